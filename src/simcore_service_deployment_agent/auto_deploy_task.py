@@ -3,13 +3,14 @@ import contextlib
 import copy
 import json
 import logging
+import os
 import tempfile
 from asyncio import create_task
 from asyncio.exceptions import CancelledError
 from contextlib import suppress
 from pathlib import Path
 from shutil import copy2
-from typing import Any
+from typing import Any, Optional
 
 import yaml
 from aiohttp import ClientError, ClientSession, web
@@ -23,9 +24,14 @@ from tenacity.stop import stop_after_attempt
 from tenacity.wait import wait_fixed
 from yarl import URL
 
-from . import portainer
+from . import portainer, subprocess_utils
 from .app_state import State
-from .docker_registries_watcher import DockerRegistriesWatcher
+from .compose_config import load_compose_config
+from .docker_registries_watcher import (
+    DockerRegistriesWatcher,
+    get_image_registry,
+    get_registry_name,
+)
 from .exceptions import (
     ConfigurationError,
     DependencyNotReadyError,
@@ -34,13 +40,21 @@ from .exceptions import (
 from .git_url_watcher import GitRepo, GitUrlWatcher, RepoID
 from .models import ComposeSpecsDict, ServiceName, VolumeName
 from .notifier import notify, notify_state
+from .polling_scheduler import PollingPolicy, PollingScheduler
+from .stack_cache import RecipeFile, StackBuildCache, compute_stack_key
 from .subprocess_utils import shell_command_async
-from .subtask import SubTask
 
 log = logging.getLogger(__name__)
 
 TASK_NAME = f"{__name__}_autodeploy_task"
 TASK_SESSION_NAME = f"{__name__}session"
+TASK_WAKEUP_NAME = f"{__name__}_wakeup"
+TASK_SCHEDULERS_NAME = f"{__name__}_schedulers"
+TASK_MAINTENANCE_NAME = f"{__name__}_maintenance"
+
+# keys of the polling schedulers
+GIT_REPOSITORIES = "git_repositories"
+DOCKER_REGISTRIES = "docker_registries"
 
 RETRY_WAIT_SECS = 2
 RETRY_COUNT = 10
@@ -144,6 +158,8 @@ async def generate_stack_file(
 
     elif dest_dir in git_repos:
         # we use one of the git repos
+        # NOTE: the copied files and the recipe outputs are cleaned in the next check
+        git_repos[dest_dir].tree_is_clean = False
         dest_dir = git_repos[dest_dir].directory
 
     file_groups_to_copy = stack_recipe_cfg["files"]
@@ -172,10 +188,24 @@ async def generate_stack_file(
     if stack_recipe_cfg["command"]:
         # The command in the stack_recipe might contain shell natives like pipes and cd
         # Thus we run it in unsafe mode as a proper shell.
-        await shell_command_async(stack_recipe_cfg["command"], cwd=dest_dir)
+        await shell_command_async(
+            stack_recipe_cfg["command"],
+            cwd=dest_dir,
+            timeout=stack_recipe_cfg.get("timeout"),
+        )
 
     stack_file = Path(dest_dir) / Path(stack_recipe_cfg["stack_file"])
 
+    if compose_cfg := stack_recipe_cfg.get("compose"):
+        # same output as docker-compose config, without spawning it
+        stack_cfg = load_compose_config(
+            [Path(dest_dir) / path for path in compose_cfg["files"]],
+            env_files=[
+                Path(dest_dir) / path for path in compose_cfg.get("env_files", [])
+            ],
+        )
+        stack_file.write_text(yaml.safe_dump(stack_cfg), encoding="utf-8")
+
     # Filesize check via https://stackoverflow.com/a/55949699
     if not stack_file.exists() or not stack_file.stat().st_size:
         raise ConfigurationError(
@@ -257,17 +287,78 @@ async def create_docker_registries_watch_subtask(
 
 
 async def create_git_watch_subtask(
-    app_config: dict[str, Any]
+    app_config: dict[str, Any], app_session: Optional[ClientSession] = None
 ) -> tuple[GitUrlWatcher, dict]:
     log.debug("creating git repo watch subtask")
-    git_sub_task = GitUrlWatcher(app_config)
+    git_sub_task = GitUrlWatcher(app_config, app_session)
     descriptions = await git_sub_task.init()
     return (git_sub_task, descriptions)
 
 
+async def _get_committed_recipe_files(
+    git_task: GitUrlWatcher, repo: GitRepo, names: list[str]
+) -> dict[str, RecipeFile]:
+    """The recipe files as of HEAD, whatever the recipe left in the working tree"""
+    backend = git_task.git_backend
+    object_ids = await backend.resolve(
+        repo.directory, *(f"HEAD:{name}" for name in names)
+    )
+    return {
+        name: RecipeFile(
+            blob_id=object_id,
+            text=await backend.read_blob(repo.directory, object_id)
+            if object_id
+            else "",
+        )
+        for name, object_id in zip(names, object_ids)
+    }
+
+
+async def _get_stack_key(app_config: dict[str, Any], git_task: GitUrlWatcher) -> str:
+    stack_recipe_cfg = app_config["main"]["docker_stack_recipe"]
+    git_repos: dict[RepoID, GitRepo] = {r.repo_id: r for r in git_task.watched_repos}
+    names: dict[RepoID, list[str]] = {}
+    for group in stack_recipe_cfg["files"]:
+        if group["id"] in git_repos:
+            names.setdefault(group["id"], []).extend(group["paths"])
+    workdir = stack_recipe_cfg["workdir"]
+    if (compose_cfg := stack_recipe_cfg.get("compose")) and workdir in git_repos:
+        # the compose files may come from the workdir repo rather than the files
+        names.setdefault(workdir, []).extend(
+            compose_cfg["files"] + compose_cfg.get("env_files", [])
+        )
+    files = {
+        repo_id: await _get_committed_recipe_files(
+            git_task, git_repos[repo_id], sorted(set(repo_names))
+        )
+        for repo_id, repo_names in names.items()
+    }
+    revisions = {
+        repo.repo_id: (await git_task.git_backend.resolve(repo.directory, "HEAD"))[0]
+        for repo in git_task.watched_repos
+    }
+    return compute_stack_key(
+        stack_recipe_cfg,
+        files,
+        revisions,
+        os.environ,
+        extra_variables=stack_recipe_cfg["cache"].get("environment", []),
+    )
+
+
 async def create_stack(
     git_task: GitUrlWatcher, app_config: dict[str, Any]
 ) -> ComposeSpecsDict:
+    stack_cache = StackBuildCache.from_config(
+        app_config["main"]["docker_stack_recipe"].get("cache")
+    )
+    stack_key = ""
+    if stack_cache:
+        stack_key = await _get_stack_key(app_config, git_task)
+        if (stack_cfg := stack_cache.get(stack_key)) is not None:
+            log.info("stack %s taken from the build cache", stack_key[:12])
+            return stack_cfg
+
     # generate the stack file
     stack_file: Path = await generate_stack_file(app_config, git_task)
     log.debug("generated stack file in %s", stack_file.name)
@@ -291,14 +382,77 @@ async def create_stack(
 
     log.debug("final stack compose specs is:")
     log.debug(json.dumps(stack_cfg, indent=4, sort_keys=True))
+    if stack_cache:
+        stack_cache.put(stack_key, stack_cfg)
     return stack_cfg
 
 
-async def check_changes(subtasks: list[SubTask]) -> dict:
-    changes = {}
-    for task in subtasks:
-        changes.update(await task.check_for_changes())
-    return changes
+class CheckRequests:
+    """Repos to check before the next polling cycle is due (e.g. pushed to)"""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+        self._repo_ids: set[RepoID] = set()
+
+    def request(self, repo_ids: list[RepoID]) -> None:
+        self._repo_ids.update(repo_ids)
+        self._event.set()
+
+    async def wait(self, timeout: float) -> Optional[set[RepoID]]:
+        """Returns the requested repos, or None if timeout expired first"""
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._event.wait(), timeout=timeout)
+        if not self._event.is_set():
+            return None
+        self._event.clear()
+        repo_ids, self._repo_ids = self._repo_ids, set()
+        return repo_ids
+
+
+def request_check(app: web.Application, repo_ids: list[RepoID]) -> None:
+    """Wakes up the auto-deploy task to check repo_ids right away"""
+    if repo_ids:
+        app[TASK_WAKEUP_NAME].request(repo_ids)
+
+
+def create_polling_schedulers(
+    app_config: dict[str, Any]
+) -> dict[str, PollingScheduler]:
+    """One scheduler for the watched git repos, one for the docker registries
+
+    Their sources are added once the subtasks are initialised
+    """
+    main_config = app_config["main"]
+    default_policy = PollingPolicy.from_main_config(main_config)
+    return {
+        GIT_REPOSITORIES: PollingScheduler(
+            default_policy,
+            {
+                config["id"]: PollingPolicy.from_config(
+                    config.get("polling"), default_policy
+                )
+                for config in main_config["watched_git_repositories"]
+            },
+        ),
+        DOCKER_REGISTRIES: PollingScheduler(
+            default_policy,
+            {
+                get_registry_name(f"{config['url']}"): PollingPolicy.from_config(
+                    config.get("polling"), default_policy
+                )
+                for config in main_config["docker_private_registries"]
+            },
+        ),
+    }
+
+
+def _seconds_until_next_poll(app: web.Application) -> float:
+    delays = [
+        delay
+        for scheduler in app[TASK_SCHEDULERS_NAME].values()
+        if (delay := scheduler.seconds_until_next_poll()) is not None
+    ]
+    return min(delays, default=app[APP_CONFIG_KEY]["main"]["polling_interval"])
 
 
 @retry(
@@ -338,11 +492,17 @@ async def _init_deploy(
         await wait_for_dependencies(app_config, app_session)
 
         # create initial stack
-        git_task, descriptions = await create_git_watch_subtask(app_config)
+        git_task, descriptions = await create_git_watch_subtask(app_config, app_session)
+        app[TASK_MAINTENANCE_NAME] = git_task.maintenance
         stack_cfg = await create_stack(git_task, app_config)
         docker_task = await create_docker_registries_watch_subtask(
             app_config, stack_cfg
         )
+        schedulers = app[TASK_SCHEDULERS_NAME]
+        schedulers[GIT_REPOSITORIES].sync(
+            repo.repo_id for repo in git_task.watched_repos
+        )
+        schedulers[DOCKER_REGISTRIES].sync(docker_task.registries)
 
         # deploy stack to swarm
         await deploy_stacks(app_config, app_session, stack_cfg)
@@ -371,8 +531,18 @@ async def _init_deploy(
 async def _deploy(
     app: web.Application, git_task: GitUrlWatcher, docker_task: DockerRegistriesWatcher
 ) -> DockerRegistriesWatcher:
+    """checks the git repos and docker registries that are due for a poll"""
     app_config = app[APP_CONFIG_KEY]
     app_session = app[TASK_SESSION_NAME]
+    schedulers = app[TASK_SCHEDULERS_NAME]
+
+    repo_ids = schedulers[GIT_REPOSITORIES].due()
+    registries = schedulers[DOCKER_REGISTRIES].due()
+    if not repo_ids and not registries:
+        return docker_task
+    if repo_ids and git_task.synced_via_tags:
+        # the tags of all the repos are compared anyway
+        repo_ids = set(schedulers[GIT_REPOSITORIES].schedules)
 
     log.info("check if stacks exist...")
     if not await stacks_exist(app_config, app_session):
@@ -394,8 +564,18 @@ async def _deploy(
         )
         log.info("initialisation completed")
 
-    log.info("Checking for changes...")
-    changes = await check_changes([git_task, docker_task])
+    log.info("Checking for changes in %s...", sorted(repo_ids) + sorted(registries))
+    changes = {}
+    if repo_ids:
+        git_changes = await git_task.check_for_changes(repo_ids)
+        schedulers[GIT_REPOSITORIES].record(repo_ids, changed=git_changes.keys())
+        changes.update(git_changes)
+    if registries:
+        docker_changes = await docker_task.check_for_changes(registries)
+        schedulers[DOCKER_REGISTRIES].record(
+            registries, changed={get_image_registry(image) for image in docker_changes}
+        )
+        changes.update(docker_changes)
     if not changes:
         log.info("--> no changes detected")
         return docker_task
@@ -403,6 +583,7 @@ async def _deploy(
 
     stack_cfg = await create_stack(git_task, app_config)
     docker_task = await create_docker_registries_watch_subtask(app_config, stack_cfg)
+    schedulers[DOCKER_REGISTRIES].sync(docker_task.registries)
 
     # deploy stack to swarm
     log.info("redeploying the stack...")
@@ -427,6 +608,8 @@ async def auto_deploy(app: web.Application):
     app_config = app[APP_CONFIG_KEY]
     app_session = app[TASK_SESSION_NAME]
     # init
+    # NOTE: the commands run by each cycle are aggregated separately
+    subprocess_utils.metrics.start_cycle()
     try:
         git_task, docker_task = await _init_deploy(app)
     except CancelledError:
@@ -443,11 +626,19 @@ async def auto_deploy(app: web.Application):
         return
 
     # loop forever to detect changes
+    # NOTE: polling is the safety net, webhooks request checks in between
     while True:
         try:
             app["state"][TASK_NAME] = State.RUNNING
+            subprocess_utils.metrics.start_cycle()
             docker_task = await _deploy(app, git_task, docker_task)
-            await asyncio.sleep(app_config["main"]["polling_interval"])
+            # NOTE: housekeeping of the clones takes at most half of the idle time
+            await git_task.run_maintenance(budget=_seconds_until_next_poll(app) / 2)
+            subprocess_utils.metrics.end_cycle()
+            if repo_ids := await app[TASK_WAKEUP_NAME].wait(
+                _seconds_until_next_poll(app)
+            ):
+                app[TASK_SCHEDULERS_NAME][GIT_REPOSITORIES].request(repo_ids)
         except asyncio.CancelledError:
             log.info("cancelling task...")
             app["state"][TASK_NAME] = State.STOPPED
@@ -477,7 +668,14 @@ async def auto_deploy(app: web.Application):
 
 
 async def background_task(app: web.Application):
+    main_config = app[APP_CONFIG_KEY]["main"]
+    subprocess_utils.configure(
+        timeout=main_config.get("subprocess_timeout"),
+        max_processes=main_config.get("subprocess_max_processes"),
+    )
     app["state"] = {TASK_NAME: State.STARTING}
+    app[TASK_WAKEUP_NAME] = CheckRequests()
+    app[TASK_SCHEDULERS_NAME] = create_polling_schedulers(app[APP_CONFIG_KEY])
     app[TASK_NAME] = create_task(auto_deploy(app))
     yield
     task = app[TASK_NAME]
@@ -14,12 +14,15 @@ Why does this file exist, and why not put this in __main__?
 
 """
 import argparse
+import asyncio
 import json
 import logging
 import os
 import sys
+from pathlib import Path
 
 from . import application, cli_config
+from .git_url_watcher import GitUrlWatcher
 
 log = logging.getLogger(__name__)
 
@@ -45,6 +48,11 @@ def create_environ(skip_system_environ=False):
 
 def setup(_parser):
     cli_config.add_cli_options(_parser)
+    _parser.add_argument(
+        "--create-bundles",
+        metavar="DIR",
+        help="Write a git bundle of each watched repository in DIR and exit",
+    )
     return _parser
 
 
@@ -66,7 +74,9 @@ def parse(args, _parser):
 
 
 def main(config=None):
-    config = parse(config, parser)
+    args = sys.argv[1:] if config is None else config
+    options, _ = parser.parse_known_args(args)
+    config = parse(args, parser)
 
     log_level = config["main"]["log_level"]
     logging.basicConfig(
@@ -77,4 +87,8 @@ def main(config=None):
 
     log.debug("We read the following configuration:")
     log.debug(json.dumps(config, indent=4, sort_keys=True))
+    if options.create_bundles:
+        # NOTE: the bundles are made from mirrors, the watcher does not clone
+        asyncio.run(GitUrlWatcher(config).create_bundles(Path(options.create_bundles)))
+        return
     application.run(config)
@@ -0,0 +1,779 @@
+""" In-process equivalent of 'docker-compose --env-file .env -f a.yml -f b.yml config'
+
+Interpolates each compose file with the project environment, merges the files
+and normalizes the result the way docker-compose 1.x does for the 3.x file
+format. A stack recipe then needs neither a shell pipeline nor the docker-compose
+binary. Options without a specific merge rule are taken from the last file
+defining them.
+
+SEE https://docs.docker.com/compose/extends/#adding-and-overriding-configuration
+SEE https://docs.docker.com/compose/environment-variables/
+SEE https://github.com/docker/compose/tree/1.29.2/compose/config
+"""
+
+import logging
+import os
+import re
+from collections.abc import Iterable, Mapping
+from functools import reduce
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import yaml
+
+from .exceptions import ConfigurationError
+from .models import ComposeSpecsDict
+
+log = logging.getLogger(__name__)
+
+Environment = Mapping[str, Optional[str]]
+
+_TOP_LEVEL_SECTIONS = ("volumes", "networks", "secrets", "configs")
+
+#
+# environment
+#
+
+_ENV_LINE_RE = re.compile(
+    r"^\s*(?:export\s+)?(?P<key>[^=\s#]+)\s*(?:=\s*(?P<value>.*?))?\s*$"
+)
+# NOTE: env files only support braced variables, as python-dotenv does
+_ENV_VARIABLE_RE = re.compile(r"\$\{(?P<name>[^}:]+)(?::-(?P<default>[^}]*))?\}")
+_DOUBLE_QUOTED_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\", '"': '"'}
+
+
+def _parse_env_value(value: str) -> tuple[str, bool]:
+    """value without its quotes or inline comment, and whether to interpolate it"""
+    if len(value) >= 2 and value[0] == value[-1] == "'":
+        return value[1:-1], False
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return (
+            re.sub(
+                r"\\(.)",
+                lambda m: _DOUBLE_QUOTED_ESCAPES.get(m.group(1), m.group(0)),
+                value[1:-1],
+            ),
+            True,
+        )
+    return re.sub(r"\s+#.*$", "", value), True
+
+
+def parse_env_file(path: Path, environ: Environment) -> dict[str, Optional[str]]:
+    """Variables of a .env file as docker-compose reads them
+
+    ${VAR} and ${VAR:-default} refer to the variables defined above in the file,
+    then to environ. A variable without '=' has no value (None)
+    """
+    values: dict[str, Optional[str]] = {}
+    for line in path.read_text(encoding="utf-8-sig").splitlines():
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        match = _ENV_LINE_RE.match(line)
+        if not match:
+            raise ConfigurationError(f"invalid line in {path}: {line!r}")
+        key, value = match.group("key"), match.group("value")
+        if value is None:
+            values[key] = None
+            continue
+        value, interpolated = _parse_env_value(value)
+        if interpolated:
+            scope = {**environ, **values}
+            value = _ENV_VARIABLE_RE.sub(
+                lambda m, scope=scope: scope.get(m.group("name"))
+                or (m.group("default") or ""),
+                value,
+            )
+        values[key] = value
+    return values
+
+
+def load_environment(
+    env_files: Iterable[Path], environ: Environment
+) -> dict[str, Optional[str]]:
+    """Project environment: the env files (later ones win) overridden by environ"""
+    environment: dict[str, Optional[str]] = {}
+    for env_file in env_files:
+        environment.update(parse_env_file(env_file, environ))
+    environment.update(environ)
+    return environment
+
+
+#
+# interpolation
+#
+
+_INTERPOLATION_RE = re.compile(
+    r"\$(?:(?P<escaped>\$)|(?P<named>[_a-zA-Z][_a-zA-Z0-9]*)"
+    r"|\{(?P<braced>[^}]*)\}|(?P<invalid>))"
+)
+_BRACED_RE = re.compile(
+    r"^(?P<name>[_a-zA-Z][_a-zA-Z0-9]*)(?:(?P<separator>:?[-?])(?P<arg>.*))?$",
+    re.DOTALL,
+)
+
+
+def interpolate(value: str, environment: Environment) -> str:
+    """Substitutes $VAR, ${VAR}, ${VAR:-default}, ${VAR-default}, ${VAR:?error}
+    and ${VAR?error} as docker-compose does, $$ is a literal $
+
+    raises ConfigurationError on invalid formats and missing required variables
+    """
+
+    def _substitute(match: re.Match) -> str:
+        if match.group("escaped"):
+            return "$"
+        name, separator, arg = match.group("named"), None, None
+        if name is None:
+            braced = _BRACED_RE.match(match.group("braced") or "")
+            if match.group("invalid") is not None or not braced:
+                raise ConfigurationError(f"Invalid interpolation format in {value!r}")
+            name, separator, arg = braced.group("name", "separator", "arg")
+        current = environment.get(name)
+        if separator == ":-":
+            return current or arg
+        if separator == "-":
+            return arg if current is None else current
+        if separator in (":?", "?") and (
+            current is None or (separator == ":?" and not current)
+        ):
+            raise ConfigurationError(
+                f"Missing mandatory value for variable {name}: {arg}"
+            )
+        if current is None:
+            log.warning(
+                "The %s variable is not set. Defaulting to a blank string.", name
+            )
+            return ""
+        return current
+
+    return _INTERPOLATION_RE.sub(_substitute, value)
+
+
+def _to_int(value: str) -> int:
+    # NOTE: octal modes, e.g. 0440
+    if re.match(r"^0[0-9]+$", value.strip()):
+        value = f"0o{value.strip()[1:]}"
+    return int(value, base=0)
+
+
+def _to_boolean(value: str) -> bool:
+    if value.lower() in ("y", "yes", "true", "on"):
+        return True
+    if value.lower() in ("n", "no", "false", "off"):
+        return False
+    raise ValueError(f"{value!r} is not a valid boolean value")
+
+
+# string values converted after interpolation, '*' matches any key
+_CONVERSIONS: dict[tuple[str, ...], Callable[[str], Any]] = {
+    ("services", "*", "cpus"): float,
+    ("services", "*", "cpu_count"): _to_int,
+    ("services", "*", "configs", "mode"): _to_int,
+    ("services", "*", "secrets", "mode"): _to_int,
+    ("services", "*", "healthcheck", "retries"): _to_int,
+    ("services", "*", "healthcheck", "disable"): _to_boolean,
+    ("services", "*", "deploy", "replicas"): _to_int,
+    ("services", "*", "deploy", "placement", "max_replicas_per_node"): _to_int,
+    ("services", "*", "deploy", "resources", "limits", "cpus"): float,
+    ("services", "*", "deploy", "update_config", "parallelism"): _to_int,
+    ("services", "*", "deploy", "update_config", "max_failure_ratio"): float,
+    ("services", "*", "deploy", "rollback_config", "parallelism"): _to_int,
+    ("services", "*", "deploy", "rollback_config", "max_failure_ratio"): float,
+    ("services", "*", "deploy", "restart_policy", "max_attempts"): _to_int,
+    ("services", "*", "mem_swappiness"): _to_int,
+    ("services", "*", "oom_kill_disable"): _to_boolean,
+    ("services", "*", "oom_score_adj"): _to_int,
+    ("services", "*", "ports", "target"): _to_int,
+    ("services", "*", "ports", "published"): _to_int,
+    ("services", "*", "scale"): _to_int,
+    ("services", "*", "ulimits", "*"): _to_int,
+    ("services", "*", "ulimits", "*", "soft"): _to_int,
+    ("services", "*", "ulimits", "*", "hard"): _to_int,
+    ("services", "*", "privileged"): _to_boolean,
+    ("services", "*", "read_only"): _to_boolean,
+    ("services", "*", "stdin_open"): _to_boolean,
+    ("services", "*", "tty"): _to_boolean,
+    ("services", "*", "volumes", "read_only"): _to_boolean,
+    ("services", "*", "volumes", "volume", "nocopy"): _to_boolean,
+    ("services", "*", "volumes", "tmpfs", "size"): _to_int,
+    ("networks", "*", "attachable"): _to_boolean,
+    ("networks", "*", "external"): _to_boolean,
+    ("networks", "*", "internal"): _to_boolean,
+    ("volumes", "*", "external"): _to_boolean,
+    ("secrets", "*", "external"): _to_boolean,
+    ("configs", "*", "external"): _to_boolean,
+}
+
+
+def _convert(path: tuple[str, ...], value: str) -> Any:
+    for pattern, converter in _CONVERSIONS.items():
+        if len(pattern) == len(path) and all(
+            expected in ("*", key) for expected, key in zip(pattern, path)
+        ):
+            try:
+                return converter(value)
+            except ValueError as err:
+                raise ConfigurationError(f"{'.'.join(path)}: {err}") from err
+    return value
+
+
+def _interpolate_recursive(
+    obj: Any, environment: Environment, path: tuple[str, ...]
+) -> Any:
+    # NOTE: as in docker-compose, list items have the path of their list
+    if isinstance(obj, str):
+        return _convert(path, interpolate(obj, environment))
+    if isinstance(obj, dict):
+        return {
+            key: _interpolate_recursive(value, environment, (*path, f"{key}"))
+            for key, value in obj.items()
+        }
+    if isinstance(obj, list):
+        return [_interpolate_recursive(item, environment, path) for item in obj]
+    return obj
+
+
+#
+# parsing of the short syntaxes
+#
+
+
+def _to_list(value: Any) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _split_kv(item: str, separator: str, no_value: Any) -> tuple[str, Any]:
+    key, found, value = f"{item}".partition(separator)
+    return key, value if found else no_value
+
+
+def parse_environment(environment: Any) -> dict[str, Any]:
+    """list of KEY=VALUE or mapping to mapping, KEY alone has no value (None)"""
+    if isinstance(environment, list):
+        return dict(_split_kv(item, "=", None) for item in environment)
+    return dict(environment or {})
+
+
+def _parse_labels(labels: Any) -> dict[str, Any]:
+    if isinstance(labels, list):
+        return dict(_split_kv(item, "=", "") for item in labels)
+    return dict(labels or {})
+
+
+def _parse_extra_hosts(extra_hosts: Any) -> dict[str, Any]:
+    if isinstance(extra_hosts, list):
+        hosts = {}
+        for line in extra_hosts:
+            host, _, address = f"{line}".partition(":")
+            hosts[host.strip()] = address.strip()
+        return hosts
+    return dict(extra_hosts or {})
+
+
+def _parse_depends_on(depends_on: Any) -> dict[str, Any]:
+    if isinstance(depends_on, list):
+        return {name: {"condition": "service_started"} for name in depends_on}
+    return dict(depends_on or {})
+
+
+def _parse_networks(networks: Any) -> dict[str, Any]:
+    if isinstance(networks, list):
+        return {name: None for name in networks}
+    return dict(networks or {})
+
+
+def _parse_references(items: Any) -> dict[str, dict[str, Any]]:
+    """secrets and configs of a service, by source"""
+    references = {}
+    for item in _to_list(items):
+        reference = {"source": item} if isinstance(item, str) else dict(item)
+        references[reference["source"]] = {
+            key: value for key, value in reference.items() if value is not None
+        }
+    return references
+
+
+def _split_port_range(value: str) -> list[str]:
+    if "-" not in value:
+        return [value]
+    start, end = value.split("-", 1)
+    return [f"{port}" for port in range(int(start), int(end) + 1)]
+
+
+def parse_ports(spec: Any) -> list[dict[str, Any]]:
+    """ports of a short (e.g. 127.0.0.1:8000-8001:80-81/udp) or long syntax
+
+    as dicts with target, published, protocol, mode and external_ip (if set)
+    """
+    if isinstance(spec, dict):
+        port = {
+            key: spec.get(key) for key in ("target", "published", "protocol", "mode")
+        }
+        return [{key: value for key, value in port.items() if value is not None}]
+
+    spec = f"{spec}"
+    spec, _, protocol = spec.partition("/")
+    parts = spec.rsplit(":", 2)
+    external_ip = parts[0] if len(parts) == 3 else None
+    published = parts[-2] if len(parts) >= 2 else ""
+    targets = _split_port_range(parts[-1])
+    publisheds: list[Optional[str]] = (
+        _split_port_range(published) if published else [None] * len(targets)
+    )
+    if len(publisheds) != len(targets):
+        raise ConfigurationError(f"Port ranges don't match in length: {spec}")
+    ports = []
+    for target, published_port in zip(targets, publisheds):
+        port = {
+            "target": int(target),
+            "published": int(published_port) if published_port else None,
+            "protocol": protocol or None,
+            "external_ip": external_ip or None,
+        }
+        ports.append({key: value for key, value in port.items() if value is not None})
+    return ports
+
+
+def _port_merge_key(port: dict[str, Any]) -> tuple:
+    return tuple(
+        port.get(key) for key in ("target", "published", "external_ip", "protocol")
+    )
+
+
+def _port_legacy_repr(port: dict[str, Any]) -> str:
+    external_ip = port.get("external_ip")
+    published = port.get("published")
+    return "".join(
+        [
+            f"{external_ip}:" if external_ip else "",
+            f"{published}" if published is not None else "",
+            ":" if published is not None or external_ip else "",
+            f"{port['target']}/{port.get('protocol') or 'tcp'}",
+        ]
+    )
+
+
+def _split_path_mapping(volume: Any) -> tuple[str, Any]:
+    """container path and (host path, mode), the dict itself for a long syntax"""
+    if isinstance(volume, dict):
+        return volume.get("target"), volume
+    if ":" not in volume:
+        return volume, None
+    host, container = volume.split(":", 1)
+    mode = None
+    if ":" in container:
+        container, mode = container.rsplit(":", 1)
+    return container, (host, mode)
+
+
+def _join_path_mapping(container: str, host: Any) -> Any:
+    if isinstance(host, dict):
+        return host
+    if host is None:
+        return container
+    host_path, mode = host
+    return f"{host_path}:{container}" + (f":{mode}" if mode else "")
+
+
+def _volume_repr(volume: str) -> str:
+    parts = volume.split(":")
+    if len(parts) > 3:
+        raise ConfigurationError(f"Volume {volume} has incorrect format")
+    if len(parts) == 1:
+        return os.path.normpath(parts[0])
+    mode = parts[2] if len(parts) == 3 else "rw"
+    return f"{os.path.normpath(parts[0])}:{os.path.normpath(parts[1])}:{mode}"
+
+
+#
+# merge
+#
+
+
+def _unique_sorted(base: Any, override: Any) -> list[str]:
+    return sorted({f"{item}" for item in _to_list(base) + _to_list(override)})
+
+
+class _MergeDict(dict):
+    """Merge of the options of a base and an override mapping"""
+
+    def __init__(self, base: Optional[dict], override: Optional[dict]):
+        super().__init__()
+        self.base = base or {}
+        self.override = override or {}
+
+    def needs_merge(self, field: str) -> bool:
+        return field in self.base or field in self.override
+
+    def merge_field(self, field: str, merge_func: Callable, default: Any = None):
+        if self.needs_merge(field):
+            self[field] = merge_func(
+                self.base.get(field, default), self.override.get(field, default)
+            )
+
+    def merge_mapping(self, field: str, parse_func: Callable = dict):
+        if self.needs_merge(field):
+            self[field] = {
+                **parse_func(self.base.get(field) or {}),
+                **parse_func(self.override.get(field) or {}),
+            }
+
+    def merge_scalar(self, field: str):
+        if field in self.override:
+            self[field] = self.override[field]
+        elif field in self.base:
+            self[field] = self.base[field]
+
+
+def _merge_path_mappings(base: Any, override: Any) -> list:
+    mappings = dict(_split_path_mapping(volume) for volume in _to_list(base))
+    mappings.update(_split_path_mapping(volume) for volume in _to_list(override))
+    return [_join_path_mapping(c, h) for c, h in sorted(mappings.items())]
+
+
+def _merge_ports(base: Any, override: Any) -> list[dict[str, Any]]:
+    ports = {
+        _port_merge_key(port): port
+        for spec in _to_list(base) + _to_list(override)
+        for port in parse_ports(spec)
+    }
+    return sorted(ports.values(), key=lambda port: port["target"])
+
+
+def _merge_networks(base: Any, override: Any) -> dict[str, Any]:
+    base, override = _parse_networks(base), _parse_networks(override)
+    merged = {}
+    for name in {**base, **override}:
+        md = _MergeDict(base.get(name), override.get(name))
+        md.merge_field("aliases", _unique_sorted, [])
+        md.merge_field("link_local_ips", _unique_sorted, [])
+        for field in ("priority", "ipv4_address", "ipv6_address"):
+            md.merge_scalar(field)
+        merged[name] = dict(md)
+    return merged
+
+
+def _merge_logging(base: Any, override: Any) -> dict[str, Any]:
+    md = _MergeDict(base, override)
+    md.merge_scalar("driver")
+    if md.get("driver") == md.base.get("driver") or md.base.get("driver") is None:
+        md.merge_mapping("options")
+    elif md.override.get("options"):
+        md["options"] = md.override["options"]
+    return dict(md)
+
+
+def _merge_healthchecks(base: Any, override: Any) -> dict[str, Any]:
+    if (override or {}).get("disable") is True:
+        return dict(override)
+    return {**(base or {}), **(override or {})}
+
+
+def _merge_deploy(base: Any, override: Any) -> dict[str, Any]:
+    md = _MergeDict(base, override)
+    for field in ("mode", "endpoint_mode", "replicas"):
+        md.merge_scalar(field)
+    md.merge_mapping("labels", _parse_labels)
+    for field in ("update_config", "rollback_config", "restart_policy"):
+        md.merge_mapping(field)
+    if md.needs_merge("resources"):
+        resources = _MergeDict(md.base.get("resources"), md.override.get("resources"))
+        resources.merge_mapping("limits")
+        resources.merge_mapping("reservations")
+        md["resources"] = dict(resources)
+    if md.needs_merge("placement"):
+        placement = _MergeDict(md.base.get("placement"), md.override.get("placement"))
+        placement.merge_scalar("max_replicas_per_node")
+        placement.merge_field("constraints", _unique_sorted, [])
+        placement.merge_field(
+            "preferences",
+            lambda b, o: b + [p for p in o if p not in b],
+            [],
+        )
+        md["placement"] = dict(placement)
+    return dict(md)
+
+
+def _merge_build(base: Any, override: Any) -> dict[str, Any]:
+    def _to_dict(build: Any) -> dict[str, Any]:
+        return {"context": build} if isinstance(build, str) else dict(build or {})
+
+    md = _MergeDict(_to_dict(base), _to_dict(override))
+    md.merge_mapping("args", parse_environment)
+    md.merge_mapping("labels", _parse_labels)
+    md.merge_field("cache_from", _unique_sorted, [])
+    for field in set(md.base) | set(md.override):
+        if field not in md:
+            md.merge_scalar(field)
+    return dict(md)
+
+
+def merge_services(base: dict[str, Any], override: dict[str, Any]) -> dict[str, Any]:
+    """Merges the options of a service defined in two files"""
+    md = _MergeDict(base, override)
+    md.merge_mapping("environment", parse_environment)
+    md.merge_mapping("labels", _parse_labels)
+    md.merge_mapping("ulimits")
+    md.merge_mapping("sysctls", _parse_labels)
+    md.merge_mapping("depends_on", _parse_depends_on)
+    md.merge_mapping("storage_opt")
+    md.merge_mapping("extra_hosts", _parse_extra_hosts)
+    for field in ("secrets", "configs"):
+        md.merge_field(
+            field,
+            lambda b, o: [*{**_parse_references(b), **_parse_references(o)}.values()],
+        )
+    for field in ("links", "security_opt"):
+        md.merge_field(field, _unique_sorted, [])
+    md.merge_field("networks", _merge_networks, {})
+    for field in ("volumes", "devices"):
+        md.merge_field(field, _merge_path_mappings)
+    for field in (
+        "cap_add",
+        "cap_drop",
+        "expose",
+        "external_links",
+        "volumes_from",
+        "device_cgroup_rules",
+    ):
+        md.merge_field(field, _unique_sorted, [])
+    for field in ("dns", "dns_search", "env_file", "tmpfs"):
+        md.merge_field(field, lambda b, o: _to_list(b) + _to_list(o))
+    md.merge_field("logging", _merge_logging, {})
+    md.merge_field("ports", _merge_ports, [])
+    md.merge_field("healthcheck", _merge_healthchecks, {})
+    md.merge_field("deploy", _merge_deploy, {})
+    md.merge_field("build", _merge_build)
+    for field in set(base) | set(override):
+        if field not in md:
+            md.merge_scalar(field)
+    return dict(md)
+
+
+#
+# normalization
+#
+
+
+def _expand_path(working_dir: Path, path: str) -> str:
+    return os.path.abspath(working_dir / os.path.expanduser(path))
+
+
+def _is_url(path: str) -> bool:
+    return "://" in path or path.startswith(("git@", "github.com/", "git://"))
+
+
+def _resolve_volume(working_dir: Path, volume: Any) -> Any:
+    if isinstance(volume, dict):
+        source = volume.get("source", "")
+        if volume.get("type") == "bind" and source.startswith((".", "~")):
+            return {**volume, "source": _expand_path(working_dir, source)}
+        return volume
+    container, host = _split_path_mapping(volume)
+    if host is None:
+        return container
+    host_path, mode = host
+    if host_path.startswith("."):
+        host_path = _expand_path(working_dir, host_path)
+    host_path = os.path.expanduser(host_path)
+    return f"{host_path}:{container}" + (f":{mode}" if mode else "")
+
+
+def _escape_dollar(obj: Any) -> Any:
+    # NOTE: docker-compose escapes the output again, $$ remains a literal $
+    if isinstance(obj, str):
+        return obj.replace("$", "$$")
+    if isinstance(obj, dict):
+        return {key: _escape_dollar(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_escape_dollar(item) for item in obj]
+    return obj
+
+
+def _resolve_environment(
+    service: dict[str, Any],
+    working_dir: Path,
+    environment: Environment,
+    environ: Environment,
+) -> dict[str, Any]:
+    """env_file contents overridden by environment, variables without value
+    are taken from the project environment"""
+    resolved: dict[str, Any] = {}
+    for env_file in _to_list(service.get("env_file")):
+        env_path = Path(_expand_path(working_dir, env_file))
+        resolved.update(parse_env_file(env_path, environ))
+    resolved.update(parse_environment(service.get("environment")))
+    return {
+        key: environment.get(key) if value is None else value
+        for key, value in resolved.items()
+    }
+
+
+def _normalize_build(
+    build: Any, working_dir: Path, environment: Environment
+) -> dict[str, Any]:
+    build = {"context": build} if isinstance(build, str) else dict(build)
+    if "context" in build and not _is_url(build["context"]):
+        build["context"] = _expand_path(working_dir, build["context"])
+    if "args" in build:
+        build["args"] = {
+            key: f"{environment.get(key) if value is None else value}"
+            for key, value in parse_environment(build["args"]).items()
+            if value is not None or environment.get(key) is not None
+        }
+    return build
+
+
+def _finalize_service(
+    service: dict[str, Any],
+    working_dir: Path,
+    version: tuple[int, int],
+    environment: Environment,
+    environ: Environment,
+) -> dict[str, Any]:
+    service = dict(service)
+    if "extends" in service:
+        raise ConfigurationError("'extends' is not supported by the 3.x file format")
+
+    if "environment" in service or "env_file" in service:
+        service["environment"] = _resolve_environment(
+            service, working_dir, environment, environ
+        )
+        service.pop("env_file", None)
+    if "build" in service:
+        service["build"] = _normalize_build(service["build"], working_dir, environment)
+    if "volumes" in service and service.get("volume_driver") is None:
+        service["volumes"] = [
+            _resolve_volume(working_dir, volume) for volume in service["volumes"]
+        ]
+    if "volumes" in service:
+        service["volumes"] = [
+            _volume_repr(volume) if isinstance(volume, str) else volume
+            for volume in service["volumes"]
+        ]
+    if "labels" in service:
+        service["labels"] = _parse_labels(service["labels"])
+    if "depends_on" in service:
+        service["depends_on"] = sorted(_parse_depends_on(service["depends_on"]))
+    for field in ("dns", "dns_search", "tmpfs"):
+        if field in service:
+            service[field] = _to_list(service[field])
+    if "ports" in service:
+        ports = [port for spec in service["ports"] for port in parse_ports(spec)]
+        service["ports"] = [
+            _port_legacy_repr(port)
+            if version < (3, 2) or port.get("external_ip")
+            else port
+            for port in ports
+        ]
+    if "networks" in service:
+        service["networks"] = _parse_networks(service["networks"])
+    for field in ("secrets", "configs"):
+        if field in service:
+            service[field] = list(_parse_references(service[field]).values())
+    return service
+
+
+def _finalize_top_level(
+    section: str, entries: dict[str, Any], working_dir: Path
+) -> dict[str, Any]:
+    finalized = {}
+    for name, entry in entries.items():
+        entry = dict(entry or {})
+        if "driver_opts" in entry:
+            entry["driver_opts"] = {
+                key: f"{value}" for key, value in entry["driver_opts"].items()
+            }
+        if section in ("secrets", "configs") and "file" in entry:
+            entry["file"] = _expand_path(working_dir, entry["file"])
+        finalized[name] = entry
+    return finalized
+
+
+def _parse_version(version: Any, path: Path) -> tuple[int, int]:
+    match = re.match(r"^(\d+)(?:\.(\d+))?$", f"{version}")
+    if not match or match.group(1) != "3":
+        raise ConfigurationError(
+            f"{path} has version {version!r}, only the 3.x compose format is supported"
+        )
+    return int(match.group(1)), int(match.group(2) or 0)
+
+
+def load_compose_config(
+    compose_files: list[Path],
+    env_files: Iterable[Path] = (),
+    environ: Optional[Environment] = None,
+) -> ComposeSpecsDict:
+    """Same as 'docker-compose --env-file <env_files> -f <compose_files> config'
+
+    Relative paths are resolved from the directory of the first compose file.
+    environ defaults to the process environment
+
+    raises ConfigurationError
+    """
+    if not compose_files:
+        raise ConfigurationError("at least one compose file is needed")
+    environ = os.environ if environ is None else environ
+    working_dir = compose_files[0].parent.resolve()
+    environment = load_environment(env_files, environ)
+
+    version: Optional[tuple[int, int]] = None
+    configs: list[dict[str, Any]] = []
+    for path in compose_files:
+        try:
+            config = yaml.safe_load(path.read_text(encoding="utf-8")) or {}
+        except (OSError, yaml.YAMLError) as err:
+            raise ConfigurationError(f"cannot load compose file {path}: {err}") from err
+        if not isinstance(config, dict):
+            raise ConfigurationError(f"{path} is not a compose file")
+        file_version = _parse_version(config.get("version"), path)
+        if version is not None and file_version != version:
+            raise ConfigurationError(
+                f"Version mismatch: {path} specifies version {config.get('version')}"
+                f" but {compose_files[0]} uses version {'.'.join(map(str, version))}"
+            )
+        version = file_version
+        configs.append(
+            {
+                section: _interpolate_recursive(
+                    config.get(section) or {}, environment, (section,)
+                )
+                for section in ("services", *_TOP_LEVEL_SECTIONS)
+            }
+        )
+    assert version  # nosec
+
+    services: dict[str, Any] = reduce(
+        lambda base, override: {
+            name: merge_services(base.get(name, {}), override.get(name, {}))
+            for name in {**base, **override}
+        },
+        (config["services"] for config in configs),
+    )
+    stack_cfg: dict[str, Any] = {
+        "version": ".".join(map(str, version)),
+        "services": {
+            name: _finalize_service(
+                service or {}, working_dir, version, environment, environ
+            )
+            for name, service in services.items()
+        },
+    }
+    for section in _TOP_LEVEL_SECTIONS:
+        entries: dict[str, Any] = {}
+        for config in configs:
+            entries.update(config[section])
+        if entries:
+            stack_cfg[section] = _finalize_top_level(section, entries, working_dir)
+    return ComposeSpecsDict(**_escape_dollar(stack_cfg))
+
+
+__all__: tuple[str, ...] = (
+    "interpolate",
+    "load_compose_config",
+    "load_environment",
+    "merge_services",
+    "parse_env_file",
+)
@@ -1,7 +1,49 @@
 import trafaret as T
 
+from .git_maintenance import MAINTENANCE_TASKS
+from .git_refs import TAG_ORDERS
 from .rest_config import schema as rest_schema
 
+# NOTE: unset intervals default to the main section's polling_interval
+polling_schema = T.Dict(
+    {
+        T.Key("min_interval", optional=True): T.Int(gte=0),
+        T.Key("max_interval", optional=True): T.Int(gte=0),
+        T.Key("backoff_factor", optional=True): T.Float(gte=1),
+        T.Key("jitter", optional=True): T.Float(gte=0, lte=1),
+    }
+)
+
+# NOTE: an interval of 0 disables the task
+maintenance_schema = T.Dict(
+    {
+        T.Key("enabled", optional=True): T.ToBool(),
+        T.Key("budget", optional=True): T.Float(gte=0),
+        T.Key("intervals", optional=True): T.Dict(
+            {T.Key(task, optional=True): T.Int(gte=0) for task in MAINTENANCE_TASKS}
+        ),
+    }
+)
+
+# NOTE: the stacks built by the recipe are cached if set
+stack_cache_schema = T.Dict(
+    {
+        "directory": T.String(),
+        T.Key("max_entries", optional=True): T.Int(gte=1),
+        T.Key("max_bytes", optional=True): T.Int(gte=0),
+        # variables the recipe uses besides the ones in its command and files
+        T.Key("environment", optional=True): T.List(T.String()),
+    }
+)
+
+# NOTE: the recipe merges these compose files in-process, as docker-compose config
+compose_recipe_schema = T.Dict(
+    {
+        "files": T.List(T.String(), min_length=1),
+        T.Key("env_files", optional=True): T.List(T.String()),
+    }
+)
+
 app_schema = T.Dict(
     {
         T.Key("host", default="0.0.0.0"): T.IP,
@@ -10,6 +52,13 @@ app_schema = T.Dict(
             "DEBUG", "WARNING", "INFO", "ERROR", "CRITICAL", "FATAL", "NOTSET"
         ),
         "synced_via_tags": T.ToBool(),
+        T.Key("git_parallelism", default=4, optional=True): T.Int(gte=1),
+        T.Key("git_cache_dir", default="", optional=True): T.String(allow_blank=True),
+        T.Key("git_sparse_checkout", default=False, optional=True): T.ToBool(),
+        T.Key("git_backend", default="cli", optional=True): T.Enum("cli", "dulwich"),
+        T.Key("git_maintenance", optional=True): maintenance_schema,
+        T.Key("subprocess_timeout", optional=True): T.Float(gte=0),
+        T.Key("subprocess_max_processes", optional=True): T.Int(gte=1),
         "watched_git_repositories": T.List(
             T.Dict(
                 {
@@ -27,7 +76,23 @@ app_schema = T.Dict(
                     T.Key("tags", default="", optional=True): T.String(
                         allow_blank=True
                     ),
+                    T.Key("tags_order", default="creatordate", optional=True): T.Enum(
+                        *TAG_ORDERS
+                    ),
                     "paths": T.List(T.String()),
+                    T.Key("polling", optional=True): polling_schema,
+                    T.Key("change_source", default="git", optional=True): T.Enum(
+                        "git", "github", "gitlab"
+                    ),
+                    T.Key("forge_api_url", default="", optional=True): T.String(
+                        allow_blank=True
+                    ),
+                    T.Key("forge_token", default="", optional=True): T.String(
+                        allow_blank=True
+                    ),
+                    T.Key("bundle", default="", optional=True): T.String(
+                        allow_blank=True
+                    ),
                 }
             ),
             min_length=1,
@@ -42,6 +107,7 @@ app_schema = T.Dict(
                     T.Key("password", optional=True, default=""): T.String(
                         allow_blank=True
                     ),
+                    T.Key("polling", optional=True): polling_schema,
                 }
             )
         ),
@@ -64,6 +130,9 @@ app_schema = T.Dict(
                 T.Key("services_prefix", default="", optional=True): T.String(
                     allow_blank=True
                 ),
+                T.Key("timeout", optional=True): T.Float(gte=0),
+                T.Key("cache", optional=True): stack_cache_schema,
+                T.Key("compose", optional=True): compose_recipe_schema,
             }
         ),
         "portainer": T.List(
@@ -83,6 +152,8 @@ app_schema = T.Dict(
             min_length=1,
         ),
         "polling_interval": T.Int(gte=0),
+        T.Key("polling", optional=True): polling_schema,
+        T.Key("webhook_secret", default="", optional=True): T.String(allow_blank=True),
         T.Key("notifications", optional=True, default=[]): T.List(
             T.Dict(
                 {
@@ -1,6 +1,7 @@
 import logging
 from collections.abc import Iterator
 from contextlib import contextmanager
+from typing import Optional
 
 from tenacity import retry
 from tenacity.after import after_log
@@ -18,6 +19,22 @@ log = logging.getLogger(__name__)
 
 NUMBER_OF_ATTEMPS = 5
 MAX_TIME_TO_WAIT_S = 10
+DEFAULT_REGISTRY = "docker.io"
+_DOCKER_HUB_HOSTS = ("docker.io", "index.docker.io", "registry-1.docker.io")
+
+
+def get_registry_name(url: str) -> str:
+    """host[:port] of a registry url, docker.io for all the docker hub aliases"""
+    host = url.split("://", 1)[-1].split("/", 1)[0]
+    return DEFAULT_REGISTRY if host in _DOCKER_HUB_HOSTS else host
+
+
+def get_image_registry(image: str) -> str:
+    """registry of an image reference, e.g. docker.io for alpine:latest"""
+    first, separator, _ = image.partition("/")
+    if separator and ("." in first or ":" in first or first == "localhost"):
+        return get_registry_name(first)
+    return DEFAULT_REGISTRY
 
 
 @contextmanager
@@ -75,16 +92,26 @@ class DockerRegistriesWatcher(SubTask):
                     repo["registry_data_attrs"] = {}
         log.debug("docker watcher initialised")
 
+    @property
+    def registries(self) -> set[str]:
+        return {get_image_registry(repo["image"]) for repo in self.watched_repos}
+
     @retry(
         reraise=True,
         stop=stop_after_attempt(NUMBER_OF_ATTEMPS),
         wait=wait_random(min=1, max=MAX_TIME_TO_WAIT_S),
         after=after_log(log, logging.DEBUG),
     )
-    async def check_for_changes(self) -> dict:
+    async def check_for_changes(self, registries: Optional[set[str]] = None) -> dict:
+        """checks only the images of registries if set"""
         changes = {}
         with docker_client(self.private_registries) as client:
             for repo in self.watched_repos:
+                if (
+                    registries is not None
+                    and get_image_registry(repo["image"]) not in registries
+                ):
+                    continue
                 try:
                     registry_data = client.images.get_registry_data(repo["image"])
                     if (
@@ -34,6 +34,14 @@ class CmdLineError(AutoDeployAgentException):
         self.error_msg = error_msg
 
 
+class CmdTimeoutError(CmdLineError):
+    """Command line killed after running for longer than its timeout"""
+
+    def __init__(self, cmd, timeout):
+        super().__init__(cmd, f"killed after {timeout}s")
+        self.timeout = timeout
+
+
 class ConfigurationError(AutoDeployAgentException):
     """Wrong configuration error"""
 
@@ -46,3 +54,17 @@ class DependencyNotReadyError(AutoDeployAgentException):
 
     def __init__(self, msg):
         super().__init__(msg)
+
+
+class WebhookError(AutoDeployAgentException):
+    """Invalid or unverifiable webhook delivery"""
+
+    def __init__(self, msg):
+        super().__init__(msg)
+
+
+class ForgeAPIError(AutoDeployAgentException):
+    """Error while querying the REST API of a git forge"""
+
+    def __init__(self, msg):
+        super().__init__(msg)
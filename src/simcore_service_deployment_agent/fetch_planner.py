@@ -0,0 +1,196 @@
+""" Narrows the fetches of a watched repo to the refs the agent can act on
+
+i.e. its branch and the tags matching its tags regexp, instead of every tag of the
+remote. An anchored regexp with a literal prefix (e.g. ^staging_.+$) is fetched as
+a ref glob (refs/tags/staging_*) that git also prunes. Otherwise the matching tags
+listed by the remote are fetched one by one, and the local ones that vanished are
+deleted explicitly.
+
+A store shared by several watched entries of the same repository keeps the
+remote's ref names and fetches the union of their refspecs.
+"""
+
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import Optional
+
+from .git_refs import TAGS_PREFIX, compile_tags_regexp
+
+_REGEXP_SPECIAL_CHARS = frozenset(".^$*+?{}[]|()\\")
+_OPTIONAL_QUANTIFIERS = frozenset("*?{")
+
+
+@dataclass(frozen=True)
+class Refspec:
+    """Forced update of dst with src, both may have a single '*' glob"""
+
+    src: str
+    dst: str
+
+    def __str__(self) -> str:
+        return f"+{self.src}:{self.dst}"
+
+    @staticmethod
+    def _match(pattern: str, refname: str) -> Optional[str]:
+        """what '*' stands for in pattern, refname itself if pattern has no glob"""
+        if "*" not in pattern:
+            return refname if refname == pattern else None
+        head, tail = pattern.split("*", 1)
+        if (
+            len(refname) >= len(head) + len(tail)
+            and refname.startswith(head)
+            and refname.endswith(tail)
+        ):
+            return refname[len(head) : len(refname) - len(tail)]
+        return None
+
+    def map(self, remote_refname: str) -> Optional[str]:
+        """local ref updated with remote_refname, None if not fetched"""
+        if (match := self._match(self.src, remote_refname)) is None:
+            return None
+        return self.dst.replace("*", match) if "*" in self.dst else self.dst
+
+    def is_pruned(self, local_refname: str) -> bool:
+        """whether local_refname is deleted if the remote no longer has its source"""
+        return "*" in self.dst and self._match(self.dst, local_refname) is not None
+
+
+@dataclass(frozen=True)
+class FetchPlan:
+    refspecs: tuple[Refspec, ...]
+    # local tags that vanished from the remote and no glob refspec prunes
+    stale_tags: tuple[str, ...] = ()
+
+    def map(self, remote_refname: str) -> Optional[str]:
+        for refspec in self.refspecs:
+            if local_refname := refspec.map(remote_refname):
+                return local_refname
+        return None
+
+    def is_pruned(self, local_refname: str) -> bool:
+        return any(refspec.is_pruned(local_refname) for refspec in self.refspecs)
+
+
+def _has_top_level_alternation(regexp: str) -> bool:
+    depth = 0
+    in_class = escaped = False
+    for char in regexp:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif in_class:
+            in_class = char != "]"
+        elif char == "[":
+            in_class = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return True
+    return False
+
+
+def tags_regexp_to_prefix(regexp: str) -> Optional[str]:
+    """Literal prefix of all the tags an anchored regexp matches, None if none
+
+    e.g. '^test(staging_.+)$' -> 'test', 'staging_' (not anchored) -> None
+    """
+    if not regexp.startswith("^") or _has_top_level_alternation(regexp):
+        return None
+    prefix = ""
+    position = 1
+    while position < len(regexp):
+        char = regexp[position]
+        if char == "\\":
+            escaped = regexp[position + 1 : position + 2]
+            if not escaped or escaped.isalnum():
+                break  # a class (e.g. \d) or an anchor (e.g. \b)
+            char = escaped
+            position += 2
+        elif char in _REGEXP_SPECIAL_CHARS:
+            break
+        else:
+            position += 1
+        quantifier = regexp[position : position + 1]
+        if quantifier and quantifier in _OPTIONAL_QUANTIFIERS:
+            break  # char is optional
+        prefix += char
+        if quantifier == "+":
+            break
+    return prefix or None
+
+
+def plan_fetch(
+    branch: str,
+    tags_regexp: str,
+    remote_refs: Optional[dict[str, str]],
+    local_tags: Iterable[str] = (),
+) -> FetchPlan:
+    """refspecs fetching branch and the tags matching tags_regexp (none if blank)
+
+    remote_refs are the refs of the remote (refname -> sha) if they were listed
+    """
+    refspecs = [Refspec(f"refs/heads/{branch}", f"refs/remotes/origin/{branch}")]
+    stale_tags: list[str] = []
+    if tags_regexp:
+        prefix = tags_regexp_to_prefix(tags_regexp)
+        if prefix is None and remote_refs is not None:
+            regexp = compile_tags_regexp(tags_regexp)
+            matching_refs = {
+                refname
+                for refname in remote_refs
+                if refname.startswith(TAGS_PREFIX)
+                and regexp.search(refname[len(TAGS_PREFIX) :])
+            }
+            refspecs.extend(Refspec(ref, ref) for ref in sorted(matching_refs))
+            stale_tags = [
+                tag
+                for tag in local_tags
+                if regexp.search(tag) and f"{TAGS_PREFIX}{tag}" not in matching_refs
+            ]
+        else:
+            glob = f"{TAGS_PREFIX}{prefix or ''}*"
+            refspecs.append(Refspec(glob, glob))
+    return FetchPlan(refspecs=tuple(refspecs), stale_tags=tuple(sorted(stale_tags)))
+
+
+def plan_store_fetch(
+    watches: Iterable[tuple[str, str]],
+    remote_refs: Optional[dict[str, str]],
+    local_tags: Iterable[str] = (),
+) -> FetchPlan:
+    """refspecs of a bare store fetching every (branch, tags regexp) of watches
+
+    The refs keep the names they have on the remote (e.g. refs/heads/master)
+    """
+    local_tags = list(local_tags)
+    refspecs: dict[str, Refspec] = {}
+    stale_tags: set[str] = set()
+    for branch, tags_regexp in watches:
+        plan = plan_fetch(branch, tags_regexp, remote_refs, local_tags)
+        for refspec in plan.refspecs:
+            refspecs.setdefault(refspec.src, Refspec(refspec.src, refspec.src))
+        stale_tags.update(plan.stale_tags)
+    store_plan = FetchPlan(refspecs=tuple(refspecs[src] for src in sorted(refspecs)))
+    # NOTE: a tag another watch fetches with a glob is already pruned by git
+    return FetchPlan(
+        refspecs=store_plan.refspecs,
+        stale_tags=tuple(
+            sorted(
+                tag
+                for tag in stale_tags
+                if not store_plan.is_pruned(f"{TAGS_PREFIX}{tag}")
+            )
+        ),
+    )
+
+
+__all__: tuple[str, ...] = (
+    "FetchPlan",
+    "Refspec",
+    "plan_fetch",
+    "plan_store_fetch",
+    "tags_regexp_to_prefix",
+)
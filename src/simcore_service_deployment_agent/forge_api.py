@@ -0,0 +1,180 @@
+""" Lists the refs of GitHub and GitLab hosted repositories through their REST API
+
+Every request is conditional (If-None-Match with the ETag of the previous answer),
+unchanged refs are answered with 304 Not Modified. These do not count against the
+rate limits and are cheap for the forge, so that the refs can be polled far more
+often than with 'git ls-remote'.
+
+SEE https://docs.github.com/en/rest/using-the-rest-api/best-practices-for-using-the-rest-api#use-conditional-requests-if-appropriate
+SEE https://docs.gitlab.com/ee/api/rest/#etag
+"""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Optional
+from urllib.parse import quote
+
+from aiohttp import ClientError, ClientSession
+from yarl import URL
+
+from .exceptions import ConfigurationError, ForgeAPIError
+
+log = logging.getLogger(__name__)
+
+GITHUB_API_URL = "https://api.github.com"
+CHANGE_SOURCES = ("git", "github", "gitlab")
+
+
+@dataclass(frozen=True)
+class _CachedResponse:
+    etag: str
+    data: Any
+    next_url: Optional[URL]
+
+
+class ForgeRefsClient(ABC):
+    """Lists the branch head and tags of a project, remembering the ETags"""
+
+    def __init__(self, api_url: URL, project: str, token: str = ""):
+        self.api_url = api_url
+        self.project = project  # e.g. ITISFoundation/osparc-simcore
+        self.token = token
+        self.session: Optional[ClientSession] = None  # set by the owner
+        self._cache: dict[URL, _CachedResponse] = {}
+
+    @abstractmethod
+    def _headers(self) -> dict[str, str]:
+        ...
+
+    async def _get(self, url: URL) -> tuple[Any, Optional[URL]]:
+        """Returns the json of url and the url of the next page if any
+
+        raises ForgeAPIError
+        """
+        assert self.session  # nosec
+        headers = self._headers()
+        cached = self._cache.get(url)
+        if cached:
+            headers["If-None-Match"] = cached.etag
+        try:
+            async with self.session.get(url, headers=headers) as response:
+                if response.status == 304 and cached:
+                    return cached.data, cached.next_url
+                if response.status != 200:
+                    raise ForgeAPIError(f"GET {url} answered {response.status}")
+                data = await response.json()
+                next_link = response.links.get("next", {}).get("url")
+                next_url = URL(f"{next_link}", encoded=True) if next_link else None
+                if etag := response.headers.get("ETag"):
+                    self._cache[url] = _CachedResponse(etag, data, next_url)
+                return data, next_url
+        except (ClientError, asyncio.TimeoutError, ValueError) as err:
+            raise ForgeAPIError(f"GET {url} failed: {err!r}") from err
+
+    async def _get_all_pages(self, url: URL) -> list[Any]:
+        items: list[Any] = []
+        next_url: Optional[URL] = url
+        while next_url:
+            data, next_url = await self._get(next_url)
+            items.extend(data)
+        return items
+
+    @abstractmethod
+    async def _list_refs(self, branch: str, tags: bool) -> dict[str, str]:
+        ...
+
+    async def list_refs(self, branch: str, tags: bool) -> dict[str, str]:
+        """refname -> sha, as 'git ls-remote --heads [--tags]' limited to branch
+
+        raises ForgeAPIError
+        """
+        try:
+            return await self._list_refs(branch, tags)
+        except (KeyError, TypeError) as err:
+            raise ForgeAPIError(f"unexpected answer from {self.api_url}") from err
+
+
+class GitHubRefsClient(ForgeRefsClient):
+    """SEE https://docs.github.com/en/rest/git/refs"""
+
+    def _headers(self) -> dict[str, str]:
+        headers = {"Accept": "application/vnd.github+json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        return headers
+
+    async def _list_refs(self, branch: str, tags: bool) -> dict[str, str]:
+        base_url = f"{self.api_url}/repos/{self.project}/git"
+        data, _ = await self._get(URL(f"{base_url}/ref/heads/{branch}"))
+        refs = {data["ref"]: data["object"]["sha"]}
+        if tags:
+            # NOTE: annotated tags give the sha of the tag object, as ls-remote does
+            for item in await self._get_all_pages(
+                URL(f"{base_url}/matching-refs/tags")
+            ):
+                refs[item["ref"]] = item["object"]["sha"]
+        return refs
+
+
+class GitLabRefsClient(ForgeRefsClient):
+    """SEE https://docs.gitlab.com/ee/api/branches.html and .../tags.html"""
+
+    def _headers(self) -> dict[str, str]:
+        return {"PRIVATE-TOKEN": self.token} if self.token else {}
+
+    async def _list_refs(self, branch: str, tags: bool) -> dict[str, str]:
+        project = quote(self.project, safe="")
+        base_url = f"{self.api_url}/projects/{project}/repository"
+        data, _ = await self._get(
+            URL(f"{base_url}/branches/{quote(branch, safe='')}", encoded=True)
+        )
+        refs = {f"refs/heads/{branch}": data["commit"]["id"]}
+        if tags:
+            # NOTE: target is the sha of the tag object for annotated tags
+            for item in await self._get_all_pages(
+                URL(f"{base_url}/tags?per_page=100", encoded=True)
+            ):
+                refs[f"refs/tags/{item['name']}"] = item["target"]
+        return refs
+
+
+def create_forge_client(
+    change_source: str, repo_url: URL, api_url: str = "", token: str = ""
+) -> Optional[ForgeRefsClient]:
+    """None if the refs are listed with git itself
+
+    raises ConfigurationError
+    """
+    if change_source == "git":
+        return None
+    repo_url = URL(f"{repo_url}")
+    project = repo_url.path.strip("/")
+    if project.endswith(".git"):
+        project = project[: -len(".git")]
+    if not api_url:
+        if not repo_url.is_absolute() or repo_url.scheme not in ("http", "https"):
+            raise ConfigurationError(
+                f"forge_api_url is needed to poll {repo_url} through {change_source}"
+            )
+        if change_source == "github":
+            api_url = (
+                GITHUB_API_URL
+                if repo_url.host == "github.com"
+                else f"{repo_url.origin()}/api/v3"  # github enterprise
+            )
+        else:
+            api_url = f"{repo_url.origin()}/api/v4"
+    if change_source == "github":
+        return GitHubRefsClient(URL(api_url), project, token)
+    if change_source == "gitlab":
+        return GitLabRefsClient(URL(api_url), project, token)
+    raise ConfigurationError(f"unknown change source {change_source}")
+
+
+__all__: tuple[str, ...] = (
+    "CHANGE_SOURCES",
+    "ForgeRefsClient",
+    "create_forge_client",
+)
@@ -0,0 +1,130 @@
+""" Interface of the git operations the watcher runs on its local clones
+
+Backends either drive the git command line or work in-process on the repository.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from yarl import URL
+
+from .fetch_planner import FetchPlan
+from .git_refs import RefSnapshot
+
+
+def authenticated_url(
+    repository: URL, username: Optional[str] = None, password: Optional[str] = None
+) -> str:
+    if username != None and password != None and username != "" and password != "":
+        return f"{URL(repository).with_user(username).with_password(password)}"
+    return f"{URL(repository)}"
+
+
+class GitBackend(ABC):
+    """Git operations on a clone whose 'origin' is the watched repository (or its store)
+
+    All methods raise CmdLineError when the underlying git operation fails
+    """
+
+    @abstractmethod
+    async def clone(
+        self,
+        repository: URL,
+        directory: str,
+        branch: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> None:
+        """Clones branch of repository into directory without checking out files"""
+
+    @abstractmethod
+    async def init_store(
+        self,
+        repository: URL,
+        directory: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> None:
+        """Creates an empty bare repository in directory whose origin is repository
+
+        Its refs keep the names they have on repository (SEE plan_store_fetch)
+        """
+
+    @abstractmethod
+    async def clone_shared(self, store: str, directory: str, branch: str) -> None:
+        """Clones branch of the local store into directory borrowing its objects
+
+        i.e. git alternates: the clone's origin is the store, fetching from it
+        neither uses the network nor copies objects
+        """
+
+    @abstractmethod
+    async def ls_remote(self, directory: str, tags: bool) -> dict[str, str]:
+        """Lists the branch heads (and tags) of origin as refname -> sha"""
+
+    @abstractmethod
+    async def fetch(self, directory: str, plan: Optional[FetchPlan] = None) -> None:
+        """Fetches origin, pruning the branches and tags that vanished
+
+        Only fetches the refspecs of plan if set, everything otherwise
+        """
+
+    @abstractmethod
+    async def get_ref_snapshot(self, directory: str) -> RefSnapshot:
+        ...
+
+    @abstractmethod
+    async def resolve(self, directory: str, *names: str) -> list[Optional[str]]:
+        """Object id of each name (e.g. HEAD, tag^{tree}, rev:path), None if missing"""
+
+    @abstractmethod
+    async def clean(self, directory: str) -> None:
+        """Removes untracked and ignored files and directories"""
+
+    @abstractmethod
+    async def checkout(self, directory: str, revision: Optional[str]) -> None:
+        """Materializes the files of revision (HEAD if None) in the working tree"""
+
+    @abstractmethod
+    async def fast_forward(self, directory: str, branch: str) -> None:
+        """Fast-forwards branch and working tree to the fetched origin/<branch>
+
+        As 'git merge --ff-only', fails if branch diverged from origin
+        """
+
+    @abstractmethod
+    async def read_blob(self, directory: str, object_id: str) -> str:
+        """Content of a file object (e.g. as resolved from rev:path), as text"""
+
+    @abstractmethod
+    async def get_changelog(self, directory: str, since: str, until: str) -> str:
+        """One line per commit in since..until"""
+
+    @abstractmethod
+    async def is_ancestor(
+        self,
+        directory: str,
+        ancestor: str,
+        descendant: str,
+        plan: Optional[FetchPlan] = None,
+    ) -> bool:
+        """Whether commit ancestor is reachable from commit descendant (full shas)
+
+        A shallow clone is deepened by a bounded number of commits, only along
+        the refspecs of plan if set
+        """
+
+    async def run_maintenance(  # pylint: disable=no-self-use
+        self, directory: str, task: str  # pylint: disable=unused-argument
+    ) -> bool:
+        """Runs a housekeeping task (SEE git_maintenance), False if not supported"""
+        return False
+
+    async def close(self) -> None:
+        """Releases the resources held by the backend"""
+
+
+__all__: tuple[str, ...] = (
+    "GitBackend",
+    "authenticated_url",
+)
@@ -0,0 +1,138 @@
+""" Long-lived 'git cat-file --batch-check' process of a repository
+
+Resolves revisions (e.g. HEAD, tag^{commit}, rev:path/to/file) to object ids
+without spawning a new git process per query. Queries are pipelined: they are
+written to the process as soon as they come and answered in the same order.
+The process is a co-process of subprocess_utils: capped, timed out and recorded
+as the other git commands.
+
+SEE https://git-scm.com/docs/git-cat-file#_batch_output
+"""
+
+import asyncio
+import logging
+from asyncio.subprocess import Process
+from collections import deque
+from typing import Optional
+
+from .exceptions import CmdLineError, CmdTimeoutError
+from .subprocess_utils import CoProcess, spawn_coprocess
+
+log = logging.getLogger(__name__)
+
+_CMD = ["git", "cat-file", "--batch-check=%(objectname)"]
+
+
+class _BatchProcess:
+    """One running cat-file process and the queries it still has to answer"""
+
+    def __init__(self, coprocess: CoProcess):
+        self.coprocess = coprocess
+        self.pending: deque[tuple[str, asyncio.Future]] = deque()
+        self.reader = asyncio.create_task(self._read_answers())
+
+    @property
+    def process(self) -> Process:
+        return self.coprocess.process
+
+    @property
+    def is_alive(self) -> bool:
+        return not self.reader.done()
+
+    def submit(self, names: list[str]) -> list[asyncio.Future]:
+        # NOTE: no await between writing and queuing, so that answers keep the order
+        assert self.process.stdin  # nosec
+        loop = asyncio.get_running_loop()
+        futures = []
+        for name in names:
+            future = loop.create_future()
+            self.pending.append((name, future))
+            futures.append(future)
+        self.process.stdin.write("".join(f"{name}\n" for name in names).encode())
+        return futures
+
+    async def _read_answers(self) -> None:
+        assert self.process.stdout  # nosec
+        try:
+            while line := await self.process.stdout.readline():
+                name, future = self.pending.popleft()
+                answer = line.decode().rstrip("\n")
+                if future.done():
+                    continue
+                if answer in (f"{name} missing", f"{name} ambiguous"):
+                    future.set_result(None)
+                else:
+                    future.set_result(answer)
+        finally:
+            error = CmdLineError(_CMD, "git cat-file process terminated")
+            while self.pending:
+                _, future = self.pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
+
+    async def close(self) -> None:
+        await self.coprocess.stop()
+        await self.reader
+
+
+class GitCatFile:
+    """Resolves object names in a repository through a single git process
+
+    The process is started on the first query and restarted if it dies.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._batch: Optional[_BatchProcess] = None
+        self._start_lock = asyncio.Lock()
+
+    async def _get_batch(self) -> _BatchProcess:
+        async with self._start_lock:
+            if self._batch is None or not self._batch.is_alive:
+                if self._batch is not None:
+                    await self._batch.close()
+                self._batch = _BatchProcess(await spawn_coprocess(_CMD, self.directory))
+            return self._batch
+
+    async def resolve(self, *names: str) -> list[Optional[str]]:
+        """Returns the object id of each name, None if it does not exist
+
+        raises CmdLineError (CmdTimeoutError if the process hangs, it is then killed)
+        """
+        if any("\n" in name for name in names):
+            raise ValueError(f"object names cannot contain newlines: {names}")
+        try:
+            return await self._resolve(list(names))
+        except CmdTimeoutError:
+            await self.close()
+            raise
+        except CmdLineError:
+            # NOTE: the process died, the queries are re-sent once to a new one
+            log.warning("git cat-file in %s failed, restarting it", self.directory)
+            await self.close()
+            return await self._resolve(list(names))
+
+    async def _resolve(self, names: list[str]) -> list[Optional[str]]:
+        batch = await self._get_batch()
+        futures = batch.submit(names)
+
+        async def _round_trip() -> list[Optional[str]]:
+            assert batch.process.stdin  # nosec
+            try:
+                await batch.process.stdin.drain()
+            except (ConnectionResetError, BrokenPipeError) as err:
+                for future in futures:
+                    future.cancel()
+                raise CmdLineError(_CMD, f"{err}") from err
+            return list(await asyncio.gather(*futures))
+
+        return await batch.coprocess.exchange(_round_trip())
+
+    async def close(self) -> None:
+        async with self._start_lock:
+            if self._batch is not None:
+                await self._batch.close()
+                self._batch = None
+
+
+__all__: tuple[str, ...] = ("GitCatFile",)
@@ -0,0 +1,481 @@
+""" In-process git backend based on dulwich
+
+Runs the git operations in a thread pool instead of spawning a git process
+(and parsing its output) for each of them. The clones stay regular git
+repositories on disk.
+
+SEE https://www.dulwich.io/
+"""
+
+import asyncio
+import functools
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Optional, TypeVar
+
+from dulwich import porcelain
+from dulwich.client import get_transport_and_path
+from dulwich.errors import NotTreeError
+from dulwich.graph import can_fast_forward
+from dulwich.object_store import iter_tree_contents, peel_sha
+from dulwich.objects import Commit, Tag
+from dulwich.objectspec import parse_ref
+from dulwich.repo import Repo
+from tenacity import retry
+from tenacity.before_sleep import before_sleep_log
+from tenacity.stop import stop_after_attempt
+from tenacity.wait import wait_fixed, wait_random
+from yarl import URL
+
+from .exceptions import CmdLineError
+from .fetch_planner import FetchPlan
+from .git_backend import GitBackend, authenticated_url
+from .git_refs import RefSnapshot, RefSnapshotBuilder
+
+log = logging.getLogger(__name__)
+
+NUMBER_OF_ATTEMPS = 5
+MAX_TIME_TO_WAIT_S = 10
+SHORT_SHA_LENGTH = 7
+PEELED_SUFFIX = b"^{}"
+_LISTED_REFS = (b"refs/heads/", b"refs/remotes/", b"refs/tags/")
+
+T = TypeVar("T")
+
+
+def _peel_commit(repo: Repo, sha: bytes) -> Commit:
+    _, peeled = peel_sha(repo.object_store, sha)
+    if not isinstance(peeled, Commit):
+        raise KeyError(sha)
+    return peeled
+
+
+def _parse_revision(repo: Repo, revision: str) -> bytes:
+    """Object id of a ref name (e.g. HEAD, a tag, origin/branch) or of a full sha"""
+    name = revision.encode()
+    try:
+        return repo.refs[parse_ref(repo, name)]
+    except KeyError:
+        if len(name) == 40 and name in repo.object_store:
+            return name
+        raise
+
+
+def _resolve(repo: Repo, name: str) -> Optional[str]:
+    try:
+        if ":" in name:
+            revision, path = name.split(":", 1)
+            tree = _peel_commit(repo, _parse_revision(repo, revision)).tree
+            _, sha = repo[tree].lookup_path(
+                repo.object_store.__getitem__, path.encode()
+            )
+        elif name.endswith("^{tree}"):
+            revision = name[: -len("^{tree}")]
+            sha = _peel_commit(repo, _parse_revision(repo, revision)).tree
+        elif name.endswith("^{commit}"):
+            revision = name[: -len("^{commit}")]
+            sha = _peel_commit(repo, _parse_revision(repo, revision)).id
+        else:
+            sha = _parse_revision(repo, name)
+    except (KeyError, NotTreeError):
+        return None
+    return sha.decode()
+
+
+def _remove_empty_parents(root: bytes, path: bytes) -> None:
+    parent = os.path.dirname(path)
+    while parent and parent != root:
+        try:
+            os.rmdir(parent)
+        except OSError:
+            return
+        parent = os.path.dirname(parent)
+
+
+def _materialize(repo: Repo, commit: Commit) -> None:
+    """Makes working tree and index match the tree of commit"""
+    root = os.fsencode(repo.path)
+    tree_paths = {
+        entry.path for entry in iter_tree_contents(repo.object_store, commit.tree)
+    }
+    for path in set(repo.open_index()) - tree_paths:
+        full_path = os.path.join(root, path)
+        if os.path.lexists(full_path):
+            os.remove(full_path)
+            _remove_empty_parents(root, full_path)
+    repo.reset_index(commit.tree)
+
+
+class DulwichBackend(GitBackend):
+    """Runs git operations in-process with dulwich
+
+    Operations on the same clone are serialized, different clones run in parallel.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._repos: dict[str, Repo] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        # NOTE: objects are immutable, so are the dates of the refs pointing to them.
+        # Per clone, only the objects its refs pointed to at the last snapshot are kept
+        self._object_dates: dict[str, dict[bytes, tuple[str, str, str, str]]] = {}
+
+    def _open(self, directory: str) -> Repo:
+        if directory not in self._repos:
+            self._repos[directory] = Repo(directory)
+        return self._repos[directory]
+
+    async def _run(self, directory: str, func: Callable[..., T], *args: Any) -> T:
+        """runs func(repo, *args) in the thread pool
+
+        raises CmdLineError
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="dulwich"
+            )
+
+        def _call() -> T:
+            return func(self._open(directory), *args)
+
+        async with self._locks.setdefault(directory, asyncio.Lock()):
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._executor, _call
+                )
+            except Exception as err:  # pylint: disable=broad-except
+                raise CmdLineError(
+                    f"dulwich {func.__name__} in {directory}", f"{err!r}"
+                ) from err
+
+    @retry(
+        stop=stop_after_attempt(NUMBER_OF_ATTEMPS),
+        wait=wait_fixed(1) + wait_random(0, MAX_TIME_TO_WAIT_S),
+        before_sleep=before_sleep_log(log, logging.WARNING),
+        reraise=True,
+    )
+    async def clone(
+        self,
+        repository: URL,
+        directory: str,
+        branch: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> None:
+        def _clone() -> None:
+            # NOTE: dulwich does not support shallow clones of local repositories
+            porcelain.clone(
+                authenticated_url(repository, username, password),
+                directory,
+                checkout=False,
+                branch=branch,
+                errstream=io.BytesIO(),
+            ).close()
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, _clone)
+        except Exception as err:  # pylint: disable=broad-except
+            raise CmdLineError(f"dulwich clone {repository}", f"{err!r}") from err
+        self._repos.pop(directory, None)
+
+    async def init_store(
+        self,
+        repository: URL,
+        directory: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> None:
+        def _init_store() -> None:
+            with Repo.init_bare(directory, mkdir=not os.path.exists(directory)) as repo:
+                config = repo.get_config()
+                config.set(
+                    (b"remote", b"origin"),
+                    b"url",
+                    authenticated_url(repository, username, password),
+                )
+                config.write_to_path()
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, _init_store)
+        except Exception as err:  # pylint: disable=broad-except
+            raise CmdLineError(f"dulwich init {directory}", f"{err!r}") from err
+        self._repos.pop(directory, None)
+
+    async def clone_shared(self, store: str, directory: str, branch: str) -> None:
+        def _clone_shared() -> None:
+            with Repo(store) as store_repo:
+                sha = store_repo.refs[f"refs/heads/{branch}".encode()]
+            with Repo.init(directory, mkdir=not os.path.exists(directory)) as repo:
+                repo.object_store.add_alternate_path(
+                    os.path.join(os.path.abspath(store), "objects")
+                )
+                config = repo.get_config()
+                config.set((b"remote", b"origin"), b"url", os.path.abspath(store))
+                config.set(
+                    (b"remote", b"origin"),
+                    b"fetch",
+                    f"+refs/heads/{branch}:refs/remotes/origin/{branch}",
+                )
+                config.set((b"branch", branch.encode()), b"remote", b"origin")
+                config.set(
+                    (b"branch", branch.encode()), b"merge", f"refs/heads/{branch}"
+                )
+                config.write_to_path()
+                repo.refs[f"refs/remotes/origin/{branch}".encode()] = sha
+                repo.refs[f"refs/heads/{branch}".encode()] = sha
+                repo.refs.set_symbolic_ref(b"HEAD", f"refs/heads/{branch}".encode())
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, _clone_shared)
+        except Exception as err:  # pylint: disable=broad-except
+            raise CmdLineError(f"dulwich clone {store}", f"{err!r}") from err
+        self._repos.pop(directory, None)
+
+    async def ls_remote(self, directory: str, tags: bool) -> dict[str, str]:
+        def _ls_remote(repo: Repo) -> dict[str, str]:
+            url = repo.get_config().get((b"remote", b"origin"), b"url").decode()
+            prefixes = (b"refs/heads/", b"refs/tags/") if tags else (b"refs/heads/",)
+            return {
+                refname.decode(): sha.decode()
+                for refname, sha in porcelain.ls_remote(url).items()
+                if refname.startswith(prefixes) and not refname.endswith(PEELED_SUFFIX)
+            }
+
+        return await self._run(directory, _ls_remote)
+
+    async def fetch(self, directory: str, plan: Optional[FetchPlan] = None) -> None:
+        def _fetch_planned(repo: Repo) -> None:
+            assert plan  # nosec
+            url = repo.get_config().get((b"remote", b"origin"), b"url").decode()
+            client, path = get_transport_and_path(url)
+            wanted: dict[bytes, bytes] = {}  # local refname -> sha
+
+            def _determine_wants(
+                remote_refs: dict[bytes, bytes],
+                depth: Optional[int] = None,  # pylint: disable=unused-argument
+            ) -> list[bytes]:
+                for refname, sha in remote_refs.items():
+                    if refname.endswith(PEELED_SUFFIX):
+                        continue
+                    if local_refname := plan.map(refname.decode()):
+                        wanted[local_refname.encode()] = sha
+                return [
+                    sha for sha in set(wanted.values()) if sha not in repo.object_store
+                ]
+
+            client.fetch(path, repo, determine_wants=_determine_wants)
+            local_refs = repo.refs.as_dict()
+            for refname, sha in wanted.items():
+                if local_refs.get(refname) != sha:
+                    repo.refs[refname] = sha
+            for refname in local_refs:
+                if refname not in wanted and plan.is_pruned(refname.decode()):
+                    del repo.refs[refname]
+            for tag in plan.stale_tags:
+                del repo.refs[f"refs/tags/{tag}".encode()]
+
+        def _fetch(repo: Repo) -> None:
+            remote_refs = porcelain.fetch(
+                repo,
+                "origin",
+                outstream=io.StringIO(),
+                errstream=io.BytesIO(),
+                force=True,
+            ).refs
+            # NOTE: pruning is done here, dulwich's own fails to log ref deletions
+            expected = {
+                refname.replace(b"refs/heads/", b"refs/remotes/origin/", 1)
+                for refname in remote_refs
+            }
+            for refname in repo.refs.keys():
+                if (
+                    refname.startswith((b"refs/remotes/origin/", b"refs/tags/"))
+                    and refname != b"refs/remotes/origin/HEAD"
+                    and refname not in expected
+                ):
+                    del repo.refs[refname]
+
+        await self._run(directory, _fetch_planned if plan else _fetch)
+
+    @staticmethod
+    def _describe_object(repo: Repo, sha: bytes) -> tuple[str, str, str, str]:
+        """for-each-ref fields of the object sha points to
+
+        i.e. %(*objectname), %(*objectname:short), %(creatordate:unix) and
+        %(taggerdate:iso-strict)
+        """
+        obj, peeled = peel_sha(repo.object_store, sha)
+        peeled_sha = peeled_short_sha = taggerdate = ""
+        creatordate = 0
+        if isinstance(obj, Tag):
+            peeled_sha = peeled.id.decode()
+            peeled_short_sha = peeled_sha[:SHORT_SHA_LENGTH]
+            creatordate = obj.tag_time
+            taggerdate = datetime.fromtimestamp(
+                obj.tag_time, timezone(timedelta(seconds=obj.tag_timezone))
+            ).isoformat()
+        elif isinstance(obj, Commit):
+            creatordate = obj.commit_time
+        return (
+            peeled_sha,
+            peeled_short_sha,
+            f"{creatordate}",
+            taggerdate,
+        )
+
+    async def get_ref_snapshot(self, directory: str) -> RefSnapshot:
+        def _get_ref_snapshot(repo: Repo) -> RefSnapshot:
+            # NOTE: same lines as 'git for-each-ref --format=FOR_EACH_REF_FORMAT'
+            builder = RefSnapshotBuilder()
+            cached = self._object_dates.get(directory, {})
+            dates: dict[bytes, tuple[str, str, str, str]] = {}
+            for refname in sorted(repo.refs.allkeys()):
+                if not refname.startswith(_LISTED_REFS):
+                    continue
+                sha = repo.refs[refname]
+                if sha not in dates:
+                    dates[sha] = cached.get(sha) or self._describe_object(repo, sha)
+                (
+                    peeled_sha,
+                    peeled_short_sha,
+                    creatordate,
+                    taggerdate,
+                ) = dates[sha]
+                builder.add_line(
+                    "\t".join(
+                        [
+                            refname.decode(),
+                            sha.decode(),
+                            peeled_sha,
+                            sha.decode()[:SHORT_SHA_LENGTH],
+                            peeled_short_sha,
+                            creatordate,
+                            taggerdate,
+                        ]
+                    )
+                )
+            self._object_dates[directory] = dates
+            head = _resolve(repo, "HEAD")
+            return builder.build(head_sha=head)
+
+        return await self._run(directory, _get_ref_snapshot)
+
+    async def resolve(self, directory: str, *names: str) -> list[Optional[str]]:
+        def _resolve_all(repo: Repo) -> list[Optional[str]]:
+            return [_resolve(repo, name) for name in names]
+
+        return await self._run(directory, _resolve_all)
+
+    async def clean(self, directory: str) -> None:
+        def _clean(repo: Repo) -> None:
+            root = os.fsencode(repo.path)
+            git_dir = os.path.join(root, b".git")
+            tracked = set(repo.open_index())
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [
+                    name for name in dirnames if os.path.join(dirpath, name) != git_dir
+                ]
+                for name in filenames:
+                    full_path = os.path.join(dirpath, name)
+                    if os.path.relpath(full_path, root) not in tracked:
+                        os.remove(full_path)
+            for dirpath, _, _ in os.walk(root, topdown=False):
+                is_in_git_dir = dirpath == git_dir or dirpath.startswith(
+                    git_dir + os.sep.encode()
+                )
+                if dirpath != root and not is_in_git_dir and not os.listdir(dirpath):
+                    os.rmdir(dirpath)
+
+        await self._run(directory, _clean)
+
+    async def checkout(self, directory: str, revision: Optional[str]) -> None:
+        def _checkout(repo: Repo) -> None:
+            commit = _peel_commit(repo, _parse_revision(repo, revision or "HEAD"))
+            _materialize(repo, commit)
+            if revision and revision != "HEAD":
+                porcelain.update_head(repo, commit.id, detached=True)
+
+        await self._run(directory, _checkout)
+
+    async def fast_forward(self, directory: str, branch: str) -> None:
+        def _fast_forward(repo: Repo) -> None:
+            commit = _peel_commit(
+                repo, repo.refs[f"refs/remotes/origin/{branch}".encode()]
+            )
+            head = repo.refs[f"refs/heads/{branch}".encode()]
+            if not can_fast_forward(repo, head, commit.id):
+                raise ValueError(f"{branch} diverged from origin/{branch}")
+            _materialize(repo, commit)
+            repo.refs[f"refs/heads/{branch}".encode()] = commit.id
+            repo.refs.set_symbolic_ref(b"HEAD", f"refs/heads/{branch}".encode())
+
+        await self._run(directory, _fast_forward)
+
+    async def read_blob(self, directory: str, object_id: str) -> str:
+        def _read_blob(repo: Repo) -> str:
+            return repo[object_id.encode()].data.decode(errors="replace")
+
+        return await self._run(directory, _read_blob)
+
+    async def get_changelog(self, directory: str, since: str, until: str) -> str:
+        def _get_changelog(repo: Repo) -> str:
+            walker = repo.get_walker(
+                include=[_peel_commit(repo, _parse_revision(repo, until)).id],
+                exclude=[_peel_commit(repo, _parse_revision(repo, since)).id],
+            )
+            return "\n".join(
+                f"{entry.commit.id.decode()[:SHORT_SHA_LENGTH]} "
+                f"{entry.commit.message.decode(errors='replace').splitlines()[0]}"
+                for entry in walker
+            )
+
+        return await self._run(directory, _get_changelog)
+
+    async def is_ancestor(
+        self,
+        directory: str,
+        ancestor: str,
+        descendant: str,
+        plan: Optional[FetchPlan] = None,
+    ) -> bool:
+        # NOTE: the clones are never shallow, the plan has no history to fetch
+        def _is_ancestor(repo: Repo) -> bool:
+            return can_fast_forward(repo, ancestor.encode(), descendant.encode())
+
+        return await self._run(directory, _is_ancestor)
+
+    async def run_maintenance(self, directory: str, task: str) -> bool:
+        def _pack_loose_objects(repo: Repo) -> None:
+            repo.object_store.pack_loose_objects()
+
+        def _repack(repo: Repo) -> None:
+            repo.object_store.repack()
+
+        maintenance = {
+            "loose-objects": _pack_loose_objects,
+            "incremental-repack": _repack,
+        }.get(task)
+        if maintenance is None:
+            return False
+        await self._run(directory, maintenance)
+        return True
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            # NOTE: waits for the running calls off the event loop, the queued ones are dropped
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                functools.partial(executor.shutdown, wait=True, cancel_futures=True),
+            )
+        for repo in self._repos.values():
+            repo.close()
+        self._repos.clear()
+        self._object_dates.clear()
+
+
+__all__: tuple[str, ...] = ("DulwichBackend",)
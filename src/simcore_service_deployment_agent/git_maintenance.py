@@ -0,0 +1,165 @@
+""" Housekeeping of the long-lived clones of the git watcher
+
+The clones are fetched every minute for weeks: loose objects, packs and reflog
+entries pile up, and listing refs or fetching gets slower as the agent ages.
+The maintenance tasks (as in 'git maintenance') are run between two polls, each
+one on its own interval and all of them within a time budget.
+
+SEE https://git-scm.com/docs/git-maintenance
+"""
+
+import logging
+import time
+from collections.abc import Awaitable, Iterable
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+from .exceptions import CmdLineError
+
+log = logging.getLogger(__name__)
+
+# task -> seconds between two runs on the same clone
+DEFAULT_TASK_INTERVALS: dict[str, float] = {
+    "pack-refs": 60 * 60,
+    "commit-graph": 60 * 60,
+    "loose-objects": 60 * 60,
+    "incremental-repack": 24 * 60 * 60,
+    "reflog-expire": 24 * 60 * 60,
+    # also drops the shallow boundaries of commits that no longer exist
+    "prune": 7 * 24 * 60 * 60,
+}
+DEFAULT_BUDGET_S = 30.0
+MAINTENANCE_TASKS = tuple(DEFAULT_TASK_INTERVALS)
+
+RunTask = Callable[[str, str], Awaitable[bool]]
+
+
+@dataclass
+class TaskMetrics:
+    runs: int = 0
+    skipped: int = 0  # not supported by the backend
+    failures: int = 0
+    total_duration: float = 0.0  # seconds
+    last_duration: Optional[float] = None
+    last_run: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+    def to_dict(self) -> dict[str, Any]:
+        data = asdict(self)
+        data["last_run"] = self.last_run.isoformat() if self.last_run else None
+        return data
+
+
+class MaintenanceScheduler:
+    """Decides which maintenance task of which clone runs next, within a budget"""
+
+    def __init__(
+        self,
+        intervals: Optional[dict[str, float]] = None,
+        budget: float = DEFAULT_BUDGET_S,
+        *,
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.intervals = intervals if intervals is not None else DEFAULT_TASK_INTERVALS
+        self.budget = budget
+        self.enabled = enabled
+        self.metrics: dict[tuple[str, str], TaskMetrics] = {}  # (source, task)
+        self._next_run: dict[tuple[str, str], float] = {}
+        self._clock = clock
+
+    @classmethod
+    def from_config(
+        cls, maintenance_config: Optional[dict[str, Any]]
+    ) -> "MaintenanceScheduler":
+        """from the main config's 'git_maintenance' section"""
+        maintenance_config = maintenance_config or {}
+        return cls(
+            intervals={
+                **DEFAULT_TASK_INTERVALS,
+                **maintenance_config.get("intervals", {}),
+            },
+            budget=maintenance_config.get("budget", DEFAULT_BUDGET_S),
+            enabled=maintenance_config.get("enabled", True),
+        )
+
+    def sync(self, source_ids: Iterable[str]) -> None:
+        """Schedules the tasks of new sources one interval from now"""
+        source_ids = set(source_ids)
+        for key in self._next_run.keys() | self.metrics.keys():
+            if key[0] not in source_ids:
+                self._next_run.pop(key, None)
+                self.metrics.pop(key, None)
+        now = self._clock()
+        for source_id in source_ids:
+            for task, interval in self.intervals.items():
+                key = (source_id, task)
+                if interval > 0 and not self.metrics.get(key, TaskMetrics()).skipped:
+                    self._next_run.setdefault(key, now + interval)
+
+    def due(self) -> list[tuple[str, str]]:
+        """(source, task) that are due, the most overdue first"""
+        now = self._clock()
+        return sorted(
+            (key for key, next_run in self._next_run.items() if next_run <= now),
+            key=lambda key: (self._next_run[key], key),
+        )
+
+    async def run(self, run_task: RunTask, budget: Optional[float] = None) -> int:
+        """Runs the due tasks until the budget (seconds) is spent
+
+        run_task(source, task) returns False if the task is not supported.
+        A started task is not interrupted, the budget only decides whether the
+        next one starts. Returns the number of tasks run
+        """
+        if not self.enabled:
+            return 0
+        budget = self.budget if budget is None else min(budget, self.budget)
+        start = self._clock()
+        num_run = 0
+        for source_id, task in self.due():
+            if self._clock() - start >= budget:
+                log.debug("maintenance budget of %ss spent", budget)
+                break
+            key = (source_id, task)
+            metrics = self.metrics.setdefault(key, TaskMetrics())
+            task_start = self._clock()
+            try:
+                if not await run_task(source_id, task):
+                    metrics.skipped += 1
+                    # NOTE: never supported, not rescheduled
+                    del self._next_run[key]
+                    continue
+            except CmdLineError as err:
+                log.warning("maintenance %s of %s failed: %s", task, source_id, err)
+                metrics.failures += 1
+                metrics.last_error = f"{err}"
+            duration = self._clock() - task_start
+            metrics.runs += 1
+            metrics.total_duration += duration
+            metrics.last_duration = duration
+            metrics.last_run = datetime.now(tz=timezone.utc)
+            self._next_run[key] = self._clock() + self.intervals[task]
+            num_run += 1
+            log.debug("maintenance %s of %s took %.2fs", task, source_id, duration)
+        return num_run
+
+    def to_dict(self) -> dict[str, Any]:
+        now = self._clock()
+        sources: dict[str, dict[str, Any]] = {}
+        for key in sorted(self._next_run.keys() | self.metrics.keys()):
+            source_id, task = key
+            next_run = self._next_run.get(key)
+            sources.setdefault(source_id, {})[task] = {
+                # NOTE: None if the backend does not support the task
+                "next_run_in": None if next_run is None else max(0.0, next_run - now),
+                **self.metrics.get(key, TaskMetrics()).to_dict(),
+            }
+        return {"enabled": self.enabled, "budget": self.budget, "sources": sources}
+
+
+__all__: tuple[str, ...] = (
+    "MAINTENANCE_TASKS",
+    "MaintenanceScheduler",
+)
@@ -0,0 +1,250 @@
+""" In-memory views on the refs of a git repository
+
+Lets the watcher answer tag, sha and tag-date queries without spawning
+a git process for each of them.
+"""
+
+import re
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Optional
+
+# NOTE: refnames cannot contain control characters, so a tab is a safe separator
+FOR_EACH_REF_FORMAT = "%09".join(
+    [
+        "%(refname)",
+        "%(objectname)",
+        "%(*objectname)",
+        "%(objectname:short)",
+        "%(*objectname:short)",
+        "%(creatordate:unix)",
+        "%(taggerdate:iso-strict)",
+    ]
+)
+_NUM_FIELDS = FOR_EACH_REF_FORMAT.count("%09") + 1
+TAGS_PREFIX = "refs/tags/"
+
+# how the latest of the matching tags is decided
+TAG_ORDERS = ("creatordate", "semver", "capture_groups")
+_SEMVER_RE = re.compile(r"(\d+)\.(\d+)\.(\d+)(?:-([0-9A-Za-z.-]+))?")
+_NATURAL_CHUNKS_RE = re.compile(r"\d+|\D+")
+
+
+@dataclass(frozen=True)
+class RefInfo:
+    sha: str  # full sha of the commit the ref points to (tags are dereferenced)
+    short_sha: str
+    creatordate: int  # unix timestamp
+    taggerdate: Optional[datetime] = None  # only annotated tags have one
+
+
+@dataclass(frozen=True)
+class RefSnapshot:
+    """All refs of a repo as listed by a single 'git for-each-ref' call"""
+
+    head_sha: Optional[str] = None
+    refs: dict[str, RefInfo] = field(default_factory=dict)
+    # indices on tags
+    tags: dict[str, RefInfo] = field(default_factory=dict)
+    sha_to_tags: dict[str, list[str]] = field(default_factory=dict)
+    # raw for-each-ref line of each tag, the line changes whenever its tag is moved
+    tag_lines: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_for_each_ref(
+        cls, for_each_ref_output: Optional[str], head_sha: Optional[str] = None
+    ) -> "RefSnapshot":
+        """Parses the output of 'git for-each-ref --format=FOR_EACH_REF_FORMAT'"""
+        builder = RefSnapshotBuilder()
+        for line in (for_each_ref_output or "").split("\n"):
+            builder.add_line(line)
+        return builder.build(head_sha)
+
+    def with_head(self, head_sha: str) -> "RefSnapshot":
+        return replace(self, head_sha=head_sha)
+
+    def tags_sorted_by_creatordate(self) -> list[str]:
+        # NOTE: same order as 'git tag --list --sort=creatordate' (ties sorted by name)
+        return sorted(self.tags, key=lambda tag: (self.tags[tag].creatordate, tag))
+
+
+class RefSnapshotBuilder:
+    """Builds a RefSnapshot from the lines of 'git for-each-ref' as they come
+
+    i.e. without holding the whole output of the command
+    """
+
+    def __init__(self):
+        self.refs: dict[str, RefInfo] = {}
+        self.tag_lines: dict[str, str] = {}
+
+    def add_line(self, line: str) -> None:
+        if not line:
+            return
+        fields = line.split("\t")
+        # NOTE: trailing empty fields might have been stripped
+        fields += [""] * (_NUM_FIELDS - len(fields))
+        (
+            refname,
+            sha,
+            peeled_sha,
+            short_sha,
+            peeled_short_sha,
+            creatordate,
+            taggerdate,
+        ) = fields
+        self.refs[refname] = RefInfo(
+            sha=peeled_sha or sha,
+            short_sha=peeled_short_sha or short_sha,
+            creatordate=int(creatordate or 0),
+            taggerdate=datetime.fromisoformat(taggerdate) if taggerdate else None,
+        )
+        if refname.startswith(TAGS_PREFIX):
+            self.tag_lines[line] = refname[len(TAGS_PREFIX) :]
+
+    def build(self, head_sha: Optional[str] = None) -> RefSnapshot:
+        tags: dict[str, RefInfo] = {}
+        sha_to_tags: dict[str, list[str]] = {}
+        for refname, info in self.refs.items():
+            if refname.startswith(TAGS_PREFIX):
+                tag = refname[len(TAGS_PREFIX) :]
+                tags[tag] = info
+                sha_to_tags.setdefault(info.sha, []).append(tag)
+        return RefSnapshot(
+            head_sha=head_sha,
+            refs=self.refs,
+            tags=tags,
+            sha_to_tags=sha_to_tags,
+            tag_lines=self.tag_lines,
+        )
+
+
+@lru_cache(maxsize=None)
+def compile_tags_regexp(regexp: str) -> re.Pattern:
+    return re.compile(regexp)
+
+
+def _natural_key(value: Optional[str]) -> tuple:
+    """runs of digits compare as numbers, e.g. sprint9 < sprint10"""
+    return tuple(
+        (0, int(chunk), "") if chunk.isdigit() else (1, 0, chunk)
+        for chunk in _NATURAL_CHUNKS_RE.findall(value or "")
+    )
+
+
+def semver_key(tag: str) -> tuple:
+    """Orders by the first MAJOR.MINOR.PATCH[-PRERELEASE] found in tag
+
+    Tags without version come first, a pre-release precedes its release.
+    SEE https://semver.org/#spec-item-11
+    """
+    match = _SEMVER_RE.search(tag)
+    if not match:
+        return (0,)
+    major, minor, patch, prerelease = match.groups()
+    return (
+        1,
+        int(major),
+        int(minor),
+        int(patch),
+        (0, *map(_natural_key, prerelease.split("."))) if prerelease else (1,),
+    )
+
+
+def _capture_groups_key(match: re.Match) -> tuple:
+    """Orders by the captured groups (the whole match if none), naturally sorted"""
+    return tuple(map(_natural_key, match.groups() or (match.group(0),)))
+
+
+_ORDER_KEYS: dict[str, Callable[[str, re.Match], tuple]] = {
+    "creatordate": lambda tag, match: (),
+    "semver": lambda tag, match: semver_key(tag),
+    "capture_groups": lambda tag, match: _capture_groups_key(match),
+}
+
+
+class TagIndex:
+    """Tags matching a regexp, kept sorted across snapshots
+
+    The tags are ordered by creation date (as 'git tag --sort=creatordate'), by
+    their semantic version or by their capture groups; ties by creation date.
+    Every update only matches and sorts the tags that were added or moved since
+    the previous snapshot, so that repos with thousands of tags stay cheap to poll.
+    """
+
+    def __init__(self, regexp: str, order: str = "creatordate"):
+        self.regexp = compile_tags_regexp(regexp)
+        self.order = order
+        self._order_key = _ORDER_KEYS[order]
+        self._ingested: dict[str, RefInfo] = {}
+        self._ingested_lines: dict[str, str] = {}
+        self._sorted_matching: list[tuple[tuple, str]] = []  # (sort key, tag)
+        self._sort_keys: dict[str, tuple] = {}
+        self._matching_by_sha: dict[str, list[str]] = {}
+        # first capture group of each matching tag (the tag if the regexp has none)
+        self._release_names: dict[str, Optional[str]] = {}
+
+    def _add(self, tag: str, info: RefInfo) -> None:
+        self._ingested[tag] = info
+        if match := self.regexp.search(tag):
+            sort_key = (self._order_key(tag, match), info.creatordate, tag)
+            self._sort_keys[tag] = sort_key
+            insort(self._sorted_matching, (sort_key, tag))
+            self._matching_by_sha.setdefault(info.sha, []).append(tag)
+            self._release_names[tag] = match.group(1) if self.regexp.groups else tag
+
+    def _remove(self, tag: str) -> None:
+        info = self._ingested.pop(tag)
+        tags_on_sha = self._matching_by_sha.get(info.sha)
+        if tags_on_sha and tag in tags_on_sha:
+            tags_on_sha.remove(tag)
+            if not tags_on_sha:
+                del self._matching_by_sha[info.sha]
+            del self._release_names[tag]
+            sort_key = self._sort_keys.pop(tag)
+            position = bisect_left(self._sorted_matching, (sort_key, tag))
+            del self._sorted_matching[position]
+
+    def update(self, snapshot: RefSnapshot) -> "TagIndex":
+        # NOTE: set operations on dict views run in C, only the differences are ingested
+        gone_or_moved = self._ingested_lines.keys() - snapshot.tag_lines.keys()
+        new_or_moved = snapshot.tag_lines.keys() - self._ingested_lines.keys()
+        for line in gone_or_moved:
+            self._remove(self._ingested_lines[line])
+        for line in new_or_moved:
+            tag = snapshot.tag_lines[line]
+            self._add(tag, snapshot.tags[tag])
+        self._ingested_lines = snapshot.tag_lines
+        return self
+
+    @property
+    def latest_tag(self) -> Optional[str]:
+        return self._sorted_matching[-1][1] if self._sorted_matching else None
+
+    def tags_on_sha(self, sha: Optional[str]) -> list[str]:
+        return sorted(self._matching_by_sha.get(sha or "", []))
+
+    def release_names_on_sha(self, sha: Optional[str]) -> list[str]:
+        """First capture group of the matching tags on sha, e.g. to sync repos"""
+        return [
+            name
+            for tag in self.tags_on_sha(sha)
+            if (name := self._release_names[tag]) is not None
+        ]
+
+    def __len__(self) -> int:
+        return len(self._sorted_matching)
+
+
+__all__: tuple[str, ...] = (
+    "FOR_EACH_REF_FORMAT",
+    "RefInfo",
+    "RefSnapshot",
+    "RefSnapshotBuilder",
+    "TAG_ORDERS",
+    "TagIndex",
+    "compile_tags_regexp",
+    "semver_key",
+)
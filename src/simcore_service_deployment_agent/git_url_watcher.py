@@ -1,12 +1,16 @@
+import asyncio
+import hashlib
+import itertools
 import logging
-import re
+from collections.abc import Awaitable, Iterable
 from contextlib import AsyncExitStack
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Optional, TypeVar, Union
 
 from aiofiles.tempfile import TemporaryDirectory
+from aiohttp import ClientSession, ClientTimeout
 from servicelib.file_utils import remove_directory
 from tenacity import retry
 from tenacity.after import after_log
@@ -15,17 +19,47 @@ from tenacity.stop import stop_after_attempt
 from tenacity.wait import wait_fixed, wait_random
 from yarl import URL
 
-from .exceptions import CmdLineError, ConfigurationError, TagSyncErrorException
-from .subprocess_utils import exec_command_async
+from .exceptions import (
+    CmdLineError,
+    ConfigurationError,
+    ForgeAPIError,
+    TagSyncErrorException,
+)
+from .fetch_planner import FetchPlan, plan_fetch, plan_store_fetch
+from .forge_api import ForgeRefsClient, create_forge_client
+from .git_backend import GitBackend, authenticated_url
+from .git_cat_file import GitCatFile
+from .git_dulwich_backend import DulwichBackend
+from .git_maintenance import MaintenanceScheduler
+from .git_refs import (
+    FOR_EACH_REF_FORMAT,
+    TAGS_PREFIX,
+    RefSnapshot,
+    RefSnapshotBuilder,
+    TagIndex,
+    compile_tags_regexp,
+)
+from .subprocess_utils import exec_command_async, run_process, stream_command_lines
 from .subtask import SubTask
+from .tag_sync import TagSyncResolver, TagSyncStatus
 
 log = logging.getLogger(__name__)
 
 NUMBER_OF_ATTEMPS = 5
 MAX_TIME_TO_WAIT_S = 10
+DEFAULT_GIT_PARALLELISM = 4
+ANCESTRY_CACHE_SIZE = 256  # memoized (tag, branch) pairs per repo
+# commits fetched below the cut of a shallow clone to find a tag on its branch
+# NOTE: never the whole history, a tag further down is taken as not on the branch
+DEEPEN_STEPS = (64, 512, 4096)
+FORGE_API_TIMEOUT_S = 10
+BUNDLE_SUFFIX = ".bundle"
 
 RepoID = str
 StatusStr = str
+RemoteRefs = dict[str, str]  # refname -> sha, as reported by ls-remote
+
+T = TypeVar("T")
 
 
 @dataclass(frozen=True)
@@ -58,6 +92,58 @@ class WatchedGitRepoConfig:
 
 class GitRepo(WatchedGitRepoConfig):
     directory: str = ""
+    # remote refs seen before the last fetch and before the last completed check
+    fetched_remote_refs: Optional[RemoteRefs] = None
+    checked_remote_refs: Optional[RemoteRefs] = None
+    # local refs, refreshed after every fetch
+    ref_snapshot: RefSnapshot = RefSnapshot()
+    # tags matching repo.tags, updated incrementally with every new snapshot
+    tag_index: Optional[TagIndex] = None
+    # how the latest matching tag is decided, one of TAG_ORDERS
+    tags_order: str = "creatordate"
+    # if set, partial clone that only checks out these directories (cone mode)
+    sparse_checkout_cones: Optional[list[str]] = None
+    # runs the git operations on the clone in directory
+    backend: Optional[GitBackend] = None
+    # if set, the remote refs are listed through the REST API of the forge
+    forge_client: Optional[ForgeRefsClient] = None
+    # (tag sha, branch sha) -> whether the tag is on the branch
+    ancestry_cache: Optional[dict[tuple[str, str], bool]] = None
+    # whether the working tree only has the files of HEAD (i.e. nothing to clean)
+    # NOTE: unset by whoever writes into the clone, e.g. the stack recipe
+    tree_is_clean: bool = False
+    # if set, bundle file (or directory of <repo id>.bundle) the clone starts from
+    bundle: str = ""
+    # if set, the clone borrows the objects of the store shared with other repos
+    store: Optional["SharedStore"] = None
+
+
+@dataclass
+class SharedStore:
+    """Bare repository fetched once for all the watched repos of the same url
+
+    The repos are clones of the store sharing its objects: they fetch from it
+    without network and without copying objects.
+    """
+
+    store_id: str
+    repos: list[GitRepo]
+    directory: str = ""
+    # remote refs seen before the last fetch
+    fetched_remote_refs: Optional[RemoteRefs] = None
+    ref_snapshot: RefSnapshot = RefSnapshot()
+
+
+@dataclass
+class WatcherState:
+    """What GitUrlWatcher shares across the repos and keeps between cycles"""
+
+    # NOTE: the repos watching the same url share the objects of one store
+    shared_stores: list[SharedStore] = field(default_factory=list)
+    # compares the latest tags of the repos with synced_via_tags
+    tag_sync: TagSyncResolver = field(default_factory=TagSyncResolver)
+    # queries the forges' APIs
+    session: Optional[ClientSession] = None
 
 
 @dataclass(frozen=True)
@@ -86,6 +172,36 @@ class RepoStatus:
             object.__setattr__(self, "tag_created", datetime.now(tz=timezone.utc))
 
 
+#
+# concurrency utils
+#
+
+
+async def _run_bounded(
+    coros: Iterable[Awaitable[T]], max_concurrency: int
+) -> list[Union[T, BaseException]]:
+    """Runs all coroutines with at most max_concurrency of them at a time
+
+    Results are returned in order. Exceptions are returned instead of raised
+    so that a failure in one repo does not cancel the work on the others.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _bounded(coro: Awaitable[T]) -> T:
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(
+        *(_bounded(coro) for coro in coros), return_exceptions=True
+    )
+
+
+def _raise_first_error(results: list[Union[Any, BaseException]]) -> None:
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
 #
 # git CLI utils
 #
@@ -103,72 +219,163 @@ async def _git_clone_repo(
     branch: str,
     username: Optional[str] = None,
     password: Optional[str] = None,
+    partial: bool = False,
 ):
-    if username != None and password != None and username != "" and password != "":
-        cmd = [
-            "git",
-            "clone",
-            "-n",
-            f"{URL(repository).with_user(username).with_password(password)}",
-            "--depth",
-            "1",
-            f"{directory}",
-            "--single-branch",
-            "--branch",
-            branch,
-        ]
-    else:
-        cmd = [
-            "git",
-            "clone",
-            "-n",
-            f"{URL(repository)}",
-            "--depth",
-            "1",
-            f"{directory}",
-            "--single-branch",
-            "--branch",
-            branch,
-        ]
+    cmd = [
+        "git",
+        "clone",
+        "-n",
+        authenticated_url(repository, username, password),
+        "--depth",
+        "1",
+        f"{directory}",
+        "--single-branch",
+        "--branch",
+        branch,
+    ]
+    if partial:
+        # NOTE: blobs are only downloaded when checked out
+        cmd.append("--filter=blob:none")
     await exec_command_async(cmd)
 
 
-async def _git_get_FETCH_HEAD_sha(directory: str) -> str:
-    cmd = ["git", "rev-parse", "--short", "FETCH_HEAD"]
-    sha = await exec_command_async(cmd, f"{directory}")
-    return sha
+@retry(
+    stop=stop_after_attempt(NUMBER_OF_ATTEMPS),
+    wait=wait_fixed(1) + wait_random(0, MAX_TIME_TO_WAIT_S),
+    before_sleep=before_sleep_log(log, logging.WARNING),
+    reraise=True,
+)
+async def _git_clone_mirror(
+    repository: URL,
+    directory: str,
+    branch: str,
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+):
+    cmd = [
+        "git",
+        "clone",
+        "--bare",
+        authenticated_url(repository, username, password),
+        f"{directory}",
+        "--single-branch",
+        "--branch",
+        branch,
+    ]
+    await exec_command_async(cmd)
 
 
-async def _git_get_sha_of_tag(directory: str, tag: str) -> str:
-    cmd = ["git", "rev-list", "-1", "--sparse", tag]
-    sha_long = await exec_command_async(cmd, f"{directory}")
-    cmd = ["git", "rev-parse", "--short", sha_long]
-    sha_short = await exec_command_async(cmd, f"{directory}")
-    return sha_short
+async def _git_clone_from_mirror(mirror: str, directory: str, branch: str):
+    # NOTE: --shared borrows the mirror's objects instead of copying them
+    cmd = [
+        "git",
+        "clone",
+        "-n",
+        "--shared",
+        mirror,
+        f"{directory}",
+        "--single-branch",
+        "--branch",
+        branch,
+    ]
+    await exec_command_async(cmd)
 
 
-async def _git_get_tag_created_dt(directory: str, tag: str) -> Optional[datetime]:
-    """
-    Returns tagger timestamp if exists, otherwise None
+async def _git_init_store(directory: str, url: str):
+    await exec_command_async(["git", "init", "--bare", "--quiet", f"{directory}"])
+    await exec_command_async(["git", "remote", "add", "origin", url], f"{directory}")
 
-    raises ValueError if invalid datetime format
-    """
-    date_string = await exec_command_async(
-        ["git", "for-each-ref", "--format='%(taggerdate)'", f"refs/tags/{tag}"],
+
+async def _git_clone_from_bundle(
+    bundle: str, directory: str, branch: str, bare: bool = False
+):
+    cmd = [
+        "git",
+        "clone",
+        "--bare" if bare else "-n",
+        bundle,
         f"{directory}",
-    )
+        "--single-branch",
+        "--branch",
+        branch,
+    ]
+    await exec_command_async(cmd)
+
+
+async def _git_fetch_bundle(directory: str, bundle: str):
+    """Imports the branches and tags of bundle as they are named in it"""
+    cmd = [
+        "git",
+        "fetch",
+        "--quiet",
+        bundle,
+        "+refs/heads/*:refs/heads/*",
+        "+refs/tags/*:refs/tags/*",
+    ]
+    await exec_command_async(cmd, f"{directory}")
+
+
+async def _git_create_bundle(directory: str, bundle: str):
+    # NOTE: --git-dir avoids picking up any enclosing repository
+    cmd = ["git", "--git-dir", ".", "bundle", "create", "--quiet", bundle, "--all"]
+    await exec_command_async(cmd, f"{directory}")
+
+
+async def _git_sparse_checkout_set(directory: str, cones: list[str]):
+    cmd = ["git", "sparse-checkout", "set", "--cone"] + cones
+    await exec_command_async(cmd, f"{directory}")
 
-    # NOTE:
-    #  $ tag -a test -m "Tagging <tag-name>"
-    #  $ git for-each-ref --format='%(taggerdate)' refs/tags/test
-    #    Tue Feb 28 20:34:50 2023 +0100
-    # Nonetheless, tags produced by **Github release workflow DO NOT HAVE taggerdate**
-    #
-    if date_string := date_string.strip("'\n "):
-        # e.g. Tue Feb 28 20:34:50 2023 +0100
-        date_format = "%a %b %d %H:%M:%S %Y %z"
-        return datetime.strptime(date_string, date_format)
-    return None
+
+async def _git_set_remote_url(directory: str, url: str):
+    cmd = ["git", "remote", "set-url", "origin", url]
+    await exec_command_async(cmd, f"{directory}")
+
+
+async def _git_is_valid_mirror(directory: str, branch: str) -> bool:
+    """Integrity check of a cached bare repository"""
+    # NOTE: --git-dir avoids picking up any enclosing repository
+    git = ["git", "--git-dir", "."]
+    try:
+        is_bare = await exec_command_async(
+            git + ["rev-parse", "--is-bare-repository"], directory
+        )
+        if is_bare != "true":
+            return False
+        await exec_command_async(
+            git
+            + ["rev-parse", "--verify", "--quiet", f"refs/heads/{branch}^{{commit}}"],
+            directory,
+        )
+        await exec_command_async(
+            git + ["fsck", "--connectivity-only", "--no-progress"], directory
+        )
+    except CmdLineError as err:
+        log.debug("invalid cached repository in %s: %s", directory, err)
+        return False
+    return True
+
+
+async def _git_for_each_ref(directory: str) -> RefSnapshot:
+    """Parses the refs as 'git for-each-ref' lists them, without HEAD"""
+    cmd = [
+        "git",
+        "for-each-ref",
+        f"--format={FOR_EACH_REF_FORMAT}",
+        "refs/heads",
+        "refs/remotes",
+        "refs/tags",
+    ]
+    builder = RefSnapshotBuilder()
+    async with stream_command_lines(cmd, f"{directory}") as lines:
+        async for line in lines:
+            builder.add_line(line)
+    return builder.build()
+
+
+async def _git_get_ref_snapshot(directory: str) -> RefSnapshot:
+    head_sha = await exec_command_async(["git", "rev-parse", "HEAD"], f"{directory}")
+    snapshot = await _git_for_each_ref(directory)
+    return snapshot.with_head(head_sha) if head_sha else snapshot
 
 
 async def _git_clean_repo(directory: str):
@@ -183,131 +390,248 @@ async def _git_checkout_files(directory: str, paths: list[Path], tag: Optional[s
     await exec_command_async(cmd, f"{directory}")
 
 
-async def _git_pull(directory: str):
-    cmd = ["git", "pull"]
+async def _git_merge_ff_only(directory: str, branch: str):
+    cmd = ["git", "merge", "--ff-only", "--quiet", f"origin/{branch}"]
     await exec_command_async(cmd, f"{directory}")
 
 
-async def _git_fetch(directory: str) -> Optional[str]:
+async def _git_fetch(directory: str, plan: Optional[FetchPlan] = None) -> Optional[str]:
     log.debug("Fetching git repo in %s", f"{directory=}")
-    cmd = ["git", "fetch", "--prune", "--tags", "--prune-tags"]
-    # via https://stackoverflow.com/questions/1841341/remove-local-git-tags-that-are-no-longer-on-the-remote-repository/16311126#comment91809130_16311126
-    return await exec_command_async(cmd, f"{directory}")
-
-
-async def _git_get_latest_matching_tag_capture_groups(
-    directory: str, regexp: str
-) -> Optional[tuple[str]]:
-    cmd = [
-        "git",
-        "tag",
-        "--list",
-        "--sort=creatordate",  # Sorted ascending by date
-    ]
-    all_tags = await exec_command_async(cmd, f"{directory}")
-    if all_tags == None:
-        return None
-    all_tags = all_tags.split("\n")
-    all_tags = [tag for tag in all_tags if tag != ""]
-    regexp_compiled = re.compile(regexp)
-    list_tags = [tag for tag in all_tags if re.search(regexp, tag) != None]
-    if not list_tags:
-        return None
-    if regexp_compiled.groups == 0:
-        return (list_tags[-1],)
-    re_search_result = re.search(regexp, list_tags[-1])
-    return re_search_result.groups() if re_search_result else None
-
-
-async def _git_get_latest_matching_tag(
-    directory: str, regexp: str
-) -> Optional[str]:  # pylint: disable=unsubscriptable-object
-    repo_tags_msg = await exec_command_async(
-        [
-            "git",
-            "tag",
-            "--list",
-            "--sort=creatordate",  # Sorted ascending by date
-        ],
-        f"{directory}",
+    if plan is None:
+        cmd = ["git", "fetch", "--prune", "--tags", "--prune-tags"]
+        # via https://stackoverflow.com/questions/1841341/remove-local-git-tags-that-are-no-longer-on-the-remote-repository/16311126#comment91809130_16311126
+        return await exec_command_async(cmd, f"{directory}")
+
+    # NOTE: --no-tags, the tags are only fetched through the plan's refspecs
+    cmd = ["git", "fetch", "--prune", "--no-tags", "origin"]
+    output = await exec_command_async(
+        cmd + [f"{refspec}" for refspec in plan.refspecs], f"{directory}"
     )
-    if repo_tags_msg is None:
-        return None
-    all_tags = [tag for tag in repo_tags_msg.split("\n") if tag != ""]
-    list_tags = [tag for tag in all_tags if re.search(regexp, tag) != None]
-    return list_tags[-1] if list_tags else None
-
-
-async def _git_get_current_matching_tag(repo: GitRepo) -> list[str]:
-    # NOTE: there might be several tags on the same commit
-    reg = repo.tags
-    if repo.tags.startswith("^"):
-        reg = repo.tags[1:]
-
-    all_tags_str = await exec_command_async(
-        [
-            "git",
-            "show-ref",
-            "--tags",
-            "--dereference",
-        ],
-        f"{repo.directory}",
-    )
-
-    if all_tags_str is None:
-        return []
+    if plan.stale_tags:
+        await exec_command_async(
+            ["git", "tag", "--delete", *plan.stale_tags], f"{directory}"
+        )
+    return output
 
-    all_tags = all_tags_str.split("\n")
 
-    cmd2 = ["git", "rev-parse", "HEAD"]
-    sha_to_be_found = await exec_command_async(cmd2, f"{repo.directory}")
-    sha_to_be_found = sha_to_be_found.split("\n")[0]
+async def _git_ls_remote(directory: str, tags: bool) -> RemoteRefs:
+    """Lists the branch heads (and tags) of origin
 
-    associated_tags_found = []
-    for tag in all_tags:
-        if sha_to_be_found in tag:
-            associated_tags_found.append(tag.split()[-1].split("refs/tags/")[-1])
-    found_matching_tags = []
-    for i in associated_tags_found:
-        if re.search(reg, i):
-            found_matching_tags += [i]
-    return found_matching_tags
+    Uses protocol v2 so that the server only advertises refs/heads/ and
+    refs/tags/ (e.g. no pull-request refs) instead of the full ref list.
+    """
+    cmd = ["git", "-c", "protocol.version=2", "ls-remote", "--refs", "--heads"]
+    if tags:
+        cmd.append("--tags")
+    cmd.append("origin")
+
+    remote_refs: RemoteRefs = {}
+    async with stream_command_lines(cmd, f"{directory}") as lines:
+        async for line in lines:
+            if not line:
+                continue
+            sha, refname = line.split()
+            remote_refs[refname] = sha
+    return remote_refs
 
 
-async def _git_diff_filenames(
-    directory: str,
-) -> Optional[str]:  # pylint: disable=unsubscriptable-object
-    cmd = ["git", "--no-pager", "diff", "--name-only", "FETCH_HEAD"]
-    modified_files = await exec_command_async(cmd, f"{directory}")
-    return modified_files
+async def _git_cat_blob(directory: str, object_id: str) -> str:
+    cmd = ["git", "cat-file", "blob", object_id]
+    return (await run_process(cmd, f"{directory}")).stdout
 
 
-async def _git_get_logs(
-    directory: str, branch1: str, branch2: str
-) -> Optional[str]:  # pylint: disable=unsubscriptable-object
+async def _git_get_logs(directory: str, since: str, until: str) -> Optional[str]:
     cmd = [
         "git",
         "--no-pager",
         "log",
         "--oneline",
-        f"{branch1}..origin/{branch2}",
+        f"{since}..{until}",
     ]
-    logs = await exec_command_async(cmd, f"{directory}", strip_endline=False)
+    logs = await exec_command_async(cmd, f"{directory}")
     return logs
 
 
-async def _git_get_logs_tags(
-    directory: str, tag1: Optional[str], tag2: str
-) -> Optional[str]:
-    cmd = [
+async def _git_is_ancestor(directory: str, ancestor: str, descendant: str) -> bool:
+    cmd = ["git", "merge-base", "--is-ancestor", ancestor, descendant]
+    try:
+        await exec_command_async(cmd, f"{directory}")
+    except CmdLineError as err:
+        if err.error_msg:
+            # NOTE: 'not an ancestor' exits with 1 and is silent, errors are not
+            raise
+        return False
+    return True
+
+
+async def _git_is_shallow(directory: str) -> bool:
+    cmd = ["git", "rev-parse", "--is-shallow-repository"]
+    return (await exec_command_async(cmd, f"{directory}") or "").strip() == "true"
+
+
+async def _git_deepen(directory: str, depth: int, plan: Optional[FetchPlan] = None):
+    """Fetches depth more commits of history"""
+    log.info("Fetching %s more commits of history in %s", depth, f"{directory=}")
+    history = f"--deepen={depth}"
+    if plan is None:
+        cmd = ["git", "fetch", history, "--tags"]
+        await exec_command_async(cmd, f"{directory}")
+        return
+    cmd = ["git", "fetch", history, "--no-tags", "origin"]
+    await exec_command_async(
+        cmd + [f"{refspec}" for refspec in plan.refspecs], f"{directory}"
+    )
+
+
+# NOTE: the clones borrow the objects of the mirrors and stores, never the reverse
+_MAINTENANCE_COMMANDS: dict[str, list[str]] = {
+    "pack-refs": ["git", "pack-refs", "--all", "--prune"],
+    "commit-graph": ["git", "maintenance", "run", "--task=commit-graph", "--quiet"],
+    "loose-objects": ["git", "maintenance", "run", "--task=loose-objects", "--quiet"],
+    "incremental-repack": [
         "git",
-        "--no-pager",
-        "log",
-        "--oneline",
-        f"{tag1 if tag1 else tag2}..{tag2}",
-    ]
-    logs = await exec_command_async(cmd, f"{directory}")
-    return logs
+        "maintenance",
+        "run",
+        "--task=incremental-repack",
+        "--quiet",
+    ],
+    "reflog-expire": [
+        "git",
+        "reflog",
+        "expire",
+        "--expire=7.days.ago",
+        "--expire-unreachable=now",
+        "--all",
+    ],
+    "prune": ["git", "prune", "--expire=2.weeks.ago"],
+}
+
+
+async def _git_run_maintenance(directory: str, task: str) -> bool:
+    if task not in _MAINTENANCE_COMMANDS:
+        return False
+    await exec_command_async(_MAINTENANCE_COMMANDS[task], f"{directory}")
+    return True
+
+
+class GitCLIBackend(GitBackend):
+    """Runs the git command line, object lookups share a cat-file process per clone"""
+
+    def __init__(self):
+        self._cat_files: dict[str, GitCatFile] = {}
+        # commits found unrelated to a branch after deepening, per clone
+        self._unrelated: dict[str, set[str]] = {}
+
+    async def clone(
+        self,
+        repository: URL,
+        directory: str,
+        branch: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> None:
+        await _git_clone_repo(
+            repository=repository,
+            directory=directory,
+            branch=branch,
+            username=username,
+            password=password,
+        )
+
+    async def init_store(
+        self,
+        repository: URL,
+        directory: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> None:
+        await _git_init_store(
+            directory, authenticated_url(repository, username, password)
+        )
+
+    async def clone_shared(self, store: str, directory: str, branch: str) -> None:
+        await _git_clone_from_mirror(store, directory, branch)
+
+    async def ls_remote(self, directory: str, tags: bool) -> RemoteRefs:
+        return await _git_ls_remote(directory, tags)
+
+    async def fetch(self, directory: str, plan: Optional[FetchPlan] = None) -> None:
+        await _git_fetch(directory, plan)
+
+    async def get_ref_snapshot(self, directory: str) -> RefSnapshot:
+        (head_sha,), snapshot = await asyncio.gather(
+            self._get_cat_file(directory).resolve("HEAD"),
+            _git_for_each_ref(directory),
+        )
+        return snapshot.with_head(head_sha) if head_sha else snapshot
+
+    def _get_cat_file(self, directory: str) -> GitCatFile:
+        if directory not in self._cat_files:
+            self._cat_files[directory] = GitCatFile(directory)
+        return self._cat_files[directory]
+
+    async def resolve(self, directory: str, *names: str) -> list[Optional[str]]:
+        return await self._get_cat_file(directory).resolve(*names)
+
+    async def clean(self, directory: str) -> None:
+        await _git_clean_repo(directory)
+
+    async def checkout(self, directory: str, revision: Optional[str]) -> None:
+        await _git_checkout_files(directory, [], revision)
+
+    async def fast_forward(self, directory: str, branch: str) -> None:
+        await _git_merge_ff_only(directory, branch)
+
+    async def read_blob(self, directory: str, object_id: str) -> str:
+        return await _git_cat_blob(directory, object_id)
+
+    async def get_changelog(self, directory: str, since: str, until: str) -> str:
+        return await _git_get_logs(directory, since, until) or ""
+
+    async def is_ancestor(
+        self,
+        directory: str,
+        ancestor: str,
+        descendant: str,
+        plan: Optional[FetchPlan] = None,
+    ) -> bool:
+        if await _git_is_ancestor(directory, ancestor, descendant):
+            return True
+        unrelated = self._unrelated.setdefault(directory, set())
+        if ancestor in unrelated:
+            # NOTE: its history was deepened already, a later merge comes with a fetch
+            return False
+        # NOTE: the history of a shallow clone is cut below its first commit and
+        # an older tag looks unrelated to the branch until enough history is fetched
+        for depth in DEEPEN_STEPS:
+            if not await _git_is_shallow(directory):
+                break
+            await _git_deepen(directory, depth, plan)
+            if await _git_is_ancestor(directory, ancestor, descendant):
+                return True
+        if len(unrelated) >= ANCESTRY_CACHE_SIZE:
+            unrelated.clear()
+        unrelated.add(ancestor)
+        return False
+
+    async def run_maintenance(self, directory: str, task: str) -> bool:
+        return await _git_run_maintenance(directory, task)
+
+    async def close(self) -> None:
+        await asyncio.gather(*(c.close() for c in self._cat_files.values()))
+        self._cat_files.clear()
+        self._unrelated.clear()
+
+
+def _create_git_backend(name: str, max_concurrency: int) -> GitBackend:
+    """
+    :raises ConfigurationError
+    """
+    if name == "cli":
+        return GitCLIBackend()
+    if name == "dulwich":
+        return DulwichBackend(max_workers=max_concurrency)
+    raise ConfigurationError(f"unknown git backend {name}")
 
 
 #
@@ -319,43 +643,426 @@ async def _checkout_repository(repo: GitRepo, tag: Optional[str] = None):
     """
     :raises ConfigurationError
     """
-    await _git_checkout_files(repo.directory, [], tag)
-    cmd = ["find", "."]
-    files_in_repo = (await exec_command_async(cmd, f"{repo.directory}")).split("\n")
-    are_all_files_present = sum(
-        1 for i in repo.paths if i in [i.replace("./", "") for i in files_in_repo]
-    ) == len(repo.paths)
+    await _backend(repo).checkout(repo.directory, tag)
+    if tag:
+        repo.ref_snapshot = repo.ref_snapshot.with_head(repo.ref_snapshot.tags[tag].sha)
+    # NOTE: asks git instead of walking the (possibly sparse) working tree
+    object_ids = await _backend(repo).resolve(
+        repo.directory, *(f"{tag or 'HEAD'}:{path}" for path in repo.paths)
+    )
+    are_all_files_present = all(object_ids)
     if not are_all_files_present:
         # no change affected the watched files
         raise ConfigurationError("no change affected the watched files")
 
 
 async def _pull_repository(repo: GitRepo):
-    await _git_pull(repo.directory)
+    # NOTE: the planned fetch of the cycle brought origin/<branch> already
+    await _backend(repo).fast_forward(repo.directory, repo.branch)
+    await _refresh_ref_snapshot(repo)
 
 
-async def _clone_and_checkout_repositories(
-    repos: list[GitRepo], aio_stack: AsyncExitStack, synced_via_tags: bool
-) -> dict[RepoID, RepoStatus]:
-    repo_2_status = {}
-    # Initializing repos
-    for repo in repos:
-        tmpdir: str = await aio_stack.enter_async_context(
-            TemporaryDirectory(prefix=f"{repo.repo_id}_")
+def _backend(repo: GitRepo) -> GitBackend:
+    assert repo.backend  # nosec
+    return repo.backend
+
+
+async def _refresh_ref_snapshot(repo: GitRepo) -> None:
+    _set_ref_snapshot(repo, await _backend(repo).get_ref_snapshot(repo.directory))
+
+
+def _set_ref_snapshot(repo: GitRepo, snapshot: RefSnapshot) -> None:
+    repo.ref_snapshot = snapshot
+    if repo.tags:
+        if repo.tag_index is None:
+            repo.tag_index = TagIndex(repo.tags, repo.tags_order)
+        repo.tag_index.update(snapshot)
+
+
+def _get_latest_matching_tag(repo: GitRepo) -> Optional[str]:
+    return repo.tag_index.latest_tag if repo.tag_index else None
+
+
+async def _have_watched_paths_changed(
+    repo: GitRepo, old_revision: str, new_revision: str
+) -> bool:
+    """Compares the object ids of the watched paths in both revisions
+
+    Only reads git objects, the working tree is left untouched. Without
+    watched paths, the whole trees of both revisions are compared.
+    """
+    backend = _backend(repo)
+    if not repo.paths:
+        old_tree, new_tree = await backend.resolve(
+            repo.directory, f"{old_revision}^{{tree}}", f"{new_revision}^{{tree}}"
         )
-        repo.directory = tmpdir
-        log.debug("cloning %s to %s...", repo.repo_id, repo.directory)
+        return old_tree != new_tree
+
+    object_ids = await backend.resolve(
+        repo.directory,
+        *(f"{old_revision}:{path}" for path in repo.paths),
+        *(f"{new_revision}:{path}" for path in repo.paths),
+    )
+    old_object_ids = object_ids[: len(repo.paths)]
+    new_object_ids = object_ids[len(repo.paths) :]
+    changed_paths = {
+        f"{path}"
+        for path, old_id, new_id in zip(repo.paths, old_object_ids, new_object_ids)
+        if old_id != new_id
+    }
+    if changed_paths:
+        log.info("File %s changed!!", changed_paths)
+    return bool(changed_paths)
+
+
+def _get_sparse_checkout_cones(paths: Iterable[Union[str, Path]]) -> list[str]:
+    """Directories to check out in cone mode so that all given files are present
+
+    Files at the root of the repository are always checked out in cone mode.
+    """
+    return sorted({f"{Path(path).parent}" for path in paths} - {"."})
+
+
+def _get_remote_branch_short_sha(repo: GitRepo) -> str:
+    return repo.ref_snapshot.refs[f"refs/remotes/origin/{repo.branch}"].short_sha
+
+
+async def _list_remote_refs(
+    repos: list[GitRepo], directory: str
+) -> Optional[RemoteRefs]:
+    """returns the branch heads (and tags) of the remote of repos, all with the same url
+
+    The refs are listed through the forge's API if configured, with git (in
+    directory) otherwise. None if they could not be listed
+    """
+    repo = repos[0]
+    branches = sorted({repo.branch for repo in repos})
+    tags = any(repo.tags for repo in repos)
+    if repo.forge_client:
+        try:
+            remote_refs: RemoteRefs = {}
+            for index, branch in enumerate(branches):
+                remote_refs.update(
+                    await repo.forge_client.list_refs(branch, tags and index == 0)
+                )
+            return remote_refs
+        except ForgeAPIError as err:
+            log.warning(
+                "listing refs of %s via its forge failed, using git: %s",
+                repo.repo_id,
+                err,
+            )
+    try:
+        return await _backend(repo).ls_remote(directory, tags)
+    except CmdLineError as err:
+        log.warning("listing remote refs of %s failed: %s", repo.repo_id, err)
+        return None
+
+
+def _filter_remote_refs(
+    repo: GitRepo, remote_refs: Optional[RemoteRefs]
+) -> Optional[RemoteRefs]:
+    """the remote refs this repo depends on: its branch head and matching tags"""
+    if remote_refs is None:
+        return None
+    branch_ref = f"refs/heads/{repo.branch}"
+    tags_regexp = compile_tags_regexp(repo.tags) if repo.tags else None
+    return {
+        refname: sha
+        for refname, sha in remote_refs.items()
+        if refname == branch_ref
+        or (
+            tags_regexp
+            and refname.startswith(TAGS_PREFIX)
+            and tags_regexp.search(refname[len(TAGS_PREFIX) :])
+        )
+    }
 
+
+async def _probe_remote_refs(repo: GitRepo) -> Optional[RemoteRefs]:
+    """returns the remote refs this repo depends on: its branch head and matching tags
+
+    None if they could not be listed
+    """
+    return _filter_remote_refs(repo, await _list_remote_refs([repo], repo.directory))
+
+
+def _plan_fetch(repo: GitRepo, remote_refs: Optional[RemoteRefs]) -> FetchPlan:
+    return plan_fetch(
+        repo.branch, repo.tags, remote_refs, local_tags=repo.ref_snapshot.tags
+    )
+
+
+async def _fetch_repository(repo: GitRepo, remote_refs: Optional[RemoteRefs]) -> None:
+    await _backend(repo).fetch(repo.directory, _plan_fetch(repo, remote_refs))
+    repo.fetched_remote_refs = remote_refs
+    await _refresh_ref_snapshot(repo)
+
+
+async def _fetch_store(store: SharedStore, remote_refs: Optional[RemoteRefs]) -> None:
+    """Fetches the refs of all the repos of the store at once"""
+    backend = _backend(store.repos[0])
+    plan = plan_store_fetch(
+        ((repo.branch, repo.tags) for repo in store.repos),
+        remote_refs,
+        local_tags=store.ref_snapshot.tags,
+    )
+    await backend.fetch(store.directory, plan)
+    store.fetched_remote_refs = remote_refs
+    store.ref_snapshot = await backend.get_ref_snapshot(store.directory)
+
+
+def _get_mirror_path(cache_dir: Path, repo: GitRepo) -> Path:
+    # NOTE: keyed by url and branch since mirrors are single-branch
+    key = hashlib.sha256(f"{repo.repo_url}#{repo.branch}".encode()).hexdigest()
+    return cache_dir / f"{key[:16]}.git"
+
+
+def _find_bundle(repo: GitRepo) -> Optional[Path]:
+    """the bundle to clone repo from, None if not configured or missing"""
+    if not repo.bundle:
+        return None
+    bundle = Path(repo.bundle)
+    if bundle.is_dir():
+        bundle = bundle / f"{repo.repo_id}{BUNDLE_SUFFIX}"
+    if not bundle.is_file():
+        log.warning("no bundle for %s in %s, cloning its remote", repo.repo_id, bundle)
+        return None
+    return bundle
+
+
+async def _clone_from_bundle(repo: GitRepo, directory: str, bare: bool = False) -> bool:
+    """Clones the bundle of repo and points origin to its remote
+
+    returns False if there is no bundle or it cannot be cloned
+    """
+    bundle = _find_bundle(repo)
+    if bundle is None:
+        return False
+    log.debug("cloning %s from %s...", repo.repo_id, bundle)
+    try:
+        await _git_clone_from_bundle(f"{bundle}", directory, repo.branch, bare=bare)
+        await _git_set_remote_url(
+            directory, authenticated_url(repo.repo_url, repo.username, repo.password)
+        )
+    except CmdLineError as err:
+        log.warning(
+            "cloning %s from %s failed, cloning its remote: %s",
+            repo.repo_id,
+            bundle,
+            err,
+        )
+        await remove_directory(Path(directory), ignore_errors=True)
+        return False
+    return True
+
+
+def _plan_mirror_fetch(repo: GitRepo) -> FetchPlan:
+    # NOTE: a bare clone has no fetch refspec, its branch moves only if fetched explicitly
+    return plan_store_fetch([(repo.branch, repo.tags)], None)
+
+
+async def _update_mirror(repo: GitRepo, mirror: Path) -> None:
+    """Brings the cached bare repository up-to-date, cloning it anew if missing or corrupt"""
+    url = authenticated_url(repo.repo_url, repo.username, repo.password)
+    if mirror.exists():
+        if await _git_is_valid_mirror(f"{mirror}", repo.branch):
+            try:
+                log.debug("updating cached %s in %s...", repo.repo_id, mirror)
+                await _git_set_remote_url(f"{mirror}", url)
+                await _git_fetch(f"{mirror}", _plan_mirror_fetch(repo))
+                return
+            except CmdLineError:
+                log.warning("updating cached %s failed", repo.repo_id, exc_info=True)
+        log.warning("discarding cached %s in %s", repo.repo_id, mirror)
+        await remove_directory(mirror, ignore_errors=True)
+
+    log.debug("caching %s in %s...", repo.repo_id, mirror)
+    mirror.parent.mkdir(parents=True, exist_ok=True)
+    if await _clone_from_bundle(repo, f"{mirror}", bare=True):
+        await _git_fetch(f"{mirror}", _plan_mirror_fetch(repo))
+        return
+    await _git_clone_mirror(
+        repository=repo.repo_url,
+        directory=f"{mirror}",
+        branch=repo.branch,
+        username=repo.username,
+        password=repo.password,
+    )
+
+
+def _get_store_path(cache_dir: Path, store: SharedStore) -> Path:
+    # NOTE: not keyed by branch, unlike the mirrors
+    key = hashlib.sha256(f"{store.repos[0].repo_url}".encode()).hexdigest()
+    return cache_dir / f"{key[:16]}.git"
+
+
+async def _clone_repository(repo: GitRepo, cache_dir: Optional[Path] = None) -> None:
+    log.debug("cloning %s to %s...", repo.repo_id, repo.directory)
+    if cache_dir:
+        mirror = _get_mirror_path(cache_dir, repo)
+        await _update_mirror(repo, mirror)
+        await _git_clone_from_mirror(f"{mirror}", repo.directory, repo.branch)
+        await _git_set_remote_url(
+            repo.directory,
+            authenticated_url(repo.repo_url, repo.username, repo.password),
+        )
+    elif await _clone_from_bundle(repo, repo.directory):
+        log.debug("%s cloned from its bundle, fetching the changes since", repo.repo_id)
+    elif repo.sparse_checkout_cones is not None:
         await _git_clone_repo(
             repository=repo.repo_url,
             directory=repo.directory,
             branch=repo.branch,
             username=repo.username,
             password=repo.password,
+            partial=True,
+        )
+    else:
+        await _backend(repo).clone(
+            repository=repo.repo_url,
+            directory=repo.directory,
+            branch=repo.branch,
+            username=repo.username,
+            password=repo.password,
+        )
+    if repo.sparse_checkout_cones is not None:
+        await _git_sparse_checkout_set(repo.directory, repo.sparse_checkout_cones)
+    # NOTE: probed before fetching, so that any later change shows up in the next probe
+    await _fetch_repository(repo, await _probe_remote_refs(repo))
+
+
+async def _clone_shared_repositories(
+    store: SharedStore, cache_dir: Optional[Path] = None
+) -> None:
+    """Fetches the store, then clones all its repos from it"""
+    repo = store.repos[0]
+    if (
+        cache_dir
+        and Path(store.directory).exists()
+        and await _git_is_valid_mirror(store.directory, repo.branch)
+    ):
+        log.debug("reusing cached store %s in %s", store.store_id, store.directory)
+        await _git_set_remote_url(
+            store.directory,
+            authenticated_url(repo.repo_url, repo.username, repo.password),
+        )
+    else:
+        if cache_dir:
+            await remove_directory(Path(store.directory), ignore_errors=True)
+        log.debug("creating store %s in %s...", store.store_id, store.directory)
+        await _backend(repo).init_store(
+            repository=repo.repo_url,
+            directory=store.directory,
+            username=repo.username,
+            password=repo.password,
+        )
+        for bundle in filter(None, map(_find_bundle, store.repos)):
+            # NOTE: the bundles have the same ref names as the store
+            log.debug("seeding store %s from %s...", store.store_id, bundle)
+            try:
+                await _git_fetch_bundle(store.directory, f"{bundle}")
+            except CmdLineError as err:
+                log.warning("seeding from %s failed: %s", bundle, err)
+    remote_refs = await _list_remote_refs(store.repos, store.directory)
+    await _fetch_store(store, remote_refs)
+
+    for repo in store.repos:
+        log.debug("cloning %s from %s...", repo.repo_id, store.directory)
+        await _backend(repo).clone_shared(store.directory, repo.directory, repo.branch)
+        if repo.sparse_checkout_cones is not None:
+            await _git_sparse_checkout_set(repo.directory, repo.sparse_checkout_cones)
+        await _fetch_repository(repo, _filter_remote_refs(repo, remote_refs))
+
+
+async def _checkout_latest(repo: GitRepo) -> RepoStatus:
+    """
+    :raises ConfigurationError
+    """
+    latest_tag: Optional[str] = _get_latest_matching_tag(repo)
+
+    log.debug(
+        "latest tag found for %s is %s, now checking out...",
+        repo.repo_id,
+        latest_tag,
+    )
+    if not latest_tag and repo.tags:
+        raise ConfigurationError(
+            msg=f"no tags found in {repo.repo_url}:{repo.branch} that follows defined tags pattern {repo.tags}: {latest_tag}"
+        )
+
+    # This subsequent call will checkout the files at the given revision
+    await _checkout_repository(repo, latest_tag)
+
+    log.info(
+        "repository %s checked out on %s",
+        repo,
+        latest_tag if latest_tag else "HEAD",
+    )
+
+    # If no tag: fetch head
+    # if tag: sha of tag
+    created = None
+    if repo.tags and latest_tag:
+        tag_info = repo.ref_snapshot.tags[latest_tag]
+        sha = tag_info.short_sha
+        created = tag_info.taggerdate
+    else:
+        sha = _get_remote_branch_short_sha(repo)
+
+    log.debug("sha for %s is %s at %s", repo.repo_id, sha, created)
+    repo.checked_remote_refs = repo.fetched_remote_refs
+    # NOTE: a fresh clone, whose files were all checked out
+    repo.tree_is_clean = True
+
+    return RepoStatus(
+        repo_id=repo.repo_id,
+        branch_name=repo.branch,
+        commit_sha=sha,
+        tag_name=latest_tag,
+        tag_created=created,
+    )
+
+
+async def _clone_and_checkout_repositories(
+    repos: list[GitRepo],
+    aio_stack: AsyncExitStack,
+    synced_via_tags: bool,
+    max_concurrency: int = DEFAULT_GIT_PARALLELISM,
+    cache_dir: Optional[Path] = None,
+    tag_sync: Optional[TagSyncResolver] = None,
+) -> dict[RepoID, RepoStatus]:
+    # Initializing repos
+    for repo in repos:
+        tmpdir: str = await aio_stack.enter_async_context(
+            TemporaryDirectory(prefix=f"{repo.repo_id}_")
+        )
+        repo.directory = tmpdir
+    stores = _get_shared_stores(repos)
+    for store in stores:
+        store.directory = (
+            f"{_get_store_path(cache_dir, store)}"
+            if cache_dir
+            else await aio_stack.enter_async_context(
+                TemporaryDirectory(prefix=f"{store.store_id}_")
+            )
+        )
+    # NOTE: every clone runs to completion before the first error is raised
+    _raise_first_error(
+        await _run_bounded(
+            itertools.chain(
+                (
+                    _clone_repository(repo, cache_dir)
+                    for repo in repos
+                    if repo.store is None
+                ),
+                (_clone_shared_repositories(store, cache_dir) for store in stores),
+            ),
+            max_concurrency,
         )
-        await _git_fetch(repo.directory)
+    )
 
-    # Checking tags
+    # Checking tags (only once all repos are fetched)
     if synced_via_tags:
         # Sanity check
         at_least_one_repo_has_tag_regex = any(repo.tags for repo in repos)
@@ -363,113 +1070,63 @@ async def _clone_and_checkout_repositories(
             raise ConfigurationError(
                 "At least one repo must have a tag-regex specified with tag-sync!"
             )
-        #
-        each_repo_latest_tags: list[
-            Any
-        ] = await _latest_matching_tag_capture_group_identical_for_repos(repos)
-
-        if not each_repo_latest_tags:
-            log.info("Repos did not match in their latest tag's first capture group!")
-            log.info(
-                "Latest (matching) tags per repo, displaying first regex capture group:"
-            )
-            for repo_tag_info in await _get_repos_latest_tags(repos):
-                log.info("%s: %s", repo_tag_info[0], repo_tag_info[1])
+        tag_sync_status = _resolve_tag_sync(repos, tag_sync or TagSyncResolver())
+        if not tag_sync_status.in_sync:
+            _log_tag_sync_status(tag_sync_status)
             raise TagSyncErrorException(
-                "Repos did not match in their latest tag's first capture group, but synced_via_tags is activated!"
+                "Repos did not match in their latest tag's first capture group, but synced_via_tags is activated! "
+                f"Blocking repos: {list(tag_sync_status.blocking_repo_ids)}"
             )
 
-    for repo in repos:
-        latest_tag: Optional[str] = (
-            await _git_get_latest_matching_tag(repo.directory, repo.tags)
-            if repo.tags
-            else None
-        )
-
-        log.debug(
-            "latest tag found for %s is %s, now checking out...",
-            repo.repo_id,
-            latest_tag,
-        )
-        if not latest_tag and repo.tags:
-            raise ConfigurationError(
-                msg=f"no tags found in {repo.repo_url}:{repo.branch} that follows defined tags pattern {repo.tags}: {latest_tag}"
-            )
+    results = await _run_bounded(
+        (_checkout_latest(repo) for repo in repos), max_concurrency
+    )
+    _raise_first_error(results)
+    return {repo.repo_id: status for repo, status in zip(repos, results)}
 
-        # This subsequent call will checkout the files at the given revision
-        await _checkout_repository(repo, latest_tag)
 
-        log.info(
-            "repository %s checked out on %s",
-            repo,
-            latest_tag if latest_tag else "HEAD",
-        )
+async def _is_tag_on_branch(repo: GitRepo, tag: str) -> bool:
+    """Whether tag is reachable from the fetched head of repo.branch
 
-        # If no tag: fetch head
-        # if tag: sha of tag
-        created = None
-        if repo.tags and latest_tag:
-            sha = await _git_get_sha_of_tag(repo.directory, latest_tag)
-            created = await _git_get_tag_created_dt(repo.directory, latest_tag)
-        else:
-            sha = await _git_get_FETCH_HEAD_sha(repo.directory)
+    The answer is memoized per (tag sha, branch sha): as long as neither ref
+    moves, the checks of the following cycles do not run git at all.
 
-        log.debug("sha for %s is %s at %s", repo.repo_id, sha, created)
+    raises RuntimeError if the branch or the tag do not exist
+    """
+    branch_info = repo.ref_snapshot.refs.get(f"refs/remotes/origin/{repo.branch}")
+    if branch_info is None:
+        raise RuntimeError("Branch", repo.branch, " does not exist. Aborting!")
+    tag_info = repo.ref_snapshot.tags.get(tag)
+    if tag_info is None:
+        raise RuntimeError("Tag", tag, " does not exist. Aborting!")
 
-        repo_2_status[repo.repo_id] = RepoStatus(
-            repo_id=repo.repo_id,
-            branch_name=repo.branch,
-            commit_sha=sha,
-            tag_name=latest_tag,
-            tag_created=created,
+    key = (tag_info.sha, branch_info.sha)
+    if repo.ancestry_cache is None or len(repo.ancestry_cache) >= ANCESTRY_CACHE_SIZE:
+        repo.ancestry_cache = {}
+    if key not in repo.ancestry_cache:
+        repo.ancestry_cache[key] = await _backend(repo).is_ancestor(
+            repo.directory, *key, _plan_fetch(repo, repo.fetched_remote_refs)
         )
-    return repo_2_status
+    return repo.ancestry_cache[key]
 
 
-async def _check_if_tag_on_branch(repo_path: str, branch: str, tag: str) -> bool:
-    # assert the branch exists:
-    cmd = ["git", "rev-parse", "--verify", branch]
-    try:
-        data = await exec_command_async(cmd, repo_path)
-    except CmdLineError as e:
-        raise RuntimeError("Branch", branch, " does not exist. Aborting!") from e
-    cmd = [
-        "git",
-        "log",
-        "--tags",
-        "--simplify-by-decoration",
-        '--pretty="format:%ai %d"',
-    ]
-    try:
-        data = await exec_command_async(cmd, repo_path)
-    except CmdLineError as e:
-        raise RuntimeError(
-            " ".join(cmd), "The command was invalid and the cmd call failed."
-        ) from e
-    if not data:
-        return False
-    for line in data.split("\n"):
-        if branch in line and tag in line:
-            return True
-    found_tag_in_data = sum(1 for i in data.split("\n") if tag in i) > 0
-
-    if not found_tag_in_data:
-        raise RuntimeError("Tag", tag, " does not exist. Aborting!")
-    return False
-
-
-async def _update_repo_using_tags(repo: GitRepo) -> Optional[RepoStatus]:
+async def _update_repo_using_tags(
+    repo: GitRepo, report_any_new_tag: bool = False
+) -> Optional[RepoStatus]:
     """
 
     returns RepoStatus if changes in repo detected otherwise None
+    (a new tag that leaves the watched paths unchanged is no change,
+    unless report_any_new_tag)
 
     :raises ConfigurationError
     """
 
     log.debug("checking %s using tags", repo.repo_id)
     # check if current tag is the latest and greatest
-    list_current_tags = await _git_get_current_matching_tag(repo)
-    latest_tag = await _git_get_latest_matching_tag(repo.directory, repo.tags)
+    assert repo.tag_index  # nosec
+    list_current_tags = repo.tag_index.tags_on_sha(repo.ref_snapshot.head_sha)
+    latest_tag = repo.tag_index.latest_tag
 
     # there should always be a tag
     if not latest_tag:
@@ -488,23 +1145,29 @@ async def _update_repo_using_tags(repo: GitRepo) -> Optional[RepoStatus]:
     else:
         log.info("New tag detected: %s on repo %s", latest_tag, repo.repo_id)
 
-    # get modifications
-    logged_changes = await _git_get_logs_tags(
-        repo.directory,
-        list_current_tags[0] if len(list_current_tags) > 0 else None,
-        latest_tag,
+    if log.isEnabledFor(logging.DEBUG):
+        # get modifications
+        logged_changes = await _backend(repo).get_changelog(
+            repo.directory,
+            since=list_current_tags[0] if len(list_current_tags) > 0 else latest_tag,
+            until=latest_tag,
+        )
+        log.debug("%s tag changes: %s", latest_tag, logged_changes)
+
+    # NOTE: compared before the checkout moves HEAD
+    watched_paths_changed = latest_tag not in list_current_tags and (
+        report_any_new_tag
+        or await _have_watched_paths_changed(repo, "HEAD", latest_tag)
     )
-    log.debug("%s tag changes: %s", latest_tag, logged_changes)
 
     # checkout no matter if there are changes, to put HEAD of git repo at desired latest matching tag
-    await _checkout_repository(repo, latest_tag)
-
-    # Report if code changed only
+    # NOTE: the working tree is already at the latest tag otherwise
     if latest_tag not in list_current_tags:
+        await _checkout_repository(repo, latest_tag)
         log.info("New tag %s checked out on repo %s", latest_tag, repo.repo_id)
 
-        # if the tag changed, an update is needed even if no files were changed
-        sha = await _git_get_sha_of_tag(repo.directory, latest_tag)
+    if watched_paths_changed:
+        sha = repo.ref_snapshot.tags[latest_tag].short_sha
 
         return RepoStatus(
             repo_id=repo.repo_id,
@@ -519,196 +1182,219 @@ async def _update_repo_using_tags(repo: GitRepo) -> Optional[RepoStatus]:
 async def _update_repo_using_branch_head(repo: GitRepo) -> Optional[RepoStatus]:
     """
     returns RepoStatus if changes in repo detected otherwise None
+    (the working tree follows the branch even if the watched paths did not change)
     """
-    modified_files_str = await _git_diff_filenames(repo.directory)
-    if not modified_files_str:
-        # no modifications
+    remote_branch = f"refs/remotes/origin/{repo.branch}"
+    if repo.ref_snapshot.head_sha == repo.ref_snapshot.refs[remote_branch].sha:
         return None
-    modified_files = modified_files_str.split()
-
-    # get the logs
-    logged_changes = await _git_get_logs(repo.directory, repo.branch, repo.branch)
-    log.debug("Changelog:\n%s", logged_changes)
-    await _pull_repository(repo)
 
-    # check if a watched file has changed
-    common_files = (
-        set(modified_files).intersection(set(repo.paths))
-        if repo.paths
-        else modified_files
+    # NOTE: compared before the pull moves HEAD
+    watched_paths_changed = await _have_watched_paths_changed(
+        repo, "HEAD", remote_branch
     )
-    if not common_files:
-        # no change affected the watched files
+    if watched_paths_changed and log.isEnabledFor(logging.DEBUG):
+        # get the logs
+        logged_changes = await _backend(repo).get_changelog(
+            repo.directory, since=repo.branch, until=f"origin/{repo.branch}"
+        )
+        log.debug("Changelog:\n%s", logged_changes)
+    await _pull_repository(repo)
+    if not watched_paths_changed:
+        # no change affected the watched files, nothing to redeploy
         return None
 
-    log.info("File %s changed!!", common_files)
-    sha = await _git_get_FETCH_HEAD_sha(repo.directory)
+    sha = _get_remote_branch_short_sha(repo)
     return RepoStatus(
         repo_id=repo.repo_id, commit_sha=sha, branch_name=repo.branch, tag_name=None
     )
 
 
-async def _git_sha_of_tag(repo_path: str, tag: str) -> str:
-    cmd = ["git", "rev-list", "-n", "1", tag]
-    try:
-        data = await exec_command_async(cmd, repo_path)
-    except CmdLineError as e:
-        raise RuntimeError(
-            " ".join(cmd), "The command was invalid and the cmd call failed."
-        ) from e
-    if not data:
-        raise RuntimeError(
-            "Tag", tag, " does not exist on repo", repo_path, ". Aborting!"
-        )
-    return data.strip()
+def _resolve_tag_sync(repos: list[GitRepo], tag_sync: TagSyncResolver) -> TagSyncStatus:
+    return tag_sync.resolve(
+        (repo.repo_id, repo.ref_snapshot, repo.tag_index)
+        for repo in repos
+        if repo.tags and repo.tag_index
+    )
 
 
-async def _get_tags_associated_to_sha(repo_path: str, sha: str) -> list[str]:
-    cmd = ["git", "tag", "--points-at", sha]
-    try:
-        data = await exec_command_async(cmd, repo_path)
-    except CmdLineError as e:
-        raise RuntimeError(
-            " ".join(cmd), "The command was invalid and the cmd call failed."
-        ) from e
-    if not data:
-        return []
-    return data.split()
+def _log_tag_sync_status(status: TagSyncStatus) -> None:
+    log.info(
+        "Repos did not match in their latest tag's first capture group, "
+        "waiting for %s",
+        ", ".join(status.blocking_repo_ids) or "a tag in any repo",
+    )
+    log.info("Latest (matching) tags per repo, displaying first regex capture group:")
+    for repo_id, release_names in status.release_names.items():
+        log.info("%s: %s", repo_id, sorted(release_names))
 
 
-async def _get_repos_latest_tags(
-    repos: list[GitRepo],
-) -> list[Any]:
-    each_repo_latest_tags = []
-    for repo in repos:
-        if not repo.tags:
-            continue
-        current_regexp = repo.tags
-        any_matching_tag = (
-            await _git_get_latest_matching_tag(  # This returns only one tag
-                repo.directory, repo.tags
+async def _check_for_changes_in_repository(
+    repo: GitRepo, synced_via_tags: bool = False
+) -> Optional[RepoStatus]:
+    """
+    raises ConfigurationError
+    """
+    log.debug("checking repo: %s...", repo.repo_url)
+    if not repo.tree_is_clean:
+        await _backend(repo).clean(repo.directory)
+        repo.tree_is_clean = True
+
+    if repo.tags:
+        latest_matching_tag = _get_latest_matching_tag(repo)
+        if latest_matching_tag is None:
+            raise ConfigurationError(
+                msg=f"no tags found in {repo.repo_id} that follows defined tags pattern {repo.tags}"
             )
-        )
-        if not any_matching_tag:
-            continue
-        sha_of_tag = await _git_sha_of_tag(repo.directory, any_matching_tag)
-        all_tags_of_sha = await _get_tags_associated_to_sha(repo.directory, sha_of_tag)
-        # Retain only regexp-matching tags
-        all_matching_tags_of_sha = [
-            tag for tag in all_tags_of_sha if re.search(current_regexp, tag) != None
-        ]
-        each_repo_latest_tags.append((repo.repo_id, all_matching_tags_of_sha))
-    return each_repo_latest_tags
 
+        if not await _is_tag_on_branch(repo, latest_matching_tag):
+            return None
+    # changes in repo
+    # NOTE: with tag-sync, every new tag is a release that all repos deploy together
+    return (
+        await _update_repo_using_tags(repo, report_any_new_tag=synced_via_tags)
+        if repo.tags
+        else await _update_repo_using_branch_head(repo)
+    )
 
-async def _latest_matching_tag_capture_group_identical_for_repos(
-    repos: list[GitRepo],
-) -> list[Any]:
-    each_repo_latest_tags: list[
-        tuple(str)
-    ] = []  # A list of tuples of (repo_id, list_of_all_tags_of_latest_tagged_commit)
+
+def _get_remote_key(repo: GitRepo) -> tuple[str, str, str]:
+    return f"{repo.repo_url}", repo.username, repo.password
+
+
+def _get_shared_stores(repos: Iterable[GitRepo]) -> list[SharedStore]:
+    stores: dict[str, SharedStore] = {}
     for repo in repos:
-        if not repo.tags:
-            continue
-        current_regexp = repo.tags
-        current_regexp_compiled = re.compile(current_regexp)
-        any_matching_tag = (
-            await _git_get_latest_matching_tag(  # This returns only one tag
-                repo.directory, repo.tags
+        if repo.store:
+            stores.setdefault(repo.store.store_id, repo.store)
+    return list(stores.values())
+
+
+async def _fetch_repositories(
+    repos: list[GitRepo], max_concurrency: int
+) -> list[tuple[GitRepo, Optional[RemoteRefs]]]:
+    """Probes and, if their remote refs changed, fetches all repos concurrently
+
+    The repos sharing a store are probed and fetched from their remote once.
+    returns the repos that are up-to-date with their remote together with the
+    probed remote refs. A repo whose fetch fails is logged and left out, so that
+    one unreachable git host does not block the others.
+    """
+
+    async def _fetch_if_changed(
+        repo: GitRepo, remote_refs: Optional[RemoteRefs]
+    ) -> Optional[RemoteRefs]:
+        if remote_refs is not None and remote_refs == repo.fetched_remote_refs:
+            log.debug("no remote changes in %s, skipping fetch", repo.repo_id)
+            return remote_refs
+
+        log.debug("fetching repo: %s...", repo.repo_url)
+        await _fetch_repository(repo, remote_refs)
+        return remote_refs
+
+    async def _fetch(repo: GitRepo) -> list[Optional[RemoteRefs]]:
+        return [await _fetch_if_changed(repo, await _probe_remote_refs(repo))]
+
+    async def _fetch_shared(
+        store: SharedStore, store_repos: list[GitRepo]
+    ) -> list[Optional[RemoteRefs]]:
+        remote_refs = await _list_remote_refs(store.repos, store.directory)
+        if remote_refs is None or remote_refs != store.fetched_remote_refs:
+            log.debug("fetching store %s...", store.store_id)
+            await _fetch_store(store, remote_refs)
+        return [
+            await _fetch_if_changed(repo, _filter_remote_refs(repo, remote_refs))
+            for repo in store_repos
+        ]
+
+    units: list[tuple[list[GitRepo], Awaitable[list[Optional[RemoteRefs]]]]] = [
+        ([repo], _fetch(repo)) for repo in repos if repo.store is None
+    ]
+    for store in _get_shared_stores(repos):
+        store_repos = [repo for repo in repos if repo.store is store]
+        units.append((store_repos, _fetch_shared(store, store_repos)))
+    results = await _run_bounded((fetch for _, fetch in units), max_concurrency)
+
+    fetched_repos = []
+    for (unit_repos, _), result in zip(units, results):
+        if isinstance(result, CmdLineError):
+            log.warning(
+                "fetching %s failed, skipping it in this cycle: %s",
+                ", ".join(repo.repo_id for repo in unit_repos),
+                result,
             )
-        )
-        if not any_matching_tag:
             continue
-        sha_of_tag = await _git_sha_of_tag(repo.directory, any_matching_tag)
-        all_tags_of_sha = await _get_tags_associated_to_sha(repo.directory, sha_of_tag)
-        # Retain only regexp-matching tags
-        all_matching_tags_of_sha = [
-            tag for tag in all_tags_of_sha if re.search(current_regexp, tag) != None
-        ]
-        # If the regexp has capture groups, return the 1st capture group
-        first_capture_group_all_matching_tags = all_matching_tags_of_sha
-        if current_regexp_compiled.groups > 0:
-            first_capture_group_all_matching_tags = [
-                re.search(current_regexp, tag).groups()[0]
-                for tag in all_matching_tags_of_sha
-                if re.search(current_regexp, tag)
-            ]
-        each_repo_latest_tags.append(
-            (repo.repo_id, first_capture_group_all_matching_tags)
-        )
-    #
-    all_unique_latest_tags_of_all_repos_combined = {
-        j for i in each_repo_latest_tags for j in i[1]
-    }
-    tag_present_in_all_repos = False
-    for tag in all_unique_latest_tags_of_all_repos_combined:
-        this_tag_present_in_all_repos = (
-            sum(1 for i in each_repo_latest_tags if tag in ",".join(i[1]))
-            - sum(1 for i in each_repo_latest_tags)
-            == 0
-        )
-        if this_tag_present_in_all_repos:
-            tag_present_in_all_repos = True
-            break
-    if tag_present_in_all_repos:
-        return each_repo_latest_tags
-    return []
+        if isinstance(result, BaseException):
+            raise result
+        fetched_repos.extend(zip(unit_repos, result))
+    # NOTE: in the order of repos
+    order = {id(repo): index for index, repo in enumerate(repos)}
+    return sorted(fetched_repos, key=lambda fetched: order[id(fetched[0])])
 
 
 async def _check_for_changes_in_repositories(  # pylint: disable=too-many-branches
     repos: list[GitRepo],
     synced_via_tags: bool = False,
+    max_concurrency: int = DEFAULT_GIT_PARALLELISM,
+    tag_sync: Optional[TagSyncResolver] = None,
 ) -> dict[RepoID, RepoStatus]:
     """
     raises ConfigurationError
     """
-    changes: dict[RepoID, RepoStatus] = {}
-    for repo in repos:
-        log.debug("fetching repo: %s...", repo.repo_url)
-        await _git_fetch(repo.directory)
-    each_repo_latest_tags: Optional[
-        list[tuple(str, str)]
-    ] = await _latest_matching_tag_capture_group_identical_for_repos(repos)
+    fetched_repos = await _fetch_repositories(repos, max_concurrency)
+    # repos whose remote refs did not change since their last completed check are skipped
+    repos_to_check = [
+        (repo, remote_refs)
+        for repo, remote_refs in fetched_repos
+        if remote_refs is None or remote_refs != repo.checked_remote_refs
+    ]
+    if not repos_to_check:
+        log.debug("no remote changes in any repo")
+        return {}
+
+    # NOTE: the tag-sync is evaluated only once every fetch is completed
+    tags_in_sync = False
     if synced_via_tags:
-        if not each_repo_latest_tags:
-            log.info("Repos did not match in their latest tag's first capture group!")
-            log.info(
-                "Latest (matching) tags per repo, displaying first regex capture group:"
-            )
-            for repo_tag_info in await _get_repos_latest_tags(repos):
-                log.info("%s: %s", repo_tag_info[0], repo_tag_info[1])
+        if len(fetched_repos) != len(repos):
+            log.info("Not all repos could be fetched, tags cannot be compared!")
             log.info("Will only update those repos that have no tag-regex specified!")
         else:
-            log.info("All synced repos have the same latest tag! Deploying....")
-    for repo in repos:
-        if synced_via_tags and not each_repo_latest_tags and repo.tags:
-            continue
-        log.debug("checking repo: %s...", repo.repo_url)
-        await _git_clean_repo(repo.directory)
-
-        if repo.tags:
-            latest_matching_tag = await _git_get_latest_matching_tag(
-                repo.directory, repo.tags
-            )
-            if latest_matching_tag is None:
-                raise ConfigurationError(
-                    msg=f"no tags found in {repo.repo_id} that follows defined tags pattern {repo.tags}"
+            tag_sync_status = _resolve_tag_sync(repos, tag_sync or TagSyncResolver())
+            tags_in_sync = tag_sync_status.in_sync
+            if tags_in_sync:
+                log.info("All synced repos have the same latest tag! Deploying....")
+            else:
+                _log_tag_sync_status(tag_sync_status)
+                log.info(
+                    "Will only update those repos that have no tag-regex specified!"
                 )
 
-            if not await _check_if_tag_on_branch(
-                repo.directory,
-                repo.branch,
-                latest_matching_tag,
-            ):
-                continue
-        # changes in repo
-        repo_changes: Optional[RepoStatus] = (
-            await _update_repo_using_tags(repo)
-            if repo.tags
-            else await _update_repo_using_branch_head(repo)
-        )
-        if repo_changes:
-            changes[repo.repo_id] = repo_changes
+    repos_to_check = [
+        (repo, remote_refs)
+        for repo, remote_refs in repos_to_check
+        if not (synced_via_tags and not tags_in_sync and repo.tags)
+    ]
+    results = await _run_bounded(
+        (
+            _check_for_changes_in_repository(repo, synced_via_tags)
+            for repo, _ in repos_to_check
+        ),
+        max_concurrency,
+    )
+
+    changes: dict[RepoID, RepoStatus] = {}
+    for (repo, remote_refs), result in zip(repos_to_check, results):
+        if isinstance(result, CmdLineError):
+            log.warning(
+                "checking %s failed, skipping it in this cycle: %s",
+                repo.repo_id,
+                result,
+            )
+            continue
+        if isinstance(result, BaseException):
+            raise result
+        repo.checked_remote_refs = remote_refs
+        if result:
+            changes[repo.repo_id] = result
 
     return changes
 
@@ -724,9 +1410,17 @@ async def _delete_repositories(repos: list[GitRepo]) -> None:
 
 
 class GitUrlWatcher(SubTask):
-    def __init__(self, app_config: dict[str, Any]):
+    def __init__(
+        self, app_config: dict[str, Any], session: Optional[ClientSession] = None
+    ):
+        """session is used to query the forges' APIs, created if needed otherwise"""
         super().__init__(name="git repo watcher")
         self.synced_via_tags = app_config["main"]["synced_via_tags"]
+        self.max_concurrency: int = app_config["main"].get(
+            "git_parallelism", DEFAULT_GIT_PARALLELISM
+        )
+        cache_dir: str = app_config["main"].get("git_cache_dir", "")
+        self.cache_dir: Optional[Path] = Path(cache_dir) if cache_dir else None
         self.watched_repos: list[GitRepo] = [
             GitRepo(
                 repo_id=config["id"],
@@ -739,15 +1433,88 @@ class GitUrlWatcher(SubTask):
             )
             for config in app_config["main"]["watched_git_repositories"]
         ]
+        git_backend: str = app_config["main"].get("git_backend", "cli")
+        sparse_checkout: bool = app_config["main"].get("git_sparse_checkout", False)
+        bundles = any(
+            config.get("bundle")
+            for config in app_config["main"]["watched_git_repositories"]
+        )
+        if git_backend != "cli" and (self.cache_dir or sparse_checkout or bundles):
+            raise ConfigurationError(
+                "git_cache_dir, git_sparse_checkout and bundles need the cli git "
+                f"backend, not {git_backend}"
+            )
+        self.git_backend = _create_git_backend(git_backend, self.max_concurrency)
+        for repo in self.watched_repos:
+            repo.backend = self.git_backend
+        self.state = WatcherState(session=session)
+        for _, group in itertools.groupby(
+            sorted(self.watched_repos, key=_get_remote_key), key=_get_remote_key
+        ):
+            repos = list(group)
+            if len(repos) > 1:
+                store = SharedStore(
+                    store_id="+".join(repo.repo_id for repo in repos), repos=repos
+                )
+                for repo in repos:
+                    repo.store = store
+                self.state.shared_stores.append(store)
+        for repo, config in zip(
+            self.watched_repos, app_config["main"]["watched_git_repositories"]
+        ):
+            repo.tags_order = config.get("tags_order", "creatordate")
+            repo.bundle = config.get("bundle", "")
+            repo.forge_client = create_forge_client(
+                config.get("change_source", "git"),
+                repo.repo_url,
+                api_url=config.get("forge_api_url", ""),
+                token=config.get("forge_token") or repo.password or "",
+            )
+        if sparse_checkout:
+            recipe_files = (
+                app_config["main"].get("docker_stack_recipe", {}).get("files", [])
+            )
+            for repo in self.watched_repos:
+                repo.sparse_checkout_cones = _get_sparse_checkout_cones(
+                    repo.paths
+                    + [
+                        path
+                        for group in recipe_files
+                        if group["id"] == repo.repo_id
+                        for path in group["paths"]
+                    ]
+                )
 
         self.repo_status: dict[RepoID, RepoStatus] = {}
+        # housekeeping of the clones, run between the polls
+        self.maintenance = MaintenanceScheduler.from_config(
+            app_config["main"].get("git_maintenance")
+        )
         self._aiostack = AsyncExitStack()
 
     async def init(self) -> dict[RepoID, StatusStr]:
         # SubTask Override
         log.info("initializing git repositories...")
+        forge_clients = [repo.forge_client for repo in self.watched_repos]
+        if any(forge_clients) and self.state.session is None:
+            self.state.session = await self._aiostack.enter_async_context(
+                ClientSession(timeout=ClientTimeout(FORGE_API_TIMEOUT_S))
+            )
+        for forge_client in forge_clients:
+            if forge_client:
+                forge_client.session = self.state.session
         self.repo_status = await _clone_and_checkout_repositories(
-            self.watched_repos, self._aiostack, synced_via_tags=self.synced_via_tags
+            self.watched_repos,
+            self._aiostack,
+            synced_via_tags=self.synced_via_tags,
+            max_concurrency=self.max_concurrency,
+            cache_dir=self.cache_dir,
+            tag_sync=self.state.tag_sync,
+        )
+
+        self.maintenance.sync(
+            [repo.repo_id for repo in self.watched_repos]
+            + [store.store_id for store in self.state.shared_stores]
         )
 
         return {
@@ -760,10 +1527,22 @@ class GitUrlWatcher(SubTask):
         wait=wait_random(min=1, max=MAX_TIME_TO_WAIT_S),
         after=after_log(log, logging.DEBUG),
     )
-    async def check_for_changes(self) -> dict[RepoID, StatusStr]:
+    async def check_for_changes(
+        self, repo_ids: Optional[set[RepoID]] = None
+    ) -> dict[RepoID, StatusStr]:
+        """checks only the repos in repo_ids if set
+
+        NOTE: with synced_via_tags all repos are checked, their tags are compared
+        """
         # SubTask Override
+        repos = self.watched_repos
+        if repo_ids is not None and not self.synced_via_tags:
+            repos = [repo for repo in repos if repo.repo_id in repo_ids]
         repos_changes = await _check_for_changes_in_repositories(
-            repos=self.watched_repos, synced_via_tags=self.synced_via_tags
+            repos=repos,
+            synced_via_tags=self.synced_via_tags,
+            max_concurrency=self.max_concurrency,
+            tag_sync=self.state.tag_sync,
         )
         changes = {
             repo_id: repo_status.to_string()
@@ -771,8 +1550,45 @@ class GitUrlWatcher(SubTask):
         }
         return changes
 
+    async def create_bundles(self, output_dir: Path) -> dict[RepoID, Path]:
+        """Writes the bundle of each watched repo as output_dir/<repo id>.bundle
+
+        A bundle holds the full history of the repo's branch and its tags. It is
+        made from the cached mirror if git_cache_dir is set, cloned anew otherwise
+        """
+        output_dir.mkdir(parents=True, exist_ok=True)
+        bundles: dict[RepoID, Path] = {}
+        async with TemporaryDirectory(prefix="bundles_") as tmpdir:
+            for repo in self.watched_repos:
+                mirror = _get_mirror_path(self.cache_dir or Path(tmpdir), repo)
+                await _update_mirror(repo, mirror)
+                bundles[repo.repo_id] = output_dir / f"{repo.repo_id}{BUNDLE_SUFFIX}"
+                await _git_create_bundle(f"{mirror}", f"{bundles[repo.repo_id]}")
+                log.info("%s bundled in %s", repo.repo_id, bundles[repo.repo_id])
+        return bundles
+
+    async def run_maintenance(self, budget: Optional[float] = None) -> int:
+        """Runs the due housekeeping tasks of the clones within budget seconds"""
+        directories = {repo.repo_id: repo.directory for repo in self.watched_repos}
+        store_directories = {
+            store.store_id: store.directory for store in self.state.shared_stores
+        }
+
+        async def _run_task(source_id: str, task: str) -> bool:
+            if source_id in store_directories:
+                if task == "prune":
+                    # NOTE: the clones may still use objects the store dropped
+                    return False
+                return await self.git_backend.run_maintenance(
+                    store_directories[source_id], task
+                )
+            return await self.git_backend.run_maintenance(directories[source_id], task)
+
+        return await self.maintenance.run(_run_task, budget)
+
     async def cleanup(self):
         # SubTask Override
+        await self.git_backend.close()
         await self._aiostack.aclose()
         await _delete_repositories(repos=self.watched_repos)
 
@@ -0,0 +1,162 @@
+""" Per-source polling intervals of the auto-deploy task
+
+Every watched git repository and docker registry is polled on its own schedule:
+the interval grows exponentially while the source is quiet, drops back to its
+minimum right after a change, and is randomized by some jitter so that the
+agents watching the same hosts do not poll them in lockstep.
+"""
+
+import random
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+DEFAULT_BACKOFF_FACTOR = 2.0
+DEFAULT_JITTER = 0.1
+
+
+@dataclass(frozen=True)
+class PollingPolicy:
+    min_interval: float  # seconds
+    max_interval: float
+    backoff_factor: float = DEFAULT_BACKOFF_FACTOR
+    jitter: float = DEFAULT_JITTER  # fraction of the interval
+
+    @classmethod
+    def from_config(
+        cls, polling_config: Optional[dict[str, Any]], default: "PollingPolicy"
+    ) -> "PollingPolicy":
+        """Overrides default with the keys set in a config's 'polling' section"""
+        polling_config = polling_config or {}
+        min_interval = polling_config.get("min_interval", default.min_interval)
+        return cls(
+            min_interval=min_interval,
+            max_interval=max(
+                min_interval, polling_config.get("max_interval", default.max_interval)
+            ),
+            backoff_factor=polling_config.get("backoff_factor", default.backoff_factor),
+            jitter=polling_config.get("jitter", default.jitter),
+        )
+
+    @classmethod
+    def from_main_config(cls, main_config: dict[str, Any]) -> "PollingPolicy":
+        """Default policy, without 'polling' section it polls every polling_interval"""
+        polling_interval = main_config["polling_interval"]
+        return cls.from_config(
+            main_config.get("polling"),
+            default=cls(min_interval=polling_interval, max_interval=polling_interval),
+        )
+
+
+@dataclass
+class SourceSchedule:
+    policy: PollingPolicy
+    interval: float
+    next_poll: float  # in the scheduler's clock
+    quiet_polls: int = 0  # polls since the last change
+    last_poll: Optional[datetime] = None
+    last_change: Optional[datetime] = None
+
+
+class PollingScheduler:
+    """Decides which sources (e.g. repo ids or registries) are due for a poll"""
+
+    def __init__(
+        self,
+        default_policy: PollingPolicy,
+        policies: Optional[dict[str, PollingPolicy]] = None,
+        *,
+        rng: Optional[random.Random] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.default_policy = default_policy
+        self.policies = policies or {}
+        self.schedules: dict[str, SourceSchedule] = {}
+        self._rng = rng or random.Random()
+        self._clock = clock
+
+    def _jittered(self, policy: PollingPolicy, interval: float) -> float:
+        return interval * self._rng.uniform(1 - policy.jitter, 1 + policy.jitter)
+
+    def sync(self, source_ids: Iterable[str]) -> None:
+        """Schedules new sources one interval from now and forgets vanished ones"""
+        source_ids = set(source_ids)
+        for source_id in self.schedules.keys() - source_ids:
+            del self.schedules[source_id]
+        now = self._clock()
+        for source_id in source_ids - self.schedules.keys():
+            policy = self.policies.get(source_id, self.default_policy)
+            self.schedules[source_id] = SourceSchedule(
+                policy=policy,
+                interval=policy.min_interval,
+                next_poll=now + self._jittered(policy, policy.min_interval),
+            )
+
+    def due(self) -> set[str]:
+        now = self._clock()
+        return {
+            source_id
+            for source_id, schedule in self.schedules.items()
+            if schedule.next_poll <= now
+        }
+
+    def request(self, source_ids: Iterable[str]) -> None:
+        """Makes sources due right away (e.g. a webhook reported a push)"""
+        now = self._clock()
+        for source_id in source_ids:
+            if schedule := self.schedules.get(source_id):
+                schedule.next_poll = min(schedule.next_poll, now)
+
+    def record(self, polled: Iterable[str], changed: Iterable[str]) -> None:
+        """Reschedules the polled sources depending on whether they changed"""
+        changed = set(changed)
+        now, now_dt = self._clock(), datetime.now(tz=timezone.utc)
+        for source_id in polled:
+            if (schedule := self.schedules.get(source_id)) is None:
+                continue
+            policy = schedule.policy
+            if source_id in changed:
+                schedule.interval = policy.min_interval
+                schedule.quiet_polls = 0
+                schedule.last_change = now_dt
+            else:
+                schedule.interval = min(
+                    schedule.interval * policy.backoff_factor, policy.max_interval
+                )
+                schedule.quiet_polls += 1
+            schedule.last_poll = now_dt
+            schedule.next_poll = now + self._jittered(policy, schedule.interval)
+
+    def seconds_until_next_poll(self) -> Optional[float]:
+        """None if there is nothing to poll"""
+        if not self.schedules:
+            return None
+        next_poll = min(schedule.next_poll for schedule in self.schedules.values())
+        return max(0.0, next_poll - self._clock())
+
+    def to_dict(self) -> dict[str, dict[str, Any]]:
+        now = self._clock()
+        return {
+            source_id: {
+                "min_interval": schedule.policy.min_interval,
+                "max_interval": schedule.policy.max_interval,
+                "interval": schedule.interval,
+                "next_poll_in": max(0.0, schedule.next_poll - now),
+                "quiet_polls": schedule.quiet_polls,
+                "last_poll": schedule.last_poll.isoformat()
+                if schedule.last_poll
+                else None,
+                "last_change": schedule.last_change.isoformat()
+                if schedule.last_change
+                else None,
+            }
+            for source_id, schedule in sorted(self.schedules.items())
+        }
+
+
+__all__: tuple[str, ...] = (
+    "PollingPolicy",
+    "PollingScheduler",
+)
@@ -55,6 +55,22 @@ def _create_routes(specs):
     operation_id = specs.paths[path].operations["post"].operation_id
     routes.append(web.post(base_path + path, handle, name=operation_id))
 
+    path, handle = "/webhooks/git", rest_handlers.receive_git_webhook
+    operation_id = specs.paths[path].operations["post"].operation_id
+    routes.append(web.post(base_path + path, handle, name=operation_id))
+
+    path, handle = "/polling", rest_handlers.get_polling_schedules
+    operation_id = specs.paths[path].operations["get"].operation_id
+    routes.append(web.get(base_path + path, handle, name=operation_id))
+
+    path, handle = "/maintenance", rest_handlers.get_maintenance
+    operation_id = specs.paths[path].operations["get"].operation_id
+    routes.append(web.get(base_path + path, handle, name=operation_id))
+
+    path, handle = "/subprocesses", rest_handlers.get_subprocess_metrics
+    operation_id = specs.paths[path].operations["get"].operation_id
+    routes.append(web.get(base_path + path, handle, name=operation_id))
+
     return routes
 
 
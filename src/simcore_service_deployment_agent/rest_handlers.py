@@ -2,15 +2,23 @@
 
 
 """
+import json
 import logging
 
 from aiohttp import web
+from servicelib.aiohttp.application_keys import APP_CONFIG_KEY
 from servicelib.aiohttp.rest_responses import wrap_as_envelope
 from servicelib.aiohttp.rest_utils import body_to_dict, extract_and_validate
 
-from . import __version__
+from . import __version__, subprocess_utils, webhooks
 from .app_state import State
-from .auto_deploy_task import TASK_NAME
+from .auto_deploy_task import (
+    TASK_MAINTENANCE_NAME,
+    TASK_NAME,
+    TASK_SCHEDULERS_NAME,
+    request_check,
+)
+from .exceptions import WebhookError
 
 log = logging.getLogger(__name__)
 
@@ -51,3 +59,68 @@ async def check_action(request: web.Request):
     }
 
     return wrap_as_envelope(data=data)
+
+
+async def receive_git_webhook(request: web.Request):
+    app_config = request.app[APP_CONFIG_KEY]
+    secret = app_config["main"].get("webhook_secret", "")
+    if not secret:
+        raise web.HTTPNotFound(reason="git webhooks are disabled")
+
+    # NOTE: the signature is computed on the raw body
+    body = await request.read()
+    try:
+        forge = webhooks.get_forge(request.headers)
+        webhooks.verify_signature(forge, request.headers, body, secret)
+    except WebhookError as err:
+        raise web.HTTPUnauthorized(reason=f"{err}") from err
+    try:
+        event = webhooks.parse_push_event(forge, request.headers, json.loads(body))
+    except (ValueError, AttributeError, WebhookError) as err:
+        raise web.HTTPBadRequest(reason=f"invalid webhook payload: {err}") from err
+
+    repo_ids = (
+        webhooks.find_watched_repos(
+            event, app_config["main"]["watched_git_repositories"]
+        )
+        if event
+        else []
+    )
+    log.info(
+        "%s webhook for %s: checking %s",
+        forge,
+        event.ref if event else "no ref",
+        repo_ids or "nothing",
+    )
+    request_check(request.app, repo_ids)
+
+    return {"repo_ids": repo_ids}
+
+
+async def get_polling_schedules(request: web.Request):
+    params, query, body = await extract_and_validate(request)
+
+    assert not params
+    assert not query
+    assert not body
+    schedulers = request.app.get(TASK_SCHEDULERS_NAME, {})
+    return {name: scheduler.to_dict() for name, scheduler in schedulers.items()}
+
+
+async def get_maintenance(request: web.Request):
+    params, query, body = await extract_and_validate(request)
+
+    assert not params
+    assert not query
+    assert not body
+    maintenance = request.app.get(TASK_MAINTENANCE_NAME)
+    return maintenance.to_dict() if maintenance else {}
+
+
+async def get_subprocess_metrics(request: web.Request):
+    params, query, body = await extract_and_validate(request)
+
+    assert not params
+    assert not query
+    assert not body
+    return subprocess_utils.metrics.to_dict()
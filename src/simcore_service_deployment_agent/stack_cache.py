@@ -0,0 +1,162 @@
+""" On-disk cache of the stacks built by the docker stack recipe
+
+Copying the recipe files, running its command (e.g. docker-compose config) and
+filtering the output takes seconds. The final stack is stored under a hash of
+everything it is built from: the recipe config, the blob id of each recipe file
+(as committed, the recipe writes into the working trees), the revision of each
+watched repo and the environment variables the recipe refers to. The least recently used stacks are dropped beyond the size limits.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+import yaml
+
+from .models import ComposeSpecsDict
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 16
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+# NOTE: to be bumped whenever the way stacks are built changes
+_KEY_VERSION = 1
+_ENTRY_SUFFIX = ".yaml"
+_VARIABLE_RE = re.compile(r"\$\{?([A-Za-z_][A-Za-z0-9_]*)")
+
+
+def blob_id(path: Path) -> str:
+    """Same id as 'git hash-object path'"""
+    content = path.read_bytes()
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()  # nosec
+
+
+@dataclass(frozen=True)
+class RecipeFile:
+    """A recipe file as an input of the stack key"""
+
+    blob_id: Optional[str]  # None if the file does not exist
+    text: str = ""
+
+
+def referenced_variables(texts: Iterable[str]) -> set[str]:
+    """names of the $NAME and ${NAME} in texts"""
+    return {name for text in texts for name in _VARIABLE_RE.findall(text)}
+
+
+def compute_stack_key(
+    recipe_config: dict[str, Any],
+    files: Mapping[str, Mapping[str, RecipeFile]],
+    revisions: Mapping[str, Optional[str]],
+    environment: Mapping[str, str],
+    extra_variables: Iterable[str] = (),
+) -> str:
+    """Hash of the inputs of a stack build
+
+    files are the recipe files of each repo id by name, revisions the checked
+    out commit of each repo id. The environment variables referred to in the
+    command, in the recipe files or listed in extra_variables are part of it
+    """
+    blob_ids = {
+        repo_id: {name: file.blob_id for name, file in sorted(named_files.items())}
+        for repo_id, named_files in files.items()
+    }
+    texts = [recipe_config.get("command", "")]
+    texts += [
+        file.text for named_files in files.values() for file in named_files.values()
+    ]
+    variables = referenced_variables(texts) | set(extra_variables)
+    inputs = {
+        "version": _KEY_VERSION,
+        "recipe": {k: v for k, v in recipe_config.items() if k != "cache"},
+        "blob_ids": blob_ids,
+        "revisions": dict(revisions),
+        "environment": {name: environment.get(name) for name in sorted(variables)},
+    }
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class StackBuildCache:
+    """Least recently used stacks stored as files, one per key"""
+
+    def __init__(
+        self,
+        directory: Path,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_config(
+        cls, cache_config: Optional[dict[str, Any]]
+    ) -> Optional["StackBuildCache"]:
+        """from the recipe's 'cache' section, None if there is none"""
+        if not cache_config:
+            return None
+        return cls(
+            Path(cache_config["directory"]),
+            max_entries=cache_config.get("max_entries", DEFAULT_MAX_ENTRIES),
+            max_bytes=cache_config.get("max_bytes", DEFAULT_MAX_BYTES),
+        )
+
+    def _get_path(self, key: str) -> Path:
+        return self.directory / f"{key}{_ENTRY_SUFFIX}"
+
+    def get(self, key: str) -> Optional[ComposeSpecsDict]:
+        path = self._get_path(key)
+        try:
+            stack_cfg = yaml.safe_load(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, yaml.YAMLError):
+            log.warning("dropping unreadable stack %s from the cache", path)
+            path.unlink(missing_ok=True)
+            return None
+        if not isinstance(stack_cfg, dict):
+            log.warning("dropping invalid stack %s from the cache", path)
+            path.unlink(missing_ok=True)
+            return None
+        # NOTE: the modification time orders the entries from the most recently used
+        os.utime(path)
+        return stack_cfg
+
+    def put(self, key: str, stack_cfg: ComposeSpecsDict) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._get_path(key)
+        partial_path = path.with_name(f".{path.name}.partial")
+        partial_path.write_text(yaml.safe_dump(stack_cfg), encoding="utf-8")
+        partial_path.replace(path)
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for path in self.directory.glob(f"*{_ENTRY_SUFFIX}"):
+            try:
+                entries.append((path.stat(), path))
+            except FileNotFoundError:
+                continue
+        entries.sort(key=lambda entry: entry[0].st_mtime_ns, reverse=True)
+        total_bytes = 0
+        for num_entries, (stat, path) in enumerate(entries, start=1):
+            total_bytes += stat.st_size
+            if num_entries > self.max_entries or total_bytes > self.max_bytes:
+                log.debug("evicting stack %s from the cache", path.name)
+                path.unlink(missing_ok=True)
+
+
+__all__: tuple[str, ...] = (
+    "RecipeFile",
+    "StackBuildCache",
+    "compute_stack_key",
+)
@@ -0,0 +1,156 @@
+""" Counts and latency histograms of the commands spawned by subprocess_utils
+
+Commands are aggregated per name (e.g. 'git fetch'), over the whole life of the
+agent and per deploy cycle, to find where the time of a cycle goes.
+"""
+
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional, Union
+
+# upper bounds (seconds) of the latency histogram buckets, the last one is +Inf
+LATENCY_BUCKETS_S: tuple[float, ...] = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+SHELL_COMMAND_NAME = "shell"
+# programs whose first argument is a subcommand, e.g. git fetch
+_PROGRAMS_WITH_SUBCOMMANDS = frozenset({"git", "docker", "docker-compose"})
+# options taking a separate value before the subcommand, e.g. git -c key=value
+_OPTIONS_WITH_VALUE = frozenset({"-c", "-C", "--git-dir", "--work-tree", "-H"})
+
+
+def command_name(command: Union[str, list[str]]) -> str:
+    """e.g. 'git fetch' for git -c protocol.version=2 fetch origin"""
+    if isinstance(command, str):
+        return SHELL_COMMAND_NAME
+    program = os.path.basename(command[0]) if command else ""
+    if program not in _PROGRAMS_WITH_SUBCOMMANDS:
+        return program
+    args = iter(command[1:])
+    for arg in args:
+        if arg in _OPTIONS_WITH_VALUE:
+            next(args, None)
+        elif not arg.startswith("-"):
+            return f"{program} {arg}"
+    return program
+
+
+@dataclass
+class CommandStats:
+    count: int = 0
+    failures: int = 0  # non-zero exit status, killed or not started
+    total_duration: float = 0.0  # seconds
+    max_duration: float = 0.0
+    output_bytes: int = 0  # stdout
+    # number of durations in each bucket of LATENCY_BUCKETS_S
+    buckets: list[int] = field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS_S) + 1)
+    )
+
+    def add(self, duration: float, returncode: Optional[int], output_bytes: int):
+        self.count += 1
+        if returncode != 0:
+            self.failures += 1
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+        self.output_bytes += output_bytes
+        bucket = next(
+            (i for i, bound in enumerate(LATENCY_BUCKETS_S) if duration <= bound),
+            len(LATENCY_BUCKETS_S),
+        )
+        self.buckets[bucket] += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "failures": self.failures,
+            "total_duration": self.total_duration,
+            "max_duration": self.max_duration,
+            "output_bytes": self.output_bytes,
+            "histogram": {
+                f"{bound}": count
+                for bound, count in zip((*LATENCY_BUCKETS_S, "+Inf"), self.buckets)
+            },
+        }
+
+
+@dataclass
+class CycleStats:
+    number: int
+    started: datetime
+    start_time: float  # of the clock
+    duration: Optional[float] = None  # seconds, None while the cycle runs
+    commands: dict[str, CommandStats] = field(default_factory=dict)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "number": self.number,
+            "started": self.started.isoformat(),
+            "duration": self.duration,
+            "commands_duration": sum(c.total_duration for c in self.commands.values()),
+            "commands": {
+                name: stats.to_dict() for name, stats in sorted(self.commands.items())
+            },
+        }
+
+
+class SubprocessMetrics:
+    """Aggregates the spawned commands in total and per deploy cycle"""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.total: dict[str, CommandStats] = {}
+        self.current_cycle: Optional[CycleStats] = None
+        self.last_cycle: Optional[CycleStats] = None
+        self._num_cycles = 0
+        self._clock = clock
+
+    def start_cycle(self) -> None:
+        self.end_cycle()
+        self._num_cycles += 1
+        self.current_cycle = CycleStats(
+            number=self._num_cycles,
+            started=datetime.now(tz=timezone.utc),
+            start_time=self._clock(),
+        )
+
+    def end_cycle(self) -> None:
+        if self.current_cycle is None:
+            return
+        self.current_cycle.duration = self._clock() - self.current_cycle.start_time
+        self.last_cycle = self.current_cycle
+        self.current_cycle = None
+
+    def record(
+        self,
+        command: Union[str, list[str]],
+        duration: float,
+        returncode: Optional[int],
+        output_bytes: int = 0,
+    ) -> None:
+        """returncode is None if the command was not started or not reaped"""
+        name = command_name(command)
+        self.total.setdefault(name, CommandStats()).add(
+            duration, returncode, output_bytes
+        )
+        if self.current_cycle is not None:
+            self.current_cycle.commands.setdefault(name, CommandStats()).add(
+                duration, returncode, output_bytes
+            )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "current_cycle": self.current_cycle.to_dict()
+            if self.current_cycle
+            else None,
+            "last_cycle": self.last_cycle.to_dict() if self.last_cycle else None,
+            "total": {
+                name: stats.to_dict() for name, stats in sorted(self.total.items())
+            },
+        }
+
+
+__all__: tuple[str, ...] = (
+    "LATENCY_BUCKETS_S",
+    "SubprocessMetrics",
+    "command_name",
+)
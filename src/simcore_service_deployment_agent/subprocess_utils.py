@@ -1,5 +1,10 @@
 """ Utils and extensions to 'subprocess' standard library
 
+The asynchronous helpers run every child process in its own process group, with
+a timeout and within a global cap on the number of concurrent child processes.
+stream_command_lines hands over the lines of a long output as they come and
+spawn_coprocess starts a long-lived process talked to through its stdin. Each
+command is recorded in the metrics (SEE subprocess_metrics).
 
 SEE https://docs.python.org/3/library/subprocess.html
 SEE https://docs.python.org/3/library/asyncio-subprocess.html
@@ -7,89 +12,443 @@ SEE https://docs.python.org/3/library/asyncio-subprocess.html
 
 
 import asyncio
+import contextlib
 import logging
+import os
+import signal
 import subprocess
+import time
 from asyncio.subprocess import Process
-from typing import Optional, Union
+from collections.abc import AsyncIterator, Awaitable
+from dataclasses import dataclass, field
+from typing import Optional, TypeVar, Union
+from weakref import WeakKeyDictionary
 
-from .exceptions import CmdLineError
+from .exceptions import CmdLineError, CmdTimeoutError
+from .subprocess_metrics import SubprocessMetrics
 
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+DEFAULT_TIMEOUT_S: float = 10 * 60
+DEFAULT_MAX_PROCESSES = 8
+_KILL_GRACE_S = 5
+# bytes buffered from a streamed stdout, also the max length of one of its lines
+STREAM_BUFFER_SIZE = 64 * 1024
+# bytes kept from the end of a streamed stderr, for the error message
+STDERR_TAIL_SIZE = 16 * 1024
+
 
 #
 # **ASYNCronous** helpers
 #
 
 
-async def _wait_and_process_results(
-    process: Process, *, command: Union[str, list[str]], strip_endline: bool = True
-) -> Optional[str]:
-    # waits
-    stdout, stderr = await process.communicate()
-    log.debug("[{%s}] exited with %s]", command, process.returncode)
+@dataclass(frozen=True)
+class CommandResult:
+    command: Union[str, list[str]]
+    returncode: int  # negative if killed by a signal
+    stdout: str
+    stderr: str
+    duration: float  # seconds
 
-    # process results
-    if process.returncode > 0:
-        error_data = ""
-        if stderr:
-            error_data = stderr.decode()
-            log.debug("\n[stderr]%s", error_data)
-        raise CmdLineError(command, error_data)
+    def output(self, strip_endline: bool = True) -> Optional[str]:
+        """stdout, None if empty"""
+        if not self.stdout:
+            return None
+        return self.stdout.strip("\n") if strip_endline else self.stdout
 
-    if stdout:
-        standard_output = stdout.decode()
-        log.debug("\n[stdout]%s", standard_output)
 
-        return standard_output.strip("\n") if strip_endline else standard_output
-    return None
+@dataclass
+class _ProcessLimits:
+    timeout: float = DEFAULT_TIMEOUT_S  # 0 waits forever
+    max_processes: int = DEFAULT_MAX_PROCESSES
+    # NOTE: a semaphore is bound to the event loop it first waits in
+    semaphores: WeakKeyDictionary = field(default_factory=WeakKeyDictionary)
 
+    def semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.max_processes)
+        return self.semaphores[loop]
 
-async def exec_command_async(
-    program_and_args: list[str], cwd: str = ".", *, strip_endline: bool = True
-) -> Optional[str]:
-    # NOTE: any change in the signature has to be applied as well in the associated test mock
-    """Create a subprocess
 
-    returns output.strip('\n') or None if no outputs
-    raises CmdLineError
+_limits = _ProcessLimits()
+# all the commands run by the asynchronous helpers
+metrics = SubprocessMetrics()
+
+
+def configure(
+    *, timeout: Optional[float] = None, max_processes: Optional[int] = None
+) -> None:
+    """Sets the default timeout (seconds, 0 for none) and the cap on the number of
+    concurrent child processes of the asynchronous helpers
     """
+    if timeout is not None:
+        _limits.timeout = timeout
+    if max_processes is not None:
+        _limits.max_processes = max_processes
+        _limits.semaphores.clear()
+
+
+async def _spawn(
+    command: Union[str, list[str]],
+    cwd: str,
+    limit: int = STREAM_BUFFER_SIZE,
+    interactive: bool = False,
+) -> Process:
+    # NOTE: a new session makes the child the leader of its own process group
+    # NOTE: nobody reads the stderr of an interactive process, it would fill up
+    pipes = {
+        "stdin": asyncio.subprocess.PIPE if interactive else None,
+        "stdout": asyncio.subprocess.PIPE,
+        "stderr": asyncio.subprocess.DEVNULL
+        if interactive
+        else asyncio.subprocess.PIPE,
+    }
+    if isinstance(command, str):
+        return await asyncio.create_subprocess_shell(
+            command, cwd=cwd, limit=limit, start_new_session=True, **pipes
+        )
     try:
-        proc = await asyncio.create_subprocess_exec(
-            *program_and_args,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            cwd=cwd,
+        return await asyncio.create_subprocess_exec(
+            *command, cwd=cwd, limit=limit, start_new_session=True, **pipes
         )
     except FileNotFoundError as e:
         raise CmdLineError(
-            " ".join(program_and_args),
+            " ".join(command),
             "The command was invalid and the cmd call failed.",
         ) from e
 
-    return await _wait_and_process_results(
-        proc, command=program_and_args, strip_endline=strip_endline
+
+async def _kill_process_group(process: Process, communicate: asyncio.Future) -> None:
+    """SIGTERM then, after a grace period, SIGKILL to the process and its children"""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(process.pid, sig)
+        with contextlib.suppress(asyncio.TimeoutError):
+            # NOTE: the outputs are drained, otherwise the pipes are never closed
+            await asyncio.wait_for(asyncio.shield(communicate), _KILL_GRACE_S)
+            return
+    log.warning("process %s still holds its outputs after SIGKILL", process.pid)
+    communicate.cancel()
+
+
+async def _spawn_recorded(
+    command: Union[str, list[str]], cwd: str, start: float, interactive: bool = False
+) -> Process:
+    try:
+        return await _spawn(command, cwd, interactive=interactive)
+    except CmdLineError:
+        metrics.record(command, time.monotonic() - start, None)
+        raise
+
+
+def _stdout_size(communicate: asyncio.Future) -> int:
+    if not communicate.done() or communicate.cancelled() or communicate.exception():
+        return 0
+    stdout, _ = communicate.result()
+    return len(stdout or b"")
+
+
+async def run_process(
+    command: Union[str, list[str]],
+    cwd: str = ".",
+    *,
+    timeout: Optional[float] = None,
+    check: bool = True,
+) -> CommandResult:
+    """Runs command (through the shell if it is a str) once the cap allows it
+
+    timeout (seconds) defaults to the configured one, 0 waits forever. On timeout
+    or cancellation the whole process group of the command is killed.
+
+    raises CmdLineError if check and the command fails
+    raises CmdTimeoutError on timeout
+    """
+    timeout = _limits.timeout if timeout is None else timeout
+    async with _limits.semaphore():
+        start = time.monotonic()
+        process = await _spawn_recorded(command, cwd, start)
+        communicate = asyncio.ensure_future(process.communicate())
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                asyncio.shield(communicate), timeout or None
+            )
+        except asyncio.TimeoutError as err:
+            log.warning("[%s] killed after %ss", command, timeout)
+            await _kill_process_group(process, communicate)
+            raise CmdTimeoutError(command, timeout) from err
+        except asyncio.CancelledError:
+            log.debug("[%s] killed, its caller was cancelled", command)
+            await _kill_process_group(process, communicate)
+            raise
+        finally:
+            metrics.record(
+                command,
+                time.monotonic() - start,
+                process.returncode,
+                _stdout_size(communicate),
+            )
+    assert process.returncode is not None  # nosec
+    result = CommandResult(
+        command=command,
+        returncode=process.returncode,
+        stdout=stdout.decode() if stdout else "",
+        stderr=stderr.decode() if stderr else "",
+        duration=time.monotonic() - start,
+    )
+    log.debug(
+        "[%s] exited with %s in %.2fs", command, result.returncode, result.duration
     )
+    if result.stdout:
+        log.debug("\n[stdout]%s", result.stdout)
+    if result.stderr:
+        log.debug("\n[stderr]%s", result.stderr)
+
+    if check and result.returncode != 0:
+        raise CmdLineError(command, result.stderr)
+    return result
+
+
+async def _read_tail(stream: asyncio.StreamReader, size: int) -> bytes:
+    tail = b""
+    while chunk := await stream.read(size):
+        tail = (tail + chunk)[-size:]
+    return tail
+
+
+async def _drain_and_wait(process: Process, stderr_tail: asyncio.Future) -> None:
+    assert process.stdout  # nosec
+    while await process.stdout.read(STREAM_BUFFER_SIZE):
+        pass
+    await stderr_tail
+    await process.wait()
+
+
+class _LineStream:
+    """Reader of the stdout lines of a spawned process, killed on timeout"""
+
+    def __init__(
+        self, command: Union[str, list[str]], process: Process, timeout: float
+    ):
+        assert process.stdout and process.stderr  # nosec
+        self.command = command
+        self.process = process
+        self.timeout = timeout
+        self.stdout = process.stdout
+        self.stderr_tail = asyncio.ensure_future(
+            _read_tail(process.stderr, STDERR_TAIL_SIZE)
+        )
+        self.num_lines = self.output_bytes = 0
+        self.timed_out = False
+        self._watchdog = (
+            asyncio.get_running_loop().call_later(timeout, self._kill_on_timeout)
+            if timeout
+            else None
+        )
+
+    def _kill_on_timeout(self) -> None:
+        # NOTE: cheaper than a timeout on every line, the reader then gets EOF
+        self.timed_out = True
+        log.warning("[%s] killed after %ss", self.command, self.timeout)
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(self.process.pid, signal.SIGKILL)
+
+    async def lines(self) -> AsyncIterator[str]:
+        while True:
+            try:
+                line = await self.stdout.readline()
+            except ValueError as err:
+                raise CmdLineError(self.command, f"stdout: {err}") from err
+            if not line:
+                break
+            self.num_lines += 1
+            self.output_bytes += len(line)
+            yield line.decode().rstrip("\n")
+        if self.timed_out:
+            raise CmdTimeoutError(self.command, self.timeout)
+
+    async def finish(self) -> bool:
+        """Waits for the process, False if killed as its output is no longer read"""
+        finished = asyncio.ensure_future(
+            _drain_and_wait(self.process, self.stderr_tail)
+        )
+        if not self.stdout.at_eof():
+            log.debug("[%s] killed, its output is no longer read", self.command)
+            await _kill_process_group(self.process, finished)
+            return False
+        await finished
+        if self.timed_out:
+            raise CmdTimeoutError(self.command, self.timeout)
+        return True
+
+    async def abort(self) -> None:
+        if self.process.returncode is None:
+            log.warning("[%s] killed after an error", self.command)
+            drained = asyncio.ensure_future(
+                _drain_and_wait(self.process, self.stderr_tail)
+            )
+            await _kill_process_group(self.process, drained)
+
+    def stop_watchdog(self) -> None:
+        if self._watchdog:
+            self._watchdog.cancel()
+
+    def check(self, duration: float) -> None:
+        log.debug(
+            "[%s] streamed %s lines, exited with %s in %.2fs",
+            self.command,
+            self.num_lines,
+            self.process.returncode,
+            duration,
+        )
+        if self.process.returncode != 0:
+            raise CmdLineError(
+                self.command, self.stderr_tail.result().decode(errors="replace")
+            )
+
+
+@contextlib.asynccontextmanager
+async def stream_command_lines(
+    command: Union[str, list[str]],
+    cwd: str = ".",
+    *,
+    timeout: Optional[float] = None,
+) -> AsyncIterator[AsyncIterator[str]]:
+    """Runs command as run_process does and yields the lines of its stdout
+
+        async with stream_command_lines(["git", "for-each-ref"], cwd) as lines:
+            async for line in lines:
+                ...
+
+    Each line is decoded as it comes, without its endline. Only STREAM_BUFFER_SIZE
+    bytes of stdout and the last STDERR_TAIL_SIZE bytes of stderr are held. The
+    process is killed if the block is left before the end of the output.
+
+    raises CmdLineError if the command fails (when leaving the block)
+    raises CmdTimeoutError on timeout
+    """
+    timeout = _limits.timeout if timeout is None else timeout
+    async with _limits.semaphore():
+        start = time.monotonic()
+        process = await _spawn_recorded(command, cwd, start)
+        stream = _LineStream(command, process, timeout)
+        try:
+            yield stream.lines()
+            if not await stream.finish():
+                return
+        except BaseException:
+            # NOTE: timeouts, cancellation and errors of the block
+            await stream.abort()
+            raise
+        finally:
+            stream.stop_watchdog()
+            metrics.record(
+                command,
+                time.monotonic() - start,
+                process.returncode,
+                stream.output_bytes,
+            )
+    stream.check(time.monotonic() - start)
+
+
+@dataclass
+class CoProcess:
+    """Long-lived child process, queried through its stdin and stdout"""
+
+    command: list[str]
+    process: Process
+    timeout: float  # seconds, for each exchange with the process, 0 waits forever
+    start: float = field(default_factory=time.monotonic)
+    stopped: bool = False
+
+    async def exchange(self, awaitable: Awaitable[T]) -> T:
+        """Awaits a write to or a read from the process, within the cap
+
+        raises CmdTimeoutError if it takes longer than timeout (the process is killed)
+        """
+        async with _limits.semaphore():
+            try:
+                return await asyncio.wait_for(awaitable, self.timeout or None)
+            except asyncio.TimeoutError as err:
+                log.warning("[%s] killed after %ss", self.command, self.timeout)
+                await self.stop(grace=0)
+                raise CmdTimeoutError(self.command, self.timeout) from err
+
+    async def stop(self, grace: float = _KILL_GRACE_S) -> None:
+        """Closes its stdin, kills its process group unless it exits within grace"""
+        if self.stopped:
+            return
+        self.stopped = True
+        assert self.process.stdin  # nosec
+        if not self.process.stdin.is_closing():
+            self.process.stdin.close()
+        exited = asyncio.ensure_future(self.process.wait())
+        try:
+            await asyncio.wait_for(asyncio.shield(exited), grace)
+        except asyncio.TimeoutError:
+            log.debug("[%s] killed, it did not exit on its own", self.command)
+            await _kill_process_group(self.process, exited)
+        except asyncio.CancelledError:
+            await _kill_process_group(self.process, exited)
+            raise
+        finally:
+            metrics.record(
+                self.command, time.monotonic() - self.start, self.process.returncode
+            )
+
+
+async def spawn_coprocess(
+    command: list[str], cwd: str = ".", *, timeout: Optional[float] = None
+) -> CoProcess:
+    """Starts command once the cap allows it, in its own process group
+
+    Its stdin and stdout are pipes, its stderr is discarded. The process only
+    holds a place in the cap while spawning and during each exchange. timeout
+    defaults to the configured one (SEE run_process).
+
+    raises CmdLineError if the command cannot be started
+    """
+    timeout = _limits.timeout if timeout is None else timeout
+    async with _limits.semaphore():
+        start = time.monotonic()
+        process = await _spawn_recorded(command, cwd, start, interactive=True)
+    return CoProcess(command, process, timeout, start)
+
+
+async def exec_command_async(
+    program_and_args: list[str],
+    cwd: str = ".",
+    *,
+    strip_endline: bool = True,
+    timeout: Optional[float] = None,
+) -> Optional[str]:
+    # NOTE: any change in the signature has to be applied as well in the associated test mock
+    """Create a subprocess
+
+    returns output.strip('\n') or None if no outputs
+    raises CmdLineError (CmdTimeoutError on timeout, SEE run_process)
+    """
+    result = await run_process(program_and_args, cwd, timeout=timeout)
+    return result.output(strip_endline)
 
 
 async def shell_command_async(
-    cmd: str, cwd: str = ".", *, strip_endline: bool = True
+    cmd: str,
+    cwd: str = ".",
+    *,
+    strip_endline: bool = True,
+    timeout: Optional[float] = None,
 ) -> Optional[str]:
     """Run the cmd shell command
 
     returns output.strip('\n') or None if no outputs
-    raises CmdLineError
+    raises CmdLineError (CmdTimeoutError on timeout, SEE run_process)
     """
-    proc = await asyncio.create_subprocess_shell(
-        cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        cwd=cwd,
-    )
-
-    return await _wait_and_process_results(
-        proc, command=cmd, strip_endline=strip_endline
-    )
+    result = await run_process(cmd, cwd, timeout=timeout)
+    return result.output(strip_endline)
 
 
 #
@@ -0,0 +1,99 @@
+""" Decides whether the repos watched with synced_via_tags are at the same release
+
+A release is deployed once every repo with a tags regexp carries it: the first
+capture group of the tags on each repo's latest tagged commit (the tags themselves
+if the regexp has no group) must have a name in common.
+"""
+
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .git_refs import RefSnapshot, TagIndex
+
+
+@dataclass(frozen=True)
+class TagSyncStatus:
+    # repo id -> release names on its latest tagged commit
+    release_names: dict[str, frozenset[str]] = field(default_factory=dict)
+    common_release_names: frozenset[str] = frozenset()
+    # repos without the release of the most recently tagged repo
+    blocking_repo_ids: tuple[str, ...] = ()
+
+    @property
+    def in_sync(self) -> bool:
+        return bool(self.common_release_names)
+
+
+class TagSyncResolver:
+    """Intersects the release names of the repos, cached until a snapshot changes"""
+
+    def __init__(self):
+        self._snapshots: list[tuple[str, RefSnapshot]] = []
+        self._status: Optional[TagSyncStatus] = None
+
+    def _is_cached(self, snapshots: list[tuple[str, RefSnapshot]]) -> bool:
+        # NOTE: snapshots are replaced (not modified) whenever the refs are listed
+        return (
+            self._status is not None
+            and len(snapshots) == len(self._snapshots)
+            and all(
+                repo_id == cached_id and snapshot is cached
+                for (repo_id, snapshot), (cached_id, cached) in zip(
+                    snapshots, self._snapshots
+                )
+            )
+        )
+
+    def resolve(
+        self, repos: Iterable[tuple[str, RefSnapshot, TagIndex]]
+    ) -> TagSyncStatus:
+        """repos are (repo id, ref snapshot, tag index updated with the snapshot)"""
+        repos = list(repos)
+        snapshots = [(repo_id, snapshot) for repo_id, snapshot, _ in repos]
+        if self._is_cached(snapshots):
+            assert self._status  # nosec
+            return self._status
+
+        release_names: dict[str, frozenset[str]] = {}
+        latest_creatordates: dict[str, int] = {}
+        for repo_id, snapshot, tag_index in repos:
+            latest_tag = tag_index.latest_tag
+            if latest_tag is None:
+                # NOTE: repos without matching tags do not take part in the sync
+                continue
+            latest_info = snapshot.tags[latest_tag]
+            release_names[repo_id] = frozenset(
+                tag_index.release_names_on_sha(latest_info.sha)
+            )
+            latest_creatordates[repo_id] = latest_info.creatordate
+
+        common_release_names: frozenset[str] = (
+            frozenset.intersection(*release_names.values())
+            if release_names
+            else frozenset()
+        )
+        blocking_repo_ids: tuple[str, ...] = ()
+        if release_names and not common_release_names:
+            leading_repo_id = max(latest_creatordates, key=latest_creatordates.get)
+            blocking_repo_ids = tuple(
+                sorted(
+                    repo_id
+                    for repo_id, names in release_names.items()
+                    if not names & release_names[leading_repo_id]
+                )
+            )
+
+        self._snapshots = snapshots
+        self._status = TagSyncStatus(
+            release_names=release_names,
+            common_release_names=common_release_names,
+            blocking_repo_ids=blocking_repo_ids,
+        )
+        return self._status
+
+
+__all__: tuple[str, ...] = (
+    "TagSyncResolver",
+    "TagSyncStatus",
+)
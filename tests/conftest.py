@@ -20,6 +20,25 @@ current_dir = Path(sys.argv[0] if __name__ == "__main__" else __file__).resolve(
 ## FIXTURES
 pytest_plugins = ["fixtures.fixture_portainer"]
 
+
+def pytest_addoption(parser: pytest.Parser):
+    parser.addoption(
+        "--run-benchmarks",
+        action="store_true",
+        default=False,
+        help="also runs the tests marked as benchmark (wall-clock comparisons)",
+    )
+
+
+def pytest_collection_modifyitems(config: pytest.Config, items: list[pytest.Item]):
+    if config.getoption("--run-benchmarks"):
+        return
+    skip_benchmark = pytest.mark.skip(reason="needs --run-benchmarks")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
 ## DIRs
 
 
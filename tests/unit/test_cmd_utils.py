@@ -4,9 +4,15 @@
 # pylint: disable=unused-variable
 # pylint: disable=wildcard-import
 
+import asyncio
+import os
+import time
 from asyncio import AbstractEventLoop
+from collections.abc import Iterator
+from pathlib import Path
 
 import pytest
+from pytest_mock import MockerFixture
 
 from simcore_service_deployment_agent import exceptions, subprocess_utils
 
@@ -29,3 +35,146 @@ async def test_valid_cmd_returns_None(event_loop: AbstractEventLoop):
 async def test_invalid_cmd(event_loop: AbstractEventLoop):
     with pytest.raises(exceptions.CmdLineError):
         await subprocess_utils.exec_command_async(["whoamiasd"])
+
+
+@pytest.fixture
+def process_limits() -> Iterator[None]:
+    yield
+    subprocess_utils.configure(
+        timeout=subprocess_utils.DEFAULT_TIMEOUT_S,
+        max_processes=subprocess_utils.DEFAULT_MAX_PROCESSES,
+    )
+
+
+def _is_running(pid: int) -> bool:
+    # NOTE: killed orphans may stay zombies if nothing reaps them
+    stat = Path(f"/proc/{pid}/stat")
+    return stat.exists() and stat.read_text().rsplit(")", 1)[1].split()[0] != "Z"
+
+
+def _running_in_group(pgid: int) -> list[int]:
+    pids = []
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # NOTE: state and process group follow the command in parentheses
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if int(fields[2]) == pgid and fields[0] != "Z":
+            pids.append(int(stat.parent.name))
+    return pids
+
+
+async def test_run_process_result(event_loop: AbstractEventLoop):
+    result = await subprocess_utils.run_process(
+        "echo out; echo err >&2; exit 3", check=False
+    )
+    assert result.returncode == 3
+    assert result.stdout == "out\n"
+    assert result.stderr == "err\n"
+    assert result.output() == "out"
+    assert result.duration > 0
+
+    with pytest.raises(exceptions.CmdLineError, match="err"):
+        await subprocess_utils.run_process("echo err >&2; exit 3")
+
+
+async def test_timeout_kills_process_group(
+    event_loop: AbstractEventLoop, tmp_path: Path, process_limits: None
+):
+    subprocess_utils.configure(timeout=0.5)
+    with pytest.raises(exceptions.CmdTimeoutError):
+        # the child of the shell has to be killed as well
+        await subprocess_utils.shell_command_async(
+            "sleep 30 & echo $! > child.pid; wait", cwd=f"{tmp_path}"
+        )
+    assert not _is_running(int((tmp_path / "child.pid").read_text()))
+
+    # a per-call timeout overrides the default one
+    assert (
+        await subprocess_utils.exec_command_async(
+            ["sh", "-c", "sleep 1; echo done"], timeout=5
+        )
+        == "done"
+    )
+
+
+async def test_cancellation_kills_process(
+    event_loop: AbstractEventLoop, mocker: MockerFixture
+):
+    spawn_spy = mocker.spy(asyncio, "create_subprocess_exec")
+    task = asyncio.create_task(
+        subprocess_utils.exec_command_async(["sh", "-c", "sleep 30 & wait"])
+    )
+    while spawn_spy.spy_return is None:
+        await asyncio.sleep(0.1)
+    pid = spawn_spy.spy_return.pid
+    assert os.getpgid(pid) == pid
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # the shell and its sleep
+    assert not _is_running(pid)
+    assert not _running_in_group(pid)
+
+
+async def test_concurrent_processes_are_capped(
+    event_loop: AbstractEventLoop, process_limits: None
+):
+    subprocess_utils.configure(max_processes=2)
+    start = time.monotonic()
+    results = await asyncio.gather(
+        *(subprocess_utils.run_process(["sleep", "0.5"]) for _ in range(4))
+    )
+    # 2 rounds of 2 processes
+    assert time.monotonic() - start >= 1
+    assert all(result.returncode == 0 for result in results)
+
+
+async def test_stream_command_lines(event_loop: AbstractEventLoop):
+    async with subprocess_utils.stream_command_lines(
+        ["printf", "a\\nb\\n\\nlast"]
+    ) as lines:
+        assert [line async for line in lines] == ["a", "b", "", "last"]
+
+    num_lines = 0
+    async with subprocess_utils.stream_command_lines("seq 100000") as lines:
+        async for line in lines:
+            num_lines += 1
+            assert int(line) == num_lines
+    assert num_lines == 100000
+
+    with pytest.raises(exceptions.CmdLineError, match="failed"):
+        async with subprocess_utils.stream_command_lines(
+            "echo out; echo failed >&2; exit 1"
+        ) as lines:
+            assert [line async for line in lines] == ["out"]
+
+
+async def test_stream_command_lines_kills_unread_process(
+    event_loop: AbstractEventLoop, tmp_path: Path
+):
+    # an endless output read partially
+    async with subprocess_utils.stream_command_lines(
+        "echo $$ > shell.pid; yes", cwd=f"{tmp_path}"
+    ) as lines:
+        async for line in lines:
+            assert line == "y"
+            break
+    assert not _is_running(int((tmp_path / "shell.pid").read_text()))
+
+    with pytest.raises(exceptions.CmdTimeoutError):
+        async with subprocess_utils.stream_command_lines(
+            "echo first; sleep 30", timeout=0.5
+        ) as lines:
+            async for line in lines:
+                assert line == "first"
+
+    # a line longer than the buffer
+    with pytest.raises(exceptions.CmdLineError):
+        async with subprocess_utils.stream_command_lines(
+            f"head -c {2 * subprocess_utils.STREAM_BUFFER_SIZE} /dev/zero"
+        ) as lines:
+            async for _ in lines:
+                pass
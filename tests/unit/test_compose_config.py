@@ -0,0 +1,254 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+
+import os
+import shutil
+import subprocess
+from asyncio import AbstractEventLoop
+from pathlib import Path
+from typing import Any
+
+import pytest
+import yaml
+from pytest import MonkeyPatch
+
+from simcore_service_deployment_agent import auto_deploy_task
+from simcore_service_deployment_agent.compose_config import (
+    interpolate,
+    load_compose_config,
+    parse_env_file,
+)
+from simcore_service_deployment_agent.exceptions import ConfigurationError
+from simcore_service_deployment_agent.git_url_watcher import GitUrlWatcher
+from simcore_service_deployment_agent.subprocess_utils import run_command
+
+# the process environment of the merge cases, it wins over the .env file
+ENVIRON = {"SWARM_STACK_NAME": "staging", "HOME": "/root"}
+GOLDEN_CASES = [
+    # compose files relative to the mocks, env files, golden output
+    (["valid_docker_stack.yaml"], [], "valid_docker_stack.yaml"),
+    (
+        ["valid_docker_stack_local_registry.yaml"],
+        [],
+        "valid_docker_stack_local_registry.yaml",
+    ),
+    (
+        ["compose/docker-compose.yml", "compose/docker-compose.deploy.yml"],
+        ["compose/.env"],
+        "docker-compose.yml",
+    ),
+]
+
+
+def _load_golden(mocks_dir: Path, name: str, project_dir: Path) -> dict[str, Any]:
+    text = (mocks_dir / "compose" / "golden" / name).read_text()
+    text = text.replace("@PROJECT_PARENT_DIR@", f"{project_dir.parent}")
+    return yaml.safe_load(text.replace("@PROJECT_DIR@", f"{project_dir}"))
+
+
+@pytest.mark.parametrize("compose_files, env_files, golden", GOLDEN_CASES)
+def test_load_compose_config_matches_golden_output(
+    mocks_dir: Path, compose_files: list[str], env_files: list[str], golden: str
+):
+    paths = [mocks_dir / path for path in compose_files]
+    stack_cfg = load_compose_config(
+        paths, env_files=[mocks_dir / path for path in env_files], environ=ENVIRON
+    )
+    assert stack_cfg == _load_golden(mocks_dir, golden, paths[0].parent.resolve())
+
+
+def _docker_compose_v1() -> bool:
+    if not shutil.which("docker-compose"):
+        return False
+    version = subprocess.run(
+        ["docker-compose", "version", "--short"],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return version.stdout.startswith("1.")
+
+
+@pytest.mark.skipif(
+    not _docker_compose_v1(), reason="needs the docker-compose 1.x binary"
+)
+@pytest.mark.parametrize("compose_files, env_files, golden", GOLDEN_CASES)
+def test_load_compose_config_matches_docker_compose(
+    mocks_dir: Path, compose_files: list[str], env_files: list[str], golden: str
+):
+    paths = [mocks_dir / path for path in compose_files]
+    command = ["docker-compose"]
+    for env_file in env_files:
+        command += ["--env-file", f"{mocks_dir / env_file}"]
+    for path in paths:
+        command += ["-f", f"{path}"]
+    output = subprocess.run(
+        [*command, "config"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={"PATH": os.environ["PATH"], **ENVIRON},
+    ).stdout
+    assert load_compose_config(
+        paths, env_files=[mocks_dir / path for path in env_files], environ=ENVIRON
+    ) == yaml.safe_load(output)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("${TAG}", "1.0"),
+        ("nginx:$TAG-alpine", "nginx:1.0-alpine"),
+        ("$$TAG costs $$5", "$TAG costs $5"),
+        ("${UNSET}", ""),
+        ("${UNSET:-default}", "default"),
+        ("${EMPTY:-default}", "default"),
+        ("${EMPTY-default}", ""),
+        ("${UNSET-default}", "default"),
+        ("${TAG:?is required}", "1.0"),
+        ("${EMPTY?is required}", ""),
+    ],
+)
+def test_interpolate(value: str, expected: str):
+    assert interpolate(value, {"TAG": "1.0", "EMPTY": ""}) == expected
+
+
+@pytest.mark.parametrize(
+    "value", ["${UNSET:?is required}", "${EMPTY:?}", "${UNSET?}", "$", "${}", "${1A}"]
+)
+def test_interpolate_errors(value: str):
+    with pytest.raises(ConfigurationError):
+        interpolate(value, {"EMPTY": ""})
+
+
+def test_parse_env_file(tmp_path: Path):
+    env_file = tmp_path / ".env"
+    env_file.write_text(
+        "\n".join(
+            [
+                "# a comment",
+                "",
+                "export EXPORTED=1",
+                "PLAIN=some value # a comment",
+                "SINGLE='${HOST} # kept'",
+                'DOUBLE="line\\nbreak"',
+                "URL=http://${HOST}:${PORT:-8080}/path",
+                "HOST=overridden",
+                "FROM_FILE=${HOST}",
+                "NO_VALUE",
+                "EMPTY=",
+            ]
+        )
+    )
+    assert parse_env_file(env_file, {"HOST": "localhost"}) == {
+        "EXPORTED": "1",
+        "PLAIN": "some value",
+        "SINGLE": "${HOST} # kept",
+        "DOUBLE": "line\nbreak",
+        "URL": "http://localhost:8080/path",
+        "HOST": "overridden",
+        "FROM_FILE": "overridden",
+        "NO_VALUE": None,
+        "EMPTY": "",
+    }
+
+
+def test_load_compose_config_converts_interpolated_values(tmp_path: Path):
+    compose = tmp_path / "docker-compose.yml"
+    compose.write_text(
+        "version: '3.8'\n"
+        "services:\n"
+        "  app:\n"
+        "    image: app\n"
+        "    read_only: ${READ_ONLY}\n"
+        "    ports:\n"
+        "      - target: ${PORT}\n"
+        "        published: ${PORT}\n"
+        "        mode: host\n"
+        "      - 127.0.0.1:${PORT}:80\n"
+        "    deploy:\n"
+        "      replicas: ${REPLICAS}\n"
+        "      resources:\n"
+        "        limits:\n"
+        "          cpus: '${CPUS}'\n"
+    )
+    stack_cfg = load_compose_config(
+        [compose],
+        environ={"READ_ONLY": "yes", "PORT": "8080", "REPLICAS": "3", "CPUS": "0.5"},
+    )
+    app = stack_cfg["services"]["app"]
+    assert app["read_only"] is True
+    assert app["ports"] == [
+        {"target": 8080, "published": 8080, "mode": "host"},
+        "127.0.0.1:8080:80/tcp",
+    ]
+    assert app["deploy"] == {"replicas": 3, "resources": {"limits": {"cpus": 0.5}}}
+
+
+def test_load_compose_config_rejects_mismatching_versions(tmp_path: Path):
+    (tmp_path / "a.yml").write_text("version: '3.7'\nservices: {}\n")
+    (tmp_path / "b.yml").write_text("version: '3.8'\nservices: {}\n")
+    (tmp_path / "c.yml").write_text("version: '2.4'\nservices: {}\n")
+    with pytest.raises(ConfigurationError, match="Version mismatch"):
+        load_compose_config([tmp_path / "a.yml", tmp_path / "b.yml"], environ={})
+    with pytest.raises(ConfigurationError, match="3.x"):
+        load_compose_config([tmp_path / "c.yml"], environ={})
+
+
+async def test_create_stack_with_compose_recipe(
+    event_loop: AbstractEventLoop, tmp_path: Path, monkeypatch: MonkeyPatch
+):
+    repo_path = tmp_path / "ops"
+    repo_path.mkdir()
+    (repo_path / "compose.yml").write_text(
+        "version: '3.7'\nservices:\n  web:\n    image: nginx:${TAG}\n"
+    )
+    (repo_path / "compose.deploy.yml").write_text(
+        "version: '3.7'\nservices:\n  web:\n    ports: ['80:80']\n"
+    )
+    (repo_path / ".env").write_text("TAG=1.0\n")
+    run_command(
+        "git init -b master; git config user.name tester;"
+        "git config user.email tester@test.com; git add .; git commit -m 'first'",
+        cwd=repo_path,
+    )
+    app_config: dict[str, Any] = {
+        "main": {
+            "synced_via_tags": False,
+            "watched_git_repositories": [
+                {
+                    "id": "ops",
+                    "url": f"file://localhost{repo_path}",
+                    "branch": "master",
+                    "tags": "",
+                    "paths": ["compose.yml"],
+                    "username": "",
+                    "password": "",
+                }
+            ],
+            "docker_stack_recipe": {
+                "files": [],
+                "workdir": "ops",
+                "command": "",
+                "compose": {
+                    "files": ["compose.yml", "compose.deploy.yml"],
+                    "env_files": [".env"],
+                },
+                "stack_file": "stack.yml",
+                "excluded_services": [],
+                "excluded_volumes": [],
+                "additional_parameters": {},
+                "services_prefix": "",
+            },
+        }
+    }
+    monkeypatch.delenv("TAG", raising=False)
+    git_watcher = GitUrlWatcher(app_config)
+    await git_watcher.init()
+
+    stack_cfg = await auto_deploy_task.create_stack(git_watcher, app_config)
+    assert stack_cfg["services"] == {
+        "web": {"image": "nginx:1.0", "ports": [{"published": 80, "target": 80}]}
+    }
+
+    await git_watcher.cleanup()
@@ -139,3 +139,33 @@ async def test_docker_registries_watcher_when_registry_fetch_fails(
         "ubuntu:latest": "image signature changed",
     }
     _assert_docker_client_calls(mock_docker_client, registry_config, valid_docker_stack)
+
+
+@pytest.mark.parametrize(
+    "image, expected_registry",
+    [
+        ("alpine:latest", "docker.io"),
+        ("itisfoundation/webserver:master", "docker.io"),
+        ("docker.io/itisfoundation/webserver", "docker.io"),
+        ("127.0.0.1:5000/simcore/services/comp/itis/sleeper:2.1.1", "127.0.0.1:5000"),
+        ("registry.osparc.io/simcore/webserver:latest", "registry.osparc.io"),
+        ("localhost/webserver", "localhost"),
+    ],
+)
+def test_get_image_registry(image: str, expected_registry: str):
+    assert docker_registries_watcher.get_image_registry(image) == expected_registry
+
+
+async def test_docker_registries_watcher_checks_only_requested_registries(
+    mock_docker_client,
+    docker_watcher: DockerRegistriesWatcher,
+):
+    assert docker_watcher.registries == {"docker.io"}
+    mock_docker_client.return_value.images.get_registry_data.return_value.attrs = {
+        "Descriptor": "somenewsignature"
+    }
+    assert await docker_watcher.check_for_changes({"registry.osparc.io"}) == {}
+    assert set(await docker_watcher.check_for_changes({"docker.io"})) == {
+        "alpine:latest",
+        "ubuntu:latest",
+    }
@@ -0,0 +1,108 @@
+from typing import Optional
+
+import pytest
+
+from simcore_service_deployment_agent.fetch_planner import (
+    Refspec,
+    plan_fetch,
+    plan_store_fetch,
+    tags_regexp_to_prefix,
+)
+
+
+@pytest.mark.parametrize(
+    "regexp, expected_prefix",
+    [
+        ("^staging_.+$", "staging_"),
+        ("^test(staging_.+)$", "test"),
+        ("^testtag_v[0-9]+.[0-9]+.[0-9]+$", "testtag_v"),
+        (r"^v\d+\.\d+\.\d+$", "v"),
+        (r"^release\-1\.", "release-1."),
+        ("^stagings?_", "staging"),
+        ("^stagingx+_", "stagingx"),
+        ("^a{2}", None),
+        ("^(staging|release)_", None),
+        ("^staging_|^release_", None),
+        ("staging_", None),
+        ("^.*", None),
+        (r"^\bv", None),
+        ("", None),
+    ],
+)
+def test_tags_regexp_to_prefix(regexp: str, expected_prefix: Optional[str]):
+    assert tags_regexp_to_prefix(regexp) == expected_prefix
+
+
+def test_refspec_map():
+    glob = Refspec("refs/tags/staging_*", "refs/tags/staging_*")
+    assert glob.map("refs/tags/staging_1") == "refs/tags/staging_1"
+    assert glob.map("refs/tags/staging_") == "refs/tags/staging_"
+    assert glob.map("refs/tags/v1") is None
+    assert glob.is_pruned("refs/tags/staging_1")
+    assert not glob.is_pruned("refs/tags/v1")
+
+    branch = Refspec("refs/heads/master", "refs/remotes/origin/master")
+    assert branch.map("refs/heads/master") == "refs/remotes/origin/master"
+    assert branch.map("refs/heads/master2") is None
+    assert not branch.is_pruned("refs/remotes/origin/master")
+    assert f"{branch}" == "+refs/heads/master:refs/remotes/origin/master"
+
+
+def test_plan_fetch():
+    branch = Refspec("refs/heads/master", "refs/remotes/origin/master")
+    assert plan_fetch("master", "", None).refspecs == (branch,)
+
+    plan = plan_fetch("master", "^test(staging_.+)$", None)
+    assert plan.refspecs == (branch, Refspec("refs/tags/test*", "refs/tags/test*"))
+    assert plan.map("refs/tags/teststaging_1") == "refs/tags/teststaging_1"
+    assert plan.map("refs/tags/staging_1") is None
+
+    # without prefix: the matching tags listed by the remote
+    remote_refs = {
+        "refs/heads/master": "1" * 40,
+        "refs/tags/v1-staging": "2" * 40,
+        "refs/tags/v2-staging": "3" * 40,
+        "refs/tags/v2-production": "3" * 40,
+    }
+    plan = plan_fetch(
+        "master",
+        "staging",
+        remote_refs,
+        local_tags=["v0-staging", "v1-staging", "v0-production"],
+    )
+    assert plan.refspecs == (
+        branch,
+        Refspec("refs/tags/v1-staging", "refs/tags/v1-staging"),
+        Refspec("refs/tags/v2-staging", "refs/tags/v2-staging"),
+    )
+    assert plan.stale_tags == ("v0-staging",)
+    assert not plan.is_pruned("refs/tags/v1-staging")
+
+    # unless they could not be listed
+    plan = plan_fetch("master", "staging", None, local_tags=["v0-staging"])
+    assert plan.refspecs == (branch, Refspec("refs/tags/*", "refs/tags/*"))
+    assert plan.stale_tags == ()
+
+
+def test_plan_store_fetch():
+    remote_refs = {
+        "refs/heads/master": "1" * 40,
+        "refs/heads/dev": "2" * 40,
+        "refs/tags/v1-staging": "2" * 40,
+        "refs/tags/staging_1": "2" * 40,
+    }
+    plan = plan_store_fetch(
+        [("master", "^staging_"), ("dev", "staging"), ("master", "")],
+        remote_refs,
+        local_tags=["v0-staging", "staging_0", "v1-staging"],
+    )
+    # same names as on the remote, each refspec once
+    assert plan.refspecs == (
+        Refspec("refs/heads/dev", "refs/heads/dev"),
+        Refspec("refs/heads/master", "refs/heads/master"),
+        Refspec("refs/tags/staging_*", "refs/tags/staging_*"),
+        Refspec("refs/tags/staging_1", "refs/tags/staging_1"),
+        Refspec("refs/tags/v1-staging", "refs/tags/v1-staging"),
+    )
+    # staging_0 is pruned by the glob
+    assert plan.stale_tags == ("v0-staging",)
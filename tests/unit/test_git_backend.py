@@ -0,0 +1,227 @@
+# pylint: disable=redefined-outer-name
+
+import time
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+from yarl import URL
+
+from simcore_service_deployment_agent import git_url_watcher, subprocess_utils
+from simcore_service_deployment_agent.fetch_planner import plan_fetch
+from simcore_service_deployment_agent.git_backend import GitBackend
+from simcore_service_deployment_agent.git_dulwich_backend import DulwichBackend
+from simcore_service_deployment_agent.git_url_watcher import GitCLIBackend
+from simcore_service_deployment_agent.subprocess_utils import run_command
+
+
+@pytest.fixture
+def remote_repo(tmp_path: Path) -> Path:
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    run_command(
+        "git init -b master; git config user.name tester;"
+        "git config user.email tester@test.com;"
+        "mkdir folder; echo 'content' > folder/file.txt; git add .;"
+        "git commit -m 'first'; git tag -a v1 -m 'annotated';"
+        "echo 'other' > other.txt; git add .; git commit -m 'second';"
+        "git tag v2",
+        cwd=remote,
+    )
+    return remote
+
+
+async def _clone(backend: GitBackend, remote: Path, directory: Path) -> str:
+    await backend.clone(URL(f"file://localhost{remote}"), f"{directory}", "master")
+    await backend.fetch(f"{directory}")
+    return f"{directory}"
+
+
+async def test_backends_agree(remote_repo: Path, tmp_path: Path):
+    cli_backend, dulwich_backend = GitCLIBackend(), DulwichBackend()
+    cli_clone = await _clone(cli_backend, remote_repo, tmp_path / "cli")
+    dulwich_clone = await _clone(dulwich_backend, remote_repo, tmp_path / "dulwich")
+    names = ("HEAD", "v1^{commit}", "v1^{tree}", "v1:folder/file.txt", "v1:other.txt")
+
+    cli_snapshot = await cli_backend.get_ref_snapshot(cli_clone)
+    dulwich_snapshot = await dulwich_backend.get_ref_snapshot(dulwich_clone)
+    assert dulwich_snapshot.head_sha == cli_snapshot.head_sha
+    assert dulwich_snapshot.tags == cli_snapshot.tags
+    assert dulwich_snapshot.tag_lines == cli_snapshot.tag_lines
+    assert await dulwich_backend.resolve(dulwich_clone, *names) == (
+        await cli_backend.resolve(cli_clone, *names)
+    )
+    (blob,) = await cli_backend.resolve(cli_clone, "v1:folder/file.txt")
+    assert blob
+    assert await cli_backend.read_blob(cli_clone, blob) == "content\n"
+    assert await dulwich_backend.read_blob(dulwich_clone, blob) == "content\n"
+    assert await dulwich_backend.ls_remote(dulwich_clone, tags=True) == (
+        await cli_backend.ls_remote(cli_clone, tags=True)
+    )
+
+    for backend, clone in ((cli_backend, cli_clone), (dulwich_backend, dulwich_clone)):
+        await backend.checkout(clone, "v1")
+        (Path(clone) / "untracked.txt").write_text("garbage")
+        await backend.clean(clone)
+        assert sorted(
+            f"{path.relative_to(clone)}"
+            for path in Path(clone).rglob("*")
+            if ".git" not in path.parts
+        ) == ["folder", "folder/file.txt"]
+        assert await backend.get_changelog(clone, since="v1", until="v2") == (
+            run_command("git log --oneline v1..v2", cwd=remote_repo)
+        )
+
+    await cli_backend.close()
+    await dulwich_backend.close()
+
+
+async def test_backends_fast_forward(remote_repo: Path, tmp_path: Path):
+    backends = (GitCLIBackend(), DulwichBackend())
+    clones = [
+        await _clone(backend, remote_repo, tmp_path / type(backend).__name__)
+        for backend in backends
+    ]
+    for backend, clone in zip(backends, clones):
+        await backend.checkout(clone, None)
+    run_command("echo 'third' > other.txt; git commit -am 'third'", cwd=remote_repo)
+    for backend, clone in zip(backends, clones):
+        await backend.fetch(clone)
+        await backend.fast_forward(clone, "master")
+        assert (Path(clone) / "other.txt").read_text() == "third\n"
+        assert (await backend.get_ref_snapshot(clone)).head_sha == run_command(
+            "git rev-parse HEAD", cwd=remote_repo
+        )
+        await backend.close()
+
+
+async def test_cli_backend_deepens_shallow_clones_in_steps(
+    tmp_path: Path, mocker: MockerFixture
+):
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    run_command(
+        "git init -b master; git config user.name tester;"
+        "git config user.email tester@test.com;"
+        "git commit --allow-empty -m 'first'; git tag v1;"
+        "git checkout -q -b other; git commit --allow-empty -m 'other'; git tag v2;"
+        "git checkout -q master;"
+        "for i in $(seq 100); do git commit --allow-empty -q -m $i; done",
+        cwd=remote,
+    )
+    backend = GitCLIBackend()
+    clone = await _clone(backend, remote, tmp_path / "clone")
+    plan = plan_fetch("master", "^v", None)
+    head, v1, v2 = await backend.resolve(clone, "HEAD", "v1", "v2")
+    assert head and v1 and v2
+    record_spy = mocker.spy(subprocess_utils.metrics, "record")
+
+    def _fetches() -> list[str]:
+        commands = [call.args[0] for call in record_spy.call_args_list]
+        record_spy.reset_mock()
+        return [command[2] for command in commands if command[:2] == ["git", "fetch"]]
+
+    assert await backend.is_ancestor(clone, v1, head, plan)
+    assert _fetches() == ["--deepen=64", "--deepen=512"]
+
+    assert not await backend.is_ancestor(clone, v2, head, plan)
+    assert not await backend.is_ancestor(clone, v2, head, plan)
+    # the history was complete already, the unrelated tag is remembered
+    assert record_spy.call_count == 3
+    assert _fetches() == []
+
+    await backend.close()
+
+
+async def test_cli_backend_does_not_unshallow_for_a_tag_off_the_branch(
+    remote_repo: Path, tmp_path: Path, mocker: MockerFixture
+):
+    mocker.patch.object(git_url_watcher, "DEEPEN_STEPS", (1, 2))
+    run_command(
+        "git checkout -q -b other v1; git commit --allow-empty -m 'other';"
+        "git tag v3; git checkout -q master;"
+        "for i in $(seq 10); do git commit --allow-empty -q -m $i; done",
+        cwd=remote_repo,
+    )
+    backend = GitCLIBackend()
+    clone = await _clone(backend, remote_repo, tmp_path / "clone")
+    head, v3 = await backend.resolve(clone, "HEAD", "v3")
+    assert head and v3
+    deepen_spy = mocker.spy(git_url_watcher, "_git_deepen")
+
+    assert not await backend.is_ancestor(
+        clone, v3, head, plan_fetch("master", "^v", None)
+    )
+    assert [call.args[1] for call in deepen_spy.call_args_list] == [1, 2]
+    assert run_command("git rev-parse --is-shallow-repository", cwd=clone) == "true"
+
+    # remembered, not deepened again
+    assert not await backend.is_ancestor(
+        clone, v3, head, plan_fetch("master", "^v", None)
+    )
+    assert deepen_spy.call_count == 2
+
+    await backend.close()
+
+
+async def test_dulwich_backend_polls_without_spawning(
+    remote_repo: Path, tmp_path: Path, mocker: MockerFixture
+):
+    # what every polling cycle does on each watched repo
+    spawns = {}
+    for backend in (GitCLIBackend(), DulwichBackend()):
+        clone = await _clone(backend, remote_repo, tmp_path / type(backend).__name__)
+        record_spy = mocker.spy(subprocess_utils.metrics, "record")
+        for _ in range(3):
+            await backend.get_ref_snapshot(clone)
+            await backend.resolve(clone, "HEAD:folder/file.txt", "v2:folder/file.txt")
+        spawns[type(backend).__name__] = record_spy.call_count
+        mocker.stop(record_spy)
+        await backend.close()
+
+    assert spawns["GitCLIBackend"] >= 3
+    assert spawns["DulwichBackend"] == 0
+
+
+async def test_dulwich_backend_forgets_dates_of_removed_refs(
+    remote_repo: Path, tmp_path: Path
+):
+    backend = DulwichBackend()
+    clone = await _clone(backend, remote_repo, tmp_path / "dulwich")
+    snapshot = await backend.get_ref_snapshot(clone)
+    # pylint: disable-next=protected-access
+    object_dates = backend._object_dates
+    (v1_sha,) = await backend.resolve(clone, "refs/tags/v1")
+    assert v1_sha
+    assert v1_sha.encode() in object_dates[clone]
+
+    run_command("git tag -d v1", cwd=remote_repo)
+    await backend.fetch(clone)
+    assert set((await backend.get_ref_snapshot(clone)).tags) == set(snapshot.tags) - {
+        "v1"
+    }
+    assert v1_sha.encode() not in object_dates[clone]
+
+    await backend.close()
+    assert not object_dates
+
+
+@pytest.mark.benchmark
+async def test_backends_benchmark(remote_repo: Path, tmp_path: Path):
+    # what every polling cycle does on each watched repo
+    num_cycles = 20
+    timings = {}
+    for backend in (GitCLIBackend(), DulwichBackend()):
+        clone = await _clone(backend, remote_repo, tmp_path / type(backend).__name__)
+        start = time.perf_counter()
+        for _ in range(num_cycles):
+            await backend.get_ref_snapshot(clone)
+            await backend.resolve(clone, "HEAD:folder/file.txt", "v2:folder/file.txt")
+        timings[type(backend).__name__] = time.perf_counter() - start
+        await backend.close()
+
+    print(
+        ", ".join(f"{name}: {timing:.3f}s" for name, timing in timings.items()),
+        f"for {num_cycles} cycles",
+    )
+    assert timings["DulwichBackend"] < timings["GitCLIBackend"]
@@ -0,0 +1,128 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=protected-access
+
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+from pytest import MonkeyPatch
+from pytest_mock import MockerFixture
+
+from simcore_service_deployment_agent import git_cat_file, subprocess_utils
+from simcore_service_deployment_agent.exceptions import CmdLineError, CmdTimeoutError
+from simcore_service_deployment_agent.git_cat_file import GitCatFile
+from simcore_service_deployment_agent.subprocess_utils import run_command
+
+
+def _alive_in_group(pgid: int) -> list[int]:
+    """pids of the processes of group pgid, but the zombies"""
+    pids = []
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # NOTE: the command between parentheses may contain spaces
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if int(fields[2]) == pgid and fields[0] != "Z":
+            pids.append(int(stat.parent.name))
+    return pids
+
+
+@pytest.fixture
+def git_repo(tmp_path: Path) -> Path:
+    run_command(
+        "git init; git config user.name tester; git config user.email tester@test.com;"
+        "mkdir folder; echo 'content' > folder/file.txt; git add .;"
+        "git commit -m 'first'; git tag -a v1 -m 'annotated'",
+        cwd=tmp_path,
+    )
+    return tmp_path
+
+
+async def test_git_cat_file_resolves_names(git_repo: Path):
+    cat_file = GitCatFile(f"{git_repo}")
+
+    head, tag, blob, missing_path, missing_rev = await cat_file.resolve(
+        "HEAD", "v1^{commit}", "v1:folder/file.txt", "HEAD:nope.txt", "nope"
+    )
+    assert head == tag == run_command("git rev-parse HEAD", cwd=git_repo)
+    assert blob == run_command("git rev-parse HEAD:folder/file.txt", cwd=git_repo)
+    assert missing_path is None
+    assert missing_rev is None
+
+    # new refs are seen by the running process
+    run_command("git commit --allow-empty -m 'second'", cwd=git_repo)
+    assert await cat_file.resolve("HEAD") == [
+        run_command("git rev-parse HEAD", cwd=git_repo)
+    ]
+    await cat_file.close()
+
+
+async def test_git_cat_file_pipelines_concurrent_queries(git_repo: Path):
+    cat_file = GitCatFile(f"{git_repo}")
+    head = run_command("git rev-parse HEAD", cwd=git_repo)
+
+    results = await asyncio.gather(
+        *(cat_file.resolve("HEAD", f"HEAD:missing_{i}") for i in range(50))
+    )
+    assert results == [[head, None]] * 50
+    # a single process answered them all
+    assert cat_file._batch
+    assert cat_file._batch.is_alive
+    await cat_file.close()
+    assert cat_file._batch is None
+
+
+async def test_git_cat_file_restarts_dead_process(git_repo: Path):
+    cat_file = GitCatFile(f"{git_repo}")
+    head = run_command("git rev-parse HEAD", cwd=git_repo)
+    assert await cat_file.resolve("HEAD") == [head]
+
+    assert cat_file._batch
+    first_process = cat_file._batch.process
+    first_process.kill()
+    await first_process.wait()
+
+    assert await cat_file.resolve("HEAD") == [head]
+    assert cat_file._batch.process is not first_process
+    await cat_file.close()
+
+
+async def test_git_cat_file_outside_repository_raises(tmp_path: Path):
+    cat_file = GitCatFile(f"{tmp_path}")
+    with pytest.raises(CmdLineError):
+        await cat_file.resolve("HEAD")
+    await cat_file.close()
+
+
+async def test_git_cat_file_runs_as_recorded_coprocess(
+    git_repo: Path, mocker: MockerFixture
+):
+    record_spy = mocker.spy(subprocess_utils.metrics, "record")
+    cat_file = GitCatFile(f"{git_repo}")
+    await cat_file.resolve("HEAD")
+    assert cat_file._batch
+    pid = cat_file._batch.process.pid
+    # NOTE: leader of its own process group, killed with its children
+    assert os.getpgid(pid) == pid
+
+    await cat_file.close()
+    record_spy.assert_called_once()
+    assert record_spy.call_args.args[0] == git_cat_file._CMD
+    assert record_spy.call_args.args[2] == 0
+
+
+async def test_git_cat_file_kills_hung_process(
+    git_repo: Path, monkeypatch: MonkeyPatch, mocker: MockerFixture
+):
+    monkeypatch.setattr(git_cat_file, "_CMD", ["sh", "-c", "sleep 30; :"])
+    monkeypatch.setattr(subprocess_utils._limits, "timeout", 0.5)
+    spawn_spy = mocker.spy(git_cat_file, "spawn_coprocess")
+    cat_file = GitCatFile(f"{git_repo}")
+    with pytest.raises(CmdTimeoutError):
+        await cat_file.resolve("HEAD")
+    assert cat_file._batch is None
+    # not retried, the whole process group is gone: the shell and its sleep
+    spawn_spy.assert_called_once()
+    assert not _alive_in_group(spawn_spy.spy_return.process.pid)
@@ -0,0 +1,105 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+
+import pytest
+
+from simcore_service_deployment_agent.exceptions import CmdLineError
+from simcore_service_deployment_agent.git_maintenance import (
+    DEFAULT_TASK_INTERVALS,
+    MaintenanceScheduler,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def test_maintenance_scheduler_from_config():
+    scheduler = MaintenanceScheduler.from_config(None)
+    assert scheduler.enabled
+    assert scheduler.intervals == DEFAULT_TASK_INTERVALS
+
+    scheduler = MaintenanceScheduler.from_config(
+        {"enabled": False, "budget": 5, "intervals": {"prune": 0}}
+    )
+    assert not scheduler.enabled
+    assert scheduler.budget == 5
+    assert scheduler.intervals == {**DEFAULT_TASK_INTERVALS, "prune": 0}
+
+
+async def test_maintenance_scheduler_runs_due_tasks_within_budget(clock: FakeClock):
+    scheduler = MaintenanceScheduler(
+        {"pack-refs": 10, "prune": 20, "disabled": 0}, budget=5, clock=clock
+    )
+    scheduler.sync(["repo1", "repo2"])
+    calls = []
+
+    async def _run_task(source_id: str, task: str) -> bool:
+        calls.append((source_id, task))
+        clock.now += 2
+        return True
+
+    assert await scheduler.run(_run_task) == 0
+    assert scheduler.due() == []
+
+    clock.now += 20
+    # the most overdue first, stops once the budget is spent
+    assert await scheduler.run(_run_task) == 3
+    assert calls == [("repo1", "pack-refs"), ("repo2", "pack-refs"), ("repo1", "prune")]
+    assert scheduler.due() == [("repo2", "prune")]
+
+    # the caller's budget is capped by the configured one
+    assert await scheduler.run(_run_task, budget=1) == 1
+    assert await scheduler.run(_run_task, budget=0) == 0
+
+    metrics = scheduler.to_dict()
+    assert metrics["sources"]["repo1"]["pack-refs"]["runs"] == 1
+    assert metrics["sources"]["repo1"]["pack-refs"]["last_duration"] == 2
+    assert metrics["sources"]["repo1"]["pack-refs"]["next_run_in"] == pytest.approx(
+        10 - 2 - 2 - 2
+    )
+    assert "disabled" not in metrics["sources"]["repo1"]
+
+    # vanished sources are dropped
+    scheduler.sync(["repo2"])
+    assert list(scheduler.to_dict()["sources"]) == ["repo2"]
+
+
+async def test_maintenance_scheduler_skips_unsupported_and_counts_failures(
+    clock: FakeClock,
+):
+    scheduler = MaintenanceScheduler(
+        {"pack-refs": 10, "commit-graph": 10}, budget=5, clock=clock
+    )
+    scheduler.sync(["repo"])
+
+    async def _run_task(source_id: str, task: str) -> bool:
+        if task == "pack-refs":
+            return False
+        raise CmdLineError("git commit-graph write", "fatal: boom")
+
+    clock.now += 10
+    assert await scheduler.run(_run_task) == 1
+    metrics = scheduler.to_dict()["sources"]["repo"]
+    assert metrics["pack-refs"]["skipped"] == 1
+    assert metrics["pack-refs"]["next_run_in"] is None
+    assert metrics["commit-graph"]["failures"] == 1
+    assert "boom" in metrics["commit-graph"]["last_error"]
+    assert metrics["commit-graph"]["next_run_in"] == 10
+
+    # unsupported tasks are never rescheduled, not even after a sync
+    scheduler.sync(["repo"])
+    clock.now += 10
+    assert scheduler.due() == [("repo", "commit-graph")]
+
+    scheduler.enabled = False
+    assert await scheduler.run(_run_task) == 0
@@ -0,0 +1,361 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+
+import re
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from simcore_service_deployment_agent.git_refs import (
+    FOR_EACH_REF_FORMAT,
+    RefSnapshot,
+    TagIndex,
+    semver_key,
+)
+from simcore_service_deployment_agent.subprocess_utils import run_command
+
+SHA_1 = "1" * 40
+SHA_2 = "2" * 40
+TAG_OBJECT_SHA = "a" * 40
+
+
+@pytest.fixture
+def for_each_ref_output() -> str:
+    lines = [
+        ("refs/heads/master", SHA_2, "", SHA_2[:7], "", "1700000100", ""),
+        ("refs/remotes/origin/master", SHA_2, "", SHA_2[:7], "", "1700000100", ""),
+        # annotated tag
+        (
+            "refs/tags/staging_b",
+            TAG_OBJECT_SHA,
+            SHA_1,
+            TAG_OBJECT_SHA[:7],
+            SHA_1[:7],
+            "1700000050",
+            "2023-11-14T22:14:10+01:00",
+        ),
+        # lightweight tags
+        ("refs/tags/staging_a", SHA_1, "", SHA_1[:7], "", "1700000000", ""),
+        ("refs/tags/v1.0.0", SHA_2, "", SHA_2[:7], "", "1700000100", ""),
+        ("refs/tags/staging_c", SHA_2, "", SHA_2[:7], "", "1700000100", ""),
+    ]
+    return "\n".join("\t".join(line) for line in lines)
+
+
+def test_ref_snapshot_parsing(for_each_ref_output: str):
+    snapshot = RefSnapshot.from_for_each_ref(for_each_ref_output, head_sha=SHA_1)
+
+    assert snapshot.tags["staging_b"].sha == SHA_1
+    assert snapshot.tags["staging_b"].short_sha == SHA_1[:7]
+    assert snapshot.tags["staging_b"].taggerdate == datetime(
+        2023, 11, 14, 21, 14, 10, tzinfo=timezone.utc
+    )
+    assert snapshot.tags["staging_a"].taggerdate is None
+    assert snapshot.refs["refs/remotes/origin/master"].short_sha == SHA_2[:7]
+    assert sorted(snapshot.sha_to_tags[SHA_1]) == ["staging_a", "staging_b"]
+
+    # sorted by date, ties by name
+    assert snapshot.tags_sorted_by_creatordate() == [
+        "staging_a",
+        "staging_b",
+        "staging_c",
+        "v1.0.0",
+    ]
+
+
+def test_tag_index(for_each_ref_output: str):
+    snapshot = RefSnapshot.from_for_each_ref(for_each_ref_output, head_sha=SHA_1)
+
+    index = TagIndex("^staging_").update(snapshot)
+    assert len(index) == 3
+    assert index.latest_tag == "staging_c"
+    assert index.tags_on_sha(snapshot.head_sha) == ["staging_a", "staging_b"]
+    assert index.tags_on_sha(snapshot.with_head(SHA_2).head_sha) == ["staging_c"]
+    assert index.tags_on_sha(None) == []
+
+    assert TagIndex("^production_").update(snapshot).latest_tag is None
+
+
+def _tag_line(tag: str, sha: str, creatordate: int) -> str:
+    return "\t".join([f"refs/tags/{tag}", sha, "", sha[:7], "", f"{creatordate}", ""])
+
+
+def test_tag_index_incremental_updates():
+    index = TagIndex("^staging_")
+    index.update(
+        RefSnapshot.from_for_each_ref(
+            "\n".join(
+                [
+                    _tag_line("staging_a", SHA_1, 1),
+                    _tag_line("staging_b", SHA_1, 2),
+                    _tag_line("other", SHA_2, 3),
+                ]
+            )
+        )
+    )
+    assert index.latest_tag == "staging_b"
+
+    # staging_b moved to a newer commit, staging_a deleted, staging_c added
+    index.update(
+        RefSnapshot.from_for_each_ref(
+            "\n".join(
+                [
+                    _tag_line("staging_b", SHA_2, 5),
+                    _tag_line("staging_c", SHA_2, 4),
+                    _tag_line("other", SHA_2, 3),
+                ]
+            )
+        )
+    )
+    assert len(index) == 2
+    assert index.latest_tag == "staging_b"
+    assert index.tags_on_sha(SHA_1) == []
+    assert index.tags_on_sha(SHA_2) == ["staging_b", "staging_c"]
+
+    index.update(RefSnapshot())
+    assert len(index) == 0
+    assert index.latest_tag is None
+
+
+def test_tag_index_only_ingests_the_changed_tags(mocker: MockerFixture):
+    num_tags = 1000
+    lines = [
+        _tag_line(f"{'staging' if i % 2 else 'build'}_{i}", f"{i:040x}", i)
+        for i in range(num_tags)
+    ]
+    snapshot = RefSnapshot.from_for_each_ref("\n".join(lines))
+    index = TagIndex("^staging_").update(snapshot)
+    assert index.latest_tag == f"staging_{num_tags - 1}"
+
+    add_spy = mocker.spy(index, "_add")
+    remove_spy = mocker.spy(index, "_remove")
+    index.update(RefSnapshot.from_for_each_ref("\n".join(lines)))
+    assert add_spy.call_count == remove_spy.call_count == 0
+
+    # one new tag and one moved tag
+    moved = _tag_line("staging_1", "f" * 40, 1)
+    added = _tag_line("staging_new", "e" * 40, num_tags)
+    index.update(RefSnapshot.from_for_each_ref("\n".join([moved, *lines[2:], added])))
+    assert sorted(call.args[0] for call in add_spy.call_args_list) == [
+        "staging_1",
+        "staging_new",
+    ]
+    assert sorted(call.args[0] for call in remove_spy.call_args_list) == [
+        "build_0",
+        "staging_1",
+    ]
+    assert index.latest_tag == "staging_new"
+    assert index.tags_on_sha("f" * 40) == ["staging_1"]
+    assert len(index) == num_tags // 2 + 1
+
+
+@pytest.mark.benchmark
+def test_tag_index_is_cheaper_than_rescanning_many_tags():
+    num_tags = 50000
+    lines = [
+        _tag_line(f"{'staging' if i % 2 else 'build'}_{i}", f"{i:040x}", i)
+        for i in range(num_tags)
+    ]
+    snapshots = [
+        RefSnapshot.from_for_each_ref("\n".join(lines)),
+        RefSnapshot.from_for_each_ref(
+            "\n".join(lines + [_tag_line("staging_new", "f" * 40, num_tags)])
+        ),
+    ]
+
+    def _rescan(snapshot: RefSnapshot) -> str:
+        # what every polling cycle used to do
+        regexp = re.compile("^staging_")
+        return [
+            tag for tag in snapshot.tags_sorted_by_creatordate() if regexp.search(tag)
+        ][-1]
+
+    index = TagIndex("^staging_").update(snapshots[0])
+    assert index.latest_tag == _rescan(snapshots[0]) == f"staging_{num_tags - 1}"
+
+    start = time.perf_counter()
+    for snapshot in snapshots * 5:
+        _rescan(snapshot)
+    rescan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for snapshot in snapshots * 5:
+        index.update(snapshot)
+        assert index.latest_tag
+    index_time = time.perf_counter() - start
+
+    assert index.update(snapshots[1]).latest_tag == "staging_new"
+    assert index_time < rescan_time
+
+
+def test_semver_key():
+    versions = [
+        "staging_latest",
+        "v1.2.3-alpha",
+        "v1.2.3-alpha.1",
+        "v1.2.3-alpha.beta",
+        "v1.2.3-beta.2",
+        "v1.2.3-beta.11",
+        "v1.2.3-rc.1",
+        "v1.2.3",
+        "v1.2.10",
+        "v1.10.0",
+        "v2.0.0",
+    ]
+    assert sorted(reversed(versions), key=semver_key) == versions
+
+
+@pytest.mark.parametrize(
+    "regexp, order, expected_latest_tag",
+    [
+        # the backport 1.2.10 was tagged after 2.0.0
+        ("^v", "creatordate", "v1.2.10"),
+        ("^v", "semver", "v2.0.0"),
+        (r"^v(\d+)\.(\d+)", "capture_groups", "v2.0.0"),
+        # only the minor counts, 1.2.x ties are decided by creation date
+        (r"^v\d+\.(\d+)", "capture_groups", "v1.2.10"),
+    ],
+)
+def test_tag_index_orders(regexp: str, order: str, expected_latest_tag: str):
+    snapshot = RefSnapshot.from_for_each_ref(
+        "\n".join(
+            [
+                _tag_line("v1.2.9", SHA_1, 1),
+                _tag_line("v2.0.0", SHA_2, 2),
+                _tag_line("v1.2.10", "3" * 40, 3),
+            ]
+        )
+    )
+    index = TagIndex(regexp, order).update(snapshot)
+    assert index.latest_tag == expected_latest_tag
+
+    # removing the latest tag falls back to the previous one
+    index.update(
+        RefSnapshot.from_for_each_ref(
+            "\n".join(
+                line
+                for line in snapshot.tag_lines
+                if snapshot.tag_lines[line] != expected_latest_tag
+            )
+        )
+    )
+    assert len(index) == 2
+    assert index.latest_tag != expected_latest_tag
+
+
+def test_tag_index_release_names():
+    snapshot = RefSnapshot.from_for_each_ref(
+        "\n".join(
+            [
+                _tag_line("teststaging_1", SHA_1, 1),
+                _tag_line("staging_1", SHA_1, 1),
+                _tag_line("test", SHA_1, 1),
+            ]
+        )
+    )
+    assert TagIndex("^(?:test)?(staging_.+)$").update(snapshot).release_names_on_sha(
+        SHA_1
+    ) == ["staging_1", "staging_1"]
+    assert TagIndex("^test(.*)$").update(snapshot).release_names_on_sha(SHA_1) == [
+        "",
+        "staging_1",
+    ]
+    assert TagIndex("staging").update(snapshot).release_names_on_sha(SHA_1) == [
+        "staging_1",
+        "teststaging_1",
+    ]
+
+
+@pytest.mark.parametrize("order", ["semver", "capture_groups"])
+def test_tag_index_versions_only_sort_the_changed_tags(
+    order: str, mocker: MockerFixture
+):
+    num_tags = 1000
+    lines = [
+        _tag_line(f"v{i // 100}.{i // 10 % 10}.{i % 10}", f"{i:040x}", num_tags - i)
+        for i in range(num_tags)
+    ]
+    index = TagIndex(r"^v(\d+)\.(\d+)\.(\d+)$", order)
+    index.update(RefSnapshot.from_for_each_ref("\n".join(lines)))
+    assert index.latest_tag == "v9.9.9"
+
+    order_key_spy = mocker.patch.object(
+        index, "_order_key", wraps=index._order_key  # pylint: disable=protected-access
+    )
+    index.update(RefSnapshot.from_for_each_ref("\n".join(lines)))
+    assert order_key_spy.call_count == 0
+
+    # the most recent tag is a backport: not the latest
+    backport = _tag_line("v0.0.99", "f" * 40, num_tags)
+    index.update(RefSnapshot.from_for_each_ref("\n".join([*lines, backport])))
+    assert [call.args[0] for call in order_key_spy.call_args_list] == ["v0.0.99"]
+    assert index.latest_tag == "v9.9.9"
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("order", ["semver", "capture_groups"])
+def test_tag_index_versions_are_cheaper_than_resorting_many_tags(order: str):
+    num_tags = 50000
+    regexp = r"^v(\d+)\.(\d+)\.(\d+)$"
+    lines = [
+        _tag_line(f"v{i // 1000}.{i // 10 % 100}.{i % 10}", f"{i:040x}", num_tags - i)
+        for i in range(num_tags)
+    ]
+    snapshots = [
+        RefSnapshot.from_for_each_ref("\n".join(lines)),
+        RefSnapshot.from_for_each_ref(
+            "\n".join(lines + [_tag_line("v0.0.99", "f" * 40, num_tags)])
+        ),
+    ]
+
+    def _resort(snapshot: RefSnapshot) -> str:
+        compiled = re.compile(regexp)
+        return max(
+            (tag for tag in snapshot.tags if compiled.search(tag)),
+            key=semver_key,
+        )
+
+    index = TagIndex(regexp, order).update(snapshots[0])
+    assert index.latest_tag == _resort(snapshots[0]) == "v49.99.9"
+
+    start = time.perf_counter()
+    for snapshot in snapshots * 5:
+        _resort(snapshot)
+    resort_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for snapshot in snapshots * 5:
+        index.update(snapshot)
+        assert index.latest_tag
+    index_time = time.perf_counter() - start
+
+    # the most recent tag is a backport: not the latest
+    assert index.update(snapshots[1]).latest_tag == "v49.99.9"
+    assert index_time < resort_time
+
+
+def test_ref_snapshot_from_git(tmp_path: Path):
+    run_command(
+        "git init; git config user.name tester; git config user.email tester@test.com;"
+        "git commit --allow-empty -m 'first'; git tag -a annotated -m 'annotated';"
+        "git tag lightweight",
+        cwd=tmp_path,
+    )
+    head_sha = run_command("git rev-parse HEAD", cwd=tmp_path)
+    snapshot = RefSnapshot.from_for_each_ref(
+        run_command(f"git for-each-ref --format='{FOR_EACH_REF_FORMAT}'", cwd=tmp_path),
+        head_sha=head_sha,
+    )
+
+    assert TagIndex(".*").update(snapshot).tags_on_sha(head_sha) == [
+        "annotated",
+        "lightweight",
+    ]
+    assert snapshot.tags["annotated"].taggerdate
+    assert snapshot.tags["lightweight"].taggerdate is None
+    assert snapshot.tags["annotated"].short_sha == run_command(
+        "git rev-parse --short HEAD", cwd=tmp_path
+    )
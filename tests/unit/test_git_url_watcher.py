@@ -4,6 +4,8 @@
 # pylint: disable=too-many-arguments
 # pylint: disable=protected-access
 
+import asyncio
+import dataclasses
 import re
 import time
 import uuid
@@ -15,18 +17,22 @@ from typing import Any, Callable, Final, Literal
 import pytest
 from faker import Faker
 from pydantic import parse_obj_as
+from pytest_mock import MockerFixture
 from tenacity import AsyncRetrying, stop_after_attempt, wait_fixed
 from yarl import URL
 
 from simcore_service_deployment_agent import git_url_watcher
 from simcore_service_deployment_agent.exceptions import (
+    CmdLineError,
     ConfigurationError,
     TagSyncErrorException,
 )
-from simcore_service_deployment_agent.git_url_watcher import (
-    GitUrlWatcher,
-    _git_get_tag_created_dt,
+from simcore_service_deployment_agent.git_maintenance import (
+    MAINTENANCE_TASKS,
+    MaintenanceScheduler,
 )
+from simcore_service_deployment_agent.git_refs import TagIndex
+from simcore_service_deployment_agent.git_url_watcher import GitUrlWatcher
 from simcore_service_deployment_agent.subprocess_utils import (
     exec_command_async,
     run_command,
@@ -88,6 +94,11 @@ def git_repository_folder(git_repository_url: URL) -> Callable[[], Path]:
     return _git_repository_folder
 
 
+@pytest.fixture(params=["cli", "dulwich"])
+def git_backend(request: pytest.FixtureRequest) -> str:
+    return request.param
+
+
 @pytest.fixture
 def watch_tags() -> str:
     return ""
@@ -104,10 +115,12 @@ def git_config(
     git_repository_url: Callable[[], str],
     watch_tags: str,
     watch_paths: list[str],
+    git_backend: str,
 ) -> dict[str, Any]:
     cfg = {
         "main": {
             "synced_via_tags": False,
+            "git_backend": git_backend,
             "watched_git_repositories": [
                 {
                     "id": "test-repo-0",
@@ -126,11 +139,12 @@ def git_config(
 
 @pytest.fixture()
 def git_config_two_repos_synced_same_tag_regex(
-    branch_name: str, git_repository_url: Callable[[], str]
+    branch_name: str, git_repository_url: Callable[[], str], git_backend: str
 ) -> dict[str, Any]:
     cfg = {
         "main": {
             "synced_via_tags": True,
+            "git_backend": git_backend,
             "watched_git_repositories": [
                 {
                     "id": "test-repo-" + str(i),
@@ -150,11 +164,12 @@ def git_config_two_repos_synced_same_tag_regex(
 
 @pytest.fixture()
 def git_config_two_repos_synced_capture_group_tag_regex(
-    branch_name: str, git_repository_url: Callable[[], str]
+    branch_name: str, git_repository_url: Callable[[], str], git_backend: str
 ) -> dict[str, Any]:
     cfg = {
         "main": {
             "synced_via_tags": True,
+            "git_backend": git_backend,
             "watched_git_repositories": [
                 {
                     "id": "test-repo-" + str(0),
@@ -183,9 +198,6 @@ def git_config_two_repos_synced_capture_group_tag_regex(
 async def test_git_url_watcher_tag_sync(
     event_loop, git_config_two_repos_synced_same_tag_regex: dict[str, Any]
 ):
-    branch_var: str = git_config_two_repos_synced_same_tag_regex["main"][
-        "watched_git_repositories"
-    ][0]["branch"]
     local_path_var: str = git_config_two_repos_synced_same_tag_regex["main"][
         "watched_git_repositories"
     ][0]["url"].replace("file://localhost", "")
@@ -216,10 +228,9 @@ async def test_git_url_watcher_tag_sync(
             f"touch {TESTFILE_NAME}; git add .; git commit -m 'pytest: I added {TESTFILE_NAME}'; git tag {VALID_TAG};",
             cwd=repo["url"].replace("file://localhost", ""),
         )
-        assert await git_url_watcher._check_if_tag_on_branch(
-            repo["url"].replace("file://localhost", ""), branch_var, VALID_TAG
-        )
     init_result = await git_watcher.init()
+    for repo in git_watcher.watched_repos:
+        assert await git_url_watcher._is_tag_on_branch(repo, VALID_TAG)
     assert not await git_watcher.check_for_changes()
     sleep_1_sec_to_make_commit_timestamp_unique()
     # Add change and tag in only one repo
@@ -294,7 +305,6 @@ async def test_git_url_watcher_find_new_file(
 async def test_git_url_watcher_find_tag_on_branch_fails_if_tag_not_found(
     event_loop: AbstractEventLoop, git_config: dict[str, Any]
 ):
-    branch_var = git_config["main"]["watched_git_repositories"][0]["branch"]
     local_path_var = git_config["main"]["watched_git_repositories"][0]["url"].replace(
         "file://localhost", ""
     )
@@ -309,10 +319,10 @@ async def test_git_url_watcher_find_tag_on_branch_fails_if_tag_not_found(
         f"touch {TESTFILE_NAME}; git add .; git commit -m 'pytest - I added {TESTFILE_NAME}'; git tag {VALID_TAG};",
         cwd=local_path_var,
     )
+    assert await git_watcher.check_for_changes()
+    (repo,) = git_watcher.watched_repos
     with pytest.raises(RuntimeError):
-        await git_url_watcher._check_if_tag_on_branch(
-            local_path_var, branch_var, "invalid_tag"
-        )
+        await git_url_watcher._is_tag_on_branch(repo, "invalid_tag")
 
     await git_watcher.cleanup()
 
@@ -323,8 +333,8 @@ async def test_git_url_watcher_find_tag_on_branch_succeeds(
     local_path_var = git_config["main"]["watched_git_repositories"][0]["url"].replace(
         "file://localhost", ""
     )
-    branch_var = git_config["main"]["watched_git_repositories"][0]["branch"]
 
+    git_config["main"]["watched_git_repositories"][0]["tags"] = "^staging_"
     git_watcher = git_url_watcher.GitUrlWatcher(git_config)
     await git_watcher.init()
     # add the a file, commit, and tag
@@ -334,11 +344,10 @@ async def test_git_url_watcher_find_tag_on_branch_succeeds(
         f"touch {TESTFILE_NAME}; git add .; git commit -m 'pytest - I added {TESTFILE_NAME}'; git tag {VALID_TAG};",
         cwd=local_path_var,
     )
-    assert await git_url_watcher._check_if_tag_on_branch(
-        local_path_var, branch_var, VALID_TAG
-    )
     check_for_changes_result = await git_watcher.check_for_changes()
     assert check_for_changes_result
+    (repo,) = git_watcher.watched_repos
+    assert await git_url_watcher._is_tag_on_branch(repo, VALID_TAG)
     await git_watcher.cleanup()
 
 
@@ -346,11 +355,11 @@ async def test_git_url_watcher_find_tag_on_branch_raises_if_branch_doesnt_exist(
     event_loop: AbstractEventLoop, git_config: dict[str, Any]
 ):
     repo_id_var = git_config["main"]["watched_git_repositories"][0]["id"]
-    branch_var = git_config["main"]["watched_git_repositories"][0]["branch"]
     local_path_var = git_config["main"]["watched_git_repositories"][0]["url"].replace(
         "file://localhost", ""
     )
 
+    git_config["main"]["watched_git_repositories"][0]["tags"] = "^staging_"
     git_watcher = git_url_watcher.GitUrlWatcher(git_config)
     init_result = await git_watcher.init()
 
@@ -361,10 +370,13 @@ async def test_git_url_watcher_find_tag_on_branch_raises_if_branch_doesnt_exist(
         f"touch {TESTFILE_NAME}; git add .; git commit -m 'pytest - I added {TESTFILE_NAME}'; git tag {VALID_TAG};",
         cwd=local_path_var,
     )
+    assert await git_watcher.check_for_changes()
+    (repo,) = git_watcher.watched_repos
+    assert await git_url_watcher._is_tag_on_branch(repo, VALID_TAG)
+    other_repo = dataclasses.replace(repo, branch="nonexistingBranch")
+    other_repo.ref_snapshot = repo.ref_snapshot
     with pytest.raises(RuntimeError):
-        await git_url_watcher._check_if_tag_on_branch(
-            local_path_var, "nonexistingBranch", VALID_TAG
-        )
+        await git_url_watcher._is_tag_on_branch(other_repo, VALID_TAG)
 
     await git_watcher.cleanup()
 
@@ -543,11 +555,10 @@ async def test_git_url_watcher_tags(
         with attempt:
             # we should have a change here
             change_results = await git_watcher.check_for_changes()
-            latestTag = await git_url_watcher._git_get_latest_matching_tag(
-                git_watcher.watched_repos[0].directory,
-                git_watcher.watched_repos[0].tags,
-            )
-            assert latestTag == NEW_VALID_TAG_ON_NEW_SHA
+            repo = git_watcher.watched_repos[0]
+            snapshot = await git_watcher.git_backend.get_ref_snapshot(repo.directory)
+            latest_tag = TagIndex(repo.tags).update(snapshot).latest_tag
+            assert latest_tag == NEW_VALID_TAG_ON_NEW_SHA
     #
     await git_watcher.cleanup()
 
@@ -603,10 +614,13 @@ async def test_git_url_watcher_tags_capture_group_replacement(
 
     change_results = await git_watcher.check_for_changes()
     assert change_results
-    latestTag = await git_url_watcher._git_get_latest_matching_tag_capture_groups(
-        git_watcher.watched_repos[0].directory, git_watcher.watched_repos[0].tags
-    )
-    assert latestTag[0] == NEW_VALID_TAG_ON_NEW_SHA.replace("test", "")
+    repo = git_watcher.watched_repos[0]
+    snapshot = await git_watcher.git_backend.get_ref_snapshot(repo.directory)
+    tag_index = TagIndex(repo.tags).update(snapshot)
+    assert tag_index.latest_tag == NEW_VALID_TAG_ON_NEW_SHA
+    assert tag_index.release_names_on_sha(
+        snapshot.tags[NEW_VALID_TAG_ON_NEW_SHA].sha
+    ) == [NEW_VALID_TAG_ON_NEW_SHA.replace("test", "")]
     #
     await git_watcher.cleanup()
 
@@ -635,8 +649,9 @@ async def test_repo_status(git_config: dict[str, Any], tag_name: str, watch_tags
     assert repo_status.tag_name == tag_name
     assert repo_status.tag_created
 
-    # tests _git_get_tag_created_dt
-    tag_created = await _git_get_tag_created_dt(repo.directory, repo_status.tag_name)
+    # the tagger date as listed in a fresh snapshot of the refs
+    snapshot = await git_task.git_backend.get_ref_snapshot(repo.directory)
+    tag_created = snapshot.tags[repo_status.tag_name].taggerdate
     assert tag_created
     assert tag_created == repo_status.tag_created
 
@@ -751,9 +766,6 @@ async def test_git_url_watcher_rolls_back_if_tag_on_remote_vanishes_tag_sync(
     event_loop: AbstractEventLoop,
     git_config_two_repos_synced_same_tag_regex: dict[str, Any],
 ):
-    branch_var: str = git_config_two_repos_synced_same_tag_regex["main"][
-        "watched_git_repositories"
-    ][0]["branch"]
     local_path_var: str = git_config_two_repos_synced_same_tag_regex["main"][
         "watched_git_repositories"
     ][0]["url"].replace("file://localhost", "")
@@ -785,10 +797,9 @@ async def test_git_url_watcher_rolls_back_if_tag_on_remote_vanishes_tag_sync(
             f"touch {TESTFILE_NAME}; git add .; git commit -m 'pytest: I added {TESTFILE_NAME}'; git tag {VALID_TAG};",
             cwd=repo["url"].replace("file://localhost", ""),
         )
-        assert await git_url_watcher._check_if_tag_on_branch(
-            repo["url"].replace("file://localhost", ""), branch_var, VALID_TAG
-        )
     init_result = await git_watcher.init()
+    for repo in git_watcher.watched_repos:
+        assert await git_url_watcher._is_tag_on_branch(repo, VALID_TAG)
     git_shas_upon_init = [
         run_command(
             f"git rev-parse --short {VALID_TAG}",
@@ -818,11 +829,10 @@ async def test_git_url_watcher_rolls_back_if_tag_on_remote_vanishes_tag_sync(
             f"touch {TESTFILE_NAME_2}; git add .; git commit -m 'pytest: I added {TESTFILE_NAME_2}'; git tag {NEW_VALID_TAG};",
             cwd=repo["url"].replace("file://localhost", ""),
         )
-        assert await git_url_watcher._check_if_tag_on_branch(
-            repo["url"].replace("file://localhost", ""), branch_var, NEW_VALID_TAG
-        )
     change_results = await git_watcher.check_for_changes()
     assert change_results
+    for repo in git_watcher.watched_repos:
+        assert await git_url_watcher._is_tag_on_branch(repo, NEW_VALID_TAG)
     sleep_1_sec_to_make_commit_timestamp_unique()
     # Remove tag from one repo
     run_command(
@@ -1087,3 +1097,634 @@ async def test_git_url_watcher_tag_sync_works_even_if_raise_upon_init(
     assert change_results  # We should see changes here.
 
     await git_watcher.cleanup()
+
+
+async def test_run_bounded_limits_concurrency_and_isolates_errors():
+    running = 0
+    max_running = 0
+
+    async def _job(index: int) -> int:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if index == 3:
+            raise CmdLineError("fake", "failure")
+        return index
+
+    results = await git_url_watcher._run_bounded((_job(i) for i in range(10)), 2)
+
+    assert max_running == 2
+    assert isinstance(results[3], CmdLineError)
+    assert [r for i, r in enumerate(results) if i != 3] == [
+        i for i in range(10) if i != 3
+    ]
+
+
+@pytest.fixture
+def git_config_two_repos(
+    branch_name: str, git_repository_url: Callable[[], str], git_backend: str
+) -> dict[str, Any]:
+    return {
+        "main": {
+            "synced_via_tags": False,
+            "git_backend": git_backend,
+            "git_parallelism": 2,
+            "watched_git_repositories": [
+                {
+                    "id": f"test-repo-{i}",
+                    "url": f"{git_repository_url()}",
+                    "branch": branch_name,
+                    "tags": "",
+                    "paths": [],
+                    "username": "",
+                    "password": "",
+                }
+                for i in range(2)
+            ],
+        }
+    }
+
+
+async def test_git_url_watcher_isolates_unreachable_repo(
+    event_loop: AbstractEventLoop,
+    git_config_two_repos: dict[str, Any],
+    tmp_path: Path,
+):
+    repo_configs = git_config_two_repos["main"]["watched_git_repositories"]
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config_two_repos)
+    await git_watcher.init()
+    assert not await git_watcher.check_for_changes()
+
+    # the first remote vanishes, the second one gets a new commit
+    unreachable_path = Path(URL(repo_configs[0]["url"]).path)
+    unreachable_path.rename(tmp_path / "vanished")
+    local_path_var = URL(repo_configs[1]["url"]).path
+    run_command(
+        "touch my_file.txt; git add .; git commit -m 'I added a file';",
+        cwd=local_path_var,
+    )
+
+    change_results = await git_watcher.check_for_changes()
+    assert list(change_results) == [repo_configs[1]["id"]]
+
+    await git_watcher.cleanup()
+
+
+async def test_git_url_watcher_checks_only_requested_repos(
+    event_loop: AbstractEventLoop,
+    git_config_two_repos: dict[str, Any],
+):
+    repo_configs = git_config_two_repos["main"]["watched_git_repositories"]
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config_two_repos)
+    await git_watcher.init()
+
+    for repo_config in repo_configs:
+        run_command(
+            "touch my_file.txt; git add .; git commit -m 'I added a file';",
+            cwd=URL(repo_config["url"]).path,
+        )
+
+    change_results = await git_watcher.check_for_changes({repo_configs[1]["id"]})
+    assert list(change_results) == [repo_configs[1]["id"]]
+    change_results = await git_watcher.check_for_changes()
+    assert list(change_results) == [repo_configs[0]["id"]]
+
+    await git_watcher.cleanup()
+
+
+async def test_git_url_watcher_skips_fetch_if_remote_refs_unchanged(
+    event_loop: AbstractEventLoop,
+    git_config_tags: dict[str, Any],
+    mocker: MockerFixture,
+):
+    local_path_var = URL(
+        git_config_tags["main"]["watched_git_repositories"][0]["url"]
+    ).path
+    run_command(
+        "touch theonefile.csv; git add .; git commit -m 'I added theonefile.csv'; git tag teststaging_z1stvalid;",
+        cwd=local_path_var,
+    )
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config_tags)
+    await git_watcher.init()
+
+    fetch_spy = mocker.spy(git_watcher.git_backend, "fetch")
+    assert not await git_watcher.check_for_changes()
+    assert fetch_spy.call_count == 0
+
+    # a non-matching tag is not a relevant remote change
+    run_command("git tag v3.4.5", cwd=local_path_var)
+    assert not await git_watcher.check_for_changes()
+    assert fetch_spy.call_count == 0
+
+    sleep_1_sec_to_make_commit_timestamp_unique()
+    run_command(
+        "echo 'blahblah' >> theonefile.csv; git add .; git commit -m 'I modified theonefile.csv'; git tag teststaging_g2ndvalid",
+        cwd=local_path_var,
+    )
+    assert await git_watcher.check_for_changes()
+    assert fetch_spy.call_count == 1
+
+    await git_watcher.cleanup()
+
+
+@pytest.mark.parametrize("git_backend", ["cli"])
+async def test_git_url_watcher_reuses_persistent_cache(
+    event_loop: AbstractEventLoop,
+    git_config: dict[str, Any],
+    tmp_path: Path,
+    mocker: MockerFixture,
+):
+    cache_dir = tmp_path / "git_cache"
+    git_config["main"]["git_cache_dir"] = f"{cache_dir}"
+    repo_config = git_config["main"]["watched_git_repositories"][0]
+    clone_spy = mocker.spy(git_url_watcher, "_git_clone_repo")
+    mirror_spy = mocker.spy(git_url_watcher, "_git_clone_mirror")
+
+    # cold start fills the cache
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config)
+    init_result = await git_watcher.init()
+    await git_watcher.cleanup()
+    assert not clone_spy.called
+    assert mirror_spy.call_count == 1
+    (mirror,) = list(cache_dir.iterdir())
+    mirror_head = f"refs/heads/{repo_config['branch']}"
+
+    # restart with new commits upstream: the cache is updated, not cloned again
+    run_command(
+        "touch my_file.txt; git add .; git commit -m 'I added a file';",
+        cwd=URL(repo_config["url"]).path,
+    )
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config)
+    restart_result = await git_watcher.init()
+    await git_watcher.cleanup()
+    assert mirror_spy.call_count == 1
+    assert restart_result != init_result
+    git_sha = run_command(
+        "git rev-parse --short HEAD", cwd=URL(repo_config["url"]).path
+    )
+    assert restart_result[repo_config["id"]].endswith(git_sha)
+    # the branch of the cache moved too, the next restart has nothing to download
+    assert run_command(f"git rev-parse --short {mirror_head}", cwd=mirror) == git_sha
+
+    # a corrupt cache is discarded and cloned again
+    for pack in (mirror / "objects").rglob("*"):
+        if pack.is_file():
+            pack.chmod(0o644)
+            pack.write_bytes(b"garbage")
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config)
+    assert await git_watcher.init() == restart_result
+    await git_watcher.cleanup()
+    assert mirror_spy.call_count == 2
+
+
+@pytest.mark.parametrize("git_backend", ["cli"])
+async def test_git_url_watcher_sparse_checkout(
+    event_loop: AbstractEventLoop,
+    git_config: dict[str, Any],
+):
+    repo_config = git_config["main"]["watched_git_repositories"][0]
+    repo_config["paths"] = ["services/docker-compose.yml"]
+    git_config["main"]["git_sparse_checkout"] = True
+    git_config["main"]["docker_stack_recipe"] = {
+        "files": [{"id": repo_config["id"], "paths": ["ops/.env"]}]
+    }
+    local_path = URL(repo_config["url"]).path
+    run_command(
+        "git config uploadpack.allowFilter true;"
+        "mkdir -p services ops unrelated;"
+        "touch services/docker-compose.yml ops/.env unrelated/big_file;"
+        "git add .; git commit -m 'added folders';",
+        cwd=local_path,
+    )
+
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config)
+    (repo,) = git_watcher.watched_repos
+    assert repo.sparse_checkout_cones == ["ops", "services"]
+    assert await git_watcher.init()
+
+    checkout = Path(repo.directory)
+    assert (checkout / "services" / "docker-compose.yml").exists()
+    assert (checkout / "ops" / ".env").exists()
+    assert (checkout / "initial_file.txt").exists()
+    assert not (checkout / "unrelated").exists()
+    assert (
+        run_command("git config remote.origin.partialclonefilter", cwd=checkout)
+        == "blob:none"
+    )
+
+    # changes in the watched paths are still detected
+    run_command(
+        "echo 'blahblah' >> services/docker-compose.yml; git add .; git commit -m 'modified';",
+        cwd=local_path,
+    )
+    git_sha = run_command("git rev-parse --short HEAD", cwd=local_path)
+    assert await git_watcher.check_for_changes() == {
+        repo.repo_id: f"{repo.repo_id}:{repo.branch}:{git_sha}"
+    }
+    assert "blahblah" in (checkout / "services" / "docker-compose.yml").read_text()
+
+    await git_watcher.cleanup()
+
+
+async def test_git_url_watcher_ignores_new_tags_not_changing_watched_paths(
+    event_loop: AbstractEventLoop,
+    git_config_tags: dict[str, Any],
+):
+    repo_config = git_config_tags["main"]["watched_git_repositories"][0]
+    local_path = URL(repo_config["url"]).path
+    run_command(
+        "touch theonefile.csv; git add .; git commit -m 'I added theonefile.csv'; git tag teststaging_1;",
+        cwd=local_path,
+    )
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config_tags)
+    await git_watcher.init()
+    (repo,) = git_watcher.watched_repos
+
+    # a new tag that leaves the watched paths unchanged is checked out but not reported
+    sleep_1_sec_to_make_commit_timestamp_unique()
+    run_command(
+        "touch my_file.txt; git add .; git commit -m 'I added my_file.txt'; git tag teststaging_2;",
+        cwd=local_path,
+    )
+    assert not await git_watcher.check_for_changes()
+    assert (Path(repo.directory) / "my_file.txt").exists()
+
+    sleep_1_sec_to_make_commit_timestamp_unique()
+    run_command(
+        "echo 'blahblah' >> theonefile.csv; git add .; git commit -m 'modified'; git tag teststaging_3;",
+        cwd=local_path,
+    )
+    git_sha = run_command("git rev-parse --short HEAD", cwd=local_path)
+    assert await git_watcher.check_for_changes() == {
+        repo.repo_id: f"{repo.repo_id}:{repo.branch}:teststaging_3:{git_sha}"
+    }
+
+    await git_watcher.cleanup()
+
+
+async def test_git_url_watcher_branch_changes_only_redeploy_on_watched_paths(
+    event_loop: AbstractEventLoop,
+    git_config_paths: dict[str, Any],
+    mocker: MockerFixture,
+):
+    repo_config = git_config_paths["main"]["watched_git_repositories"][0]
+    local_path = URL(repo_config["url"]).path
+    run_command(
+        "touch theonefile.csv; git add .; git commit -m 'I added theonefile.csv';",
+        cwd=local_path,
+    )
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config_paths)
+    await git_watcher.init()
+    (repo,) = git_watcher.watched_repos
+    pull_spy = mocker.spy(git_watcher.git_backend, "fast_forward")
+
+    run_command(
+        "touch my_file.txt; git add .; git commit -m 'I added my_file.txt';",
+        cwd=local_path,
+    )
+    assert not await git_watcher.check_for_changes()
+    assert pull_spy.call_count == 1
+    assert (Path(repo.directory) / "my_file.txt").exists()
+
+    # nothing moved, nothing to pull
+    assert not await git_watcher.check_for_changes()
+    assert pull_spy.call_count == 1
+
+    run_command(
+        "echo 'blahblah' >> theonefile.csv; git add .; git commit -m 'modified';",
+        cwd=local_path,
+    )
+    assert await git_watcher.check_for_changes()
+    assert pull_spy.call_count == 2
+    assert "blahblah" in (Path(repo.directory) / "theonefile.csv").read_text()
+
+    await git_watcher.cleanup()
+
+
+async def test_git_url_watcher_memoizes_tag_ancestry(
+    event_loop: AbstractEventLoop,
+    git_config_tags: dict[str, Any],
+    mocker: MockerFixture,
+):
+    repo_config = git_config_tags["main"]["watched_git_repositories"][0]
+    local_path = URL(repo_config["url"]).path
+    run_command(
+        "touch theonefile.csv; git add .; git commit -m 'I added theonefile.csv'; git tag teststaging_1;",
+        cwd=local_path,
+    )
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config_tags)
+    await git_watcher.init()
+    (repo,) = git_watcher.watched_repos
+    is_ancestor_spy = mocker.spy(git_watcher.git_backend, "is_ancestor")
+
+    # the branch moved past the new tag: it is still on the branch
+    sleep_1_sec_to_make_commit_timestamp_unique()
+    run_command(
+        "echo 'blahblah' >> theonefile.csv; git add .; git commit -m 'modified'; git tag teststaging_2;"
+        "touch my_file.txt; git add .; git commit -m 'I added my_file.txt';",
+        cwd=local_path,
+    )
+    git_sha = run_command("git rev-parse --short teststaging_2", cwd=local_path)
+    assert await git_watcher.check_for_changes() == {
+        repo.repo_id: f"{repo.repo_id}:{repo.branch}:teststaging_2:{git_sha}"
+    }
+    assert is_ancestor_spy.call_count == 1
+
+    # same refs, same answer without asking git
+    assert await git_url_watcher._is_tag_on_branch(repo, "teststaging_2")
+    assert is_ancestor_spy.call_count == 1
+
+    # a tag on another branch is ignored
+    sleep_1_sec_to_make_commit_timestamp_unique()
+    run_command(
+        f"git checkout -b other; echo 'other' >> theonefile.csv; git commit -am 'other';"
+        f"git tag teststaging_3; git checkout {repo.branch}",
+        cwd=local_path,
+    )
+    assert not await git_watcher.check_for_changes()
+    assert is_ancestor_spy.call_count == 2
+    assert not await git_url_watcher._is_tag_on_branch(repo, "teststaging_3")
+    assert is_ancestor_spy.call_count == 2
+
+    with pytest.raises(RuntimeError):
+        await git_url_watcher._is_tag_on_branch(repo, "teststaging_unknown")
+
+    await git_watcher.cleanup()
+
+
+async def test_git_url_watcher_orders_tags_by_semver(
+    event_loop: AbstractEventLoop,
+    git_config: dict[str, Any],
+):
+    repo_config = git_config["main"]["watched_git_repositories"][0]
+    repo_config.update(tags="^v", tags_order="semver", paths=["theonefile.csv"])
+    local_path = URL(repo_config["url"]).path
+    run_command(
+        "touch theonefile.csv; git add .; git commit -m 'I added theonefile.csv'; git tag v2.0.0;",
+        cwd=local_path,
+    )
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config)
+    init_result = await git_watcher.init()
+    (repo,) = git_watcher.watched_repos
+    git_sha = run_command("git rev-parse --short v2.0.0", cwd=local_path)
+    assert init_result == {
+        repo.repo_id: f"{repo.repo_id}:{repo.branch}:v2.0.0:{git_sha}"
+    }
+
+    # a more recent tag with a lower version is not the latest one
+    sleep_1_sec_to_make_commit_timestamp_unique()
+    run_command(
+        "echo 'backport' >> theonefile.csv; git commit -am 'backport'; git tag v1.9.1;",
+        cwd=local_path,
+    )
+    assert not await git_watcher.check_for_changes()
+
+    sleep_1_sec_to_make_commit_timestamp_unique()
+    run_command("git tag v2.0.10", cwd=local_path)
+    git_sha = run_command("git rev-parse --short v2.0.10", cwd=local_path)
+    assert await git_watcher.check_for_changes() == {
+        repo.repo_id: f"{repo.repo_id}:{repo.branch}:v2.0.10:{git_sha}"
+    }
+
+    await git_watcher.cleanup()
+
+
+@pytest.mark.parametrize("watch_tags", ["^test(staging_.+)$", "test(staging_.+)$"])
+async def test_git_url_watcher_fetches_only_matching_tags(
+    event_loop: AbstractEventLoop,
+    git_config: dict[str, Any],
+    watch_tags: str,
+):
+    repo_config = git_config["main"]["watched_git_repositories"][0]
+    local_path = URL(repo_config["url"]).path
+    run_command(
+        "touch theonefile.csv; git add .; git commit -m 'I added theonefile.csv'; git tag teststaging_1;",
+        cwd=local_path,
+    )
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config)
+    await git_watcher.init()
+    (repo,) = git_watcher.watched_repos
+
+    sleep_1_sec_to_make_commit_timestamp_unique()
+    run_command(
+        "git tag build_1; git tag other_product_v1;"
+        "echo 'blahblah' >> theonefile.csv; git commit -am 'modified';"
+        "git tag teststaging_2; git tag build_2",
+        cwd=local_path,
+    )
+    assert await git_watcher.check_for_changes()
+    local_tags = run_command("git tag --list", cwd=repo.directory).split()
+    assert "teststaging_2" in local_tags
+    assert not {"build_1", "build_2", "other_product_v1"} & set(local_tags)
+
+    # vanished tags are pruned
+    run_command("git tag -d teststaging_2", cwd=local_path)
+    assert await git_watcher.check_for_changes()
+    assert "teststaging_2" not in run_command("git tag --list", cwd=repo.directory)
+
+    await git_watcher.cleanup()
+
+
+async def test_git_url_watcher_runs_maintenance_on_clones(
+    event_loop: AbstractEventLoop, git_config: dict[str, Any], git_backend: str
+):
+    git_config["main"]["git_maintenance"] = {"enabled": False}
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config)
+    await git_watcher.init()
+    assert await git_watcher.run_maintenance() == 0
+
+    # all tasks are due right away
+    now = time.monotonic()
+    git_watcher.maintenance = MaintenanceScheduler(
+        {task: 60 for task in MAINTENANCE_TASKS}, clock=lambda: now
+    )
+    git_watcher.maintenance.sync(repo.repo_id for repo in git_watcher.watched_repos)
+    now += 60
+    assert await git_watcher.run_maintenance() > 0
+
+    sources = git_watcher.maintenance.to_dict()["sources"]
+    assert sources
+    for tasks in sources.values():
+        assert all(metrics["failures"] == 0 for metrics in tasks.values())
+        supported = {task for task, metrics in tasks.items() if metrics["runs"]}
+        if git_backend == "cli":
+            assert supported == set(MAINTENANCE_TASKS)
+        else:
+            assert supported == {"loose-objects", "incremental-repack"}
+    # the clone is still usable
+    assert not await git_watcher.check_for_changes()
+
+    await git_watcher.cleanup()
+
+
+async def test_git_url_watcher_shares_store_between_repos_of_same_url(
+    event_loop: AbstractEventLoop,
+    git_config: dict[str, Any],
+    branch_name: str,
+    mocker: MockerFixture,
+):
+    repo_config = git_config["main"]["watched_git_repositories"][0]
+    local_path_var = URL(repo_config["url"]).path
+    run_command(
+        "git checkout -b other; touch other.txt; git add .; git commit -m 'other';"
+        f"git tag staging_1; git checkout {branch_name}",
+        cwd=local_path_var,
+    )
+    git_config["main"]["watched_git_repositories"] = [
+        repo_config,
+        {
+            **repo_config,
+            "id": "test-repo-tags",
+            "branch": "other",
+            "tags": "^staging_[0-9]",
+        },
+        {**repo_config, "id": "test-repo-head", "branch": "other"},
+    ]
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config)
+    (store,) = git_watcher.state.shared_stores
+    assert store.store_id == "test-repo-0+test-repo-tags+test-repo-head"
+    init_status = await git_watcher.init()
+    assert init_status["test-repo-tags"].split(":")[2] == "staging_1"
+
+    # the clones borrow the objects of the store
+    store_objects = Path(store.directory) / "objects"
+    for repo in git_watcher.watched_repos:
+        alternates = Path(repo.directory) / ".git" / "objects" / "info" / "alternates"
+        assert Path(alternates.read_text().strip()) == store_objects
+        assert not list((Path(repo.directory) / ".git" / "objects").glob("pack/*"))
+
+    ls_remote_spy = mocker.spy(git_watcher.git_backend, "ls_remote")
+    fetch_spy = mocker.spy(git_watcher.git_backend, "fetch")
+    assert not await git_watcher.check_for_changes()
+    assert ls_remote_spy.call_count == 1
+    assert not fetch_spy.called
+
+    # one fetch of the remote serves the repos of the changed branch
+    run_command(
+        "git checkout other; touch new.txt; git add .; git commit -m 'new';"
+        f"git tag staging_2; git checkout {branch_name}",
+        cwd=local_path_var,
+    )
+    changes = await git_watcher.check_for_changes()
+    assert sorted(changes) == ["test-repo-head", "test-repo-tags"]
+    assert changes["test-repo-tags"].split(":")[2] == "staging_2"
+    assert ls_remote_spy.call_count == 2
+    fetched_directories = [call.args[0] for call in fetch_spy.call_args_list]
+    assert fetched_directories.count(store.directory) == 1
+    assert set(fetched_directories) == {store.directory} | {
+        repo.directory for repo in git_watcher.watched_repos[1:]
+    }
+
+    await git_watcher.cleanup()
+
+
+@pytest.mark.parametrize("git_backend", ["cli"])
+async def test_git_url_watcher_clones_from_bundle(
+    event_loop: AbstractEventLoop,
+    git_config: dict[str, Any],
+    tmp_path: Path,
+    mocker: MockerFixture,
+):
+    repo_config = git_config["main"]["watched_git_repositories"][0]
+    bundles_dir = tmp_path / "bundles"
+    bundles = await git_url_watcher.GitUrlWatcher(git_config).create_bundles(
+        bundles_dir
+    )
+    assert bundles == {"test-repo-0": bundles_dir / "test-repo-0.bundle"}
+
+    # the remote moves on after the bundle was made
+    run_command(
+        "touch new_file.txt; git add .; git commit -m 'new'",
+        cwd=URL(repo_config["url"]).path,
+    )
+    head_sha = run_command(
+        "git rev-parse --short HEAD", cwd=URL(repo_config["url"]).path
+    )
+    for bundle, num_clones in ((bundles_dir, 0), (tmp_path / "missing", 1)):
+        repo_config["bundle"] = f"{bundle}"
+        git_watcher = git_url_watcher.GitUrlWatcher(git_config)
+        clone_spy = mocker.spy(git_watcher.git_backend, "clone")
+        init_status = await git_watcher.init()
+        assert init_status["test-repo-0"].endswith(head_sha)
+        assert clone_spy.call_count == num_clones
+        repo = git_watcher.watched_repos[0]
+        assert run_command("git remote get-url origin", cwd=repo.directory) == (
+            repo_config["url"]
+        )
+        assert not await git_watcher.check_for_changes()
+        await git_watcher.cleanup()
+
+    # a corrupt bundle is skipped
+    (bundles_dir / "test-repo-0.bundle").write_text("garbage")
+    repo_config["bundle"] = f"{bundles_dir}"
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config)
+    init_status = await git_watcher.init()
+    assert init_status["test-repo-0"].endswith(head_sha)
+    await git_watcher.cleanup()
+
+    git_config["main"]["git_backend"] = "dulwich"
+    with pytest.raises(ConfigurationError):
+        git_url_watcher.GitUrlWatcher(git_config)
+
+
+def _spawned_git_commands(spawn_spy) -> list[str]:
+    """git command (e.g. fetch) of each process spawned since the spy was reset"""
+    return [
+        next(arg for arg in call.args[1:] if not arg.startswith("-") and "=" not in arg)
+        for call in spawn_spy.call_args_list
+    ]
+
+
+@pytest.mark.parametrize("git_backend", ["cli"])
+async def test_git_url_watcher_no_change_cycles_neither_clean_nor_checkout(
+    event_loop: AbstractEventLoop,
+    git_config_tags: dict[str, Any],
+    mocker: MockerFixture,
+):
+    local_path_var = URL(
+        git_config_tags["main"]["watched_git_repositories"][0]["url"]
+    ).path
+    run_command(
+        "touch theonefile.csv; git add .; git commit -m 'I added theonefile.csv';"
+        "git tag teststaging_z1stvalid",
+        cwd=local_path_var,
+    )
+    git_watcher = git_url_watcher.GitUrlWatcher(git_config_tags)
+    await git_watcher.init()
+    spawn_spy = mocker.spy(asyncio, "create_subprocess_exec")
+
+    # nothing changed on the remote: only its refs are listed
+    assert not await git_watcher.check_for_changes()
+    assert _spawned_git_commands(spawn_spy) == ["ls-remote"]
+
+    # a new commit without a new tag is fetched, the working tree is left alone
+    spawn_spy.reset_mock()
+    run_command(
+        "echo 'blahblah' >> theonefile.csv; git commit -am 'I modified theonefile.csv'",
+        cwd=local_path_var,
+    )
+    assert not await git_watcher.check_for_changes()
+    assert _spawned_git_commands(spawn_spy) == [
+        "ls-remote",
+        "fetch",
+        "for-each-ref",
+        "merge-base",
+    ]
+
+    # the recipe wrote into the clone: cleaned in the next check, not checked out
+    spawn_spy.reset_mock()
+    repo = git_watcher.watched_repos[0]
+    repo.tree_is_clean = False
+    recipe_output = Path(repo.directory) / "stack.yml"
+    recipe_output.write_text("services: {}")
+    run_command("git commit --allow-empty -m 'empty'", cwd=local_path_var)
+    assert not await git_watcher.check_for_changes()
+    spawned_commands = _spawned_git_commands(spawn_spy)
+    assert "clean" in spawned_commands
+    assert "checkout" not in spawned_commands
+    assert not recipe_output.exists()
+    assert repo.tree_is_clean
+
+    await git_watcher.cleanup()
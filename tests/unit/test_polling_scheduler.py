@@ -0,0 +1,95 @@
+# pylint: disable=redefined-outer-name
+
+import random
+
+import pytest
+
+from simcore_service_deployment_agent.polling_scheduler import (
+    PollingPolicy,
+    PollingScheduler,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def test_polling_policy_from_config():
+    default = PollingPolicy.from_main_config({"polling_interval": 30})
+    assert default == PollingPolicy(min_interval=30, max_interval=30)
+
+    default = PollingPolicy.from_main_config(
+        {"polling_interval": 30, "polling": {"max_interval": 600, "jitter": 0.2}}
+    )
+    assert default == PollingPolicy(min_interval=30, max_interval=600, jitter=0.2)
+
+    # max_interval is never below min_interval
+    assert PollingPolicy.from_config({"min_interval": 900}, default) == PollingPolicy(
+        min_interval=900, max_interval=900, jitter=0.2
+    )
+    assert PollingPolicy.from_config(None, default) == default
+
+
+def test_polling_scheduler_backs_off_while_quiet(clock: FakeClock):
+    policy = PollingPolicy(min_interval=10, max_interval=60, jitter=0)
+    scheduler = PollingScheduler(policy, clock=clock)
+    scheduler.sync(["repo1", "repo2"])
+    assert scheduler.due() == set()
+    assert scheduler.seconds_until_next_poll() == 10
+
+    intervals = []
+    for _ in range(5):
+        clock.now += scheduler.seconds_until_next_poll()
+        assert scheduler.due() == {"repo1", "repo2"}
+        scheduler.record({"repo1", "repo2"}, changed=[])
+        intervals.append(scheduler.schedules["repo1"].interval)
+    assert intervals == [20, 40, 60, 60, 60]
+    assert scheduler.schedules["repo1"].quiet_polls == 5
+
+    # a change brings the interval back to its minimum
+    clock.now += scheduler.seconds_until_next_poll()
+    scheduler.record({"repo1", "repo2"}, changed=["repo1"])
+    assert scheduler.schedules["repo1"].interval == 10
+    assert scheduler.schedules["repo1"].last_change
+    assert scheduler.schedules["repo2"].interval == 60
+    clock.now += 10
+    assert scheduler.due() == {"repo1"}
+
+
+def test_polling_scheduler_per_source_policies_and_requests(clock: FakeClock):
+    scheduler = PollingScheduler(
+        PollingPolicy(min_interval=60, max_interval=60, jitter=0),
+        {"fast": PollingPolicy(min_interval=5, max_interval=5, jitter=0)},
+        clock=clock,
+    )
+    scheduler.sync(["fast", "slow"])
+    clock.now += 5
+    assert scheduler.due() == {"fast"}
+
+    scheduler.request(["slow", "unknown"])
+    assert scheduler.due() == {"fast", "slow"}
+
+    scheduler.sync(["fast", "new"])
+    assert set(scheduler.to_dict()) == {"fast", "new"}
+    assert scheduler.to_dict()["new"]["next_poll_in"] == 60
+
+
+def test_polling_scheduler_jitter_spreads_agents(clock: FakeClock):
+    policy = PollingPolicy(min_interval=60, max_interval=60, jitter=0.1)
+    next_polls = set()
+    for seed in range(20):
+        scheduler = PollingScheduler(policy, rng=random.Random(seed), clock=clock)
+        scheduler.sync(["repo"])
+        next_poll_in = scheduler.seconds_until_next_poll()
+        assert 54 <= next_poll_in <= 66
+        next_polls.add(next_poll_in)
+    assert len(next_polls) == 20
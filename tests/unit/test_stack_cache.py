@@ -0,0 +1,175 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+
+import os
+from asyncio import AbstractEventLoop
+from pathlib import Path
+from typing import Any
+
+import pytest
+from pytest import MonkeyPatch
+from pytest_mock import MockerFixture
+
+from simcore_service_deployment_agent import auto_deploy_task
+from simcore_service_deployment_agent.git_url_watcher import GitUrlWatcher
+from simcore_service_deployment_agent.stack_cache import (
+    RecipeFile,
+    StackBuildCache,
+    blob_id,
+    compute_stack_key,
+)
+from simcore_service_deployment_agent.subprocess_utils import run_command
+
+RECIPE = {
+    "files": [{"id": "ops", "paths": ["compose.yml"]}],
+    "workdir": "temp",
+    # as envsubst does
+    "command": 'sed "s/\\${TAG}/$TAG/" compose.yml > stack.yml',
+    "stack_file": "stack.yml",
+    "excluded_services": [],
+    "excluded_volumes": [],
+    "additional_parameters": {},
+    "services_prefix": "",
+}
+COMPOSE = "services:\n  web:\n    image: nginx:${TAG}\n"
+
+
+def test_stack_cache_drops_least_recently_used(tmp_path: Path):
+    cache = StackBuildCache(tmp_path / "stacks", max_entries=2)
+    assert cache.get("a") is None
+
+    cache.put("a", {"services": {"a": {}}})
+    cache.put("b", {"services": {"b": {}}})
+    # refreshes a
+    os.utime(cache.directory / "b.yaml", ns=(1, 1))
+    assert cache.get("a") == {"services": {"a": {}}}
+    cache.put("c", {"services": {"c": {}}})
+    assert cache.get("b") is None
+    assert cache.get("a")
+    assert cache.get("c")
+
+    # every entry is larger than the limit
+    cache.max_bytes = 10
+    cache.put("d", {"services": {"d": {}}})
+    assert not list(cache.directory.iterdir())
+
+    (cache.directory / "e.yaml").write_text("[not a stack")
+    assert cache.get("e") is None
+    assert not (cache.directory / "e.yaml").exists()
+
+
+def test_compute_stack_key(tmp_path: Path):
+    compose = tmp_path / "compose.yml"
+    compose.write_text(COMPOSE)
+    files = {"ops": {"compose.yml": RecipeFile(blob_id(compose), COMPOSE)}}
+    revisions = {"ops": "1" * 40, "simcore": "2" * 40}
+    environment = {"TAG": "1.0", "HOSTNAME": "abc"}
+    key = compute_stack_key(RECIPE, files, revisions, environment)
+
+    assert compute_stack_key(RECIPE, files, revisions, environment) == key
+    # variables the recipe does not refer to
+    assert compute_stack_key(RECIPE, files, revisions, {"TAG": "1.0"}) == key
+    assert (
+        compute_stack_key(
+            RECIPE, files, revisions, environment, extra_variables=["HOSTNAME"]
+        )
+        != key
+    )
+    assert compute_stack_key(RECIPE, files, revisions, {"TAG": "1.1"}) != key
+    assert (
+        compute_stack_key(RECIPE, files, {**revisions, "simcore": None}, environment)
+        != key
+    )
+    assert (
+        compute_stack_key(
+            {**RECIPE, "services_prefix": "prod"}, files, revisions, environment
+        )
+        != key
+    )
+    assert (
+        compute_stack_key(
+            {**RECIPE, "cache": {"directory": "/somewhere"}},
+            files,
+            revisions,
+            environment,
+        )
+        == key
+    )
+    compose.write_text(COMPOSE + "\n")
+    files = {"ops": {"compose.yml": RecipeFile(blob_id(compose), COMPOSE + "\n")}}
+    assert compute_stack_key(RECIPE, files, revisions, environment) != key
+    files = {"ops": {"compose.yml": RecipeFile(None)}}
+    assert compute_stack_key(RECIPE, files, revisions, environment) != key
+
+
+async def test_create_stack_reuses_cached_stack(
+    event_loop: AbstractEventLoop,
+    tmp_path: Path,
+    monkeypatch: MonkeyPatch,
+    mocker: MockerFixture,
+):
+    repo_path = tmp_path / "ops"
+    repo_path.mkdir()
+    (repo_path / "compose.yml").write_text(COMPOSE)
+    run_command(
+        "git init -b master; git config user.name tester;"
+        "git config user.email tester@test.com; git add .; git commit -m 'first'",
+        cwd=repo_path,
+    )
+    app_config: dict[str, Any] = {
+        "main": {
+            "synced_via_tags": False,
+            "watched_git_repositories": [
+                {
+                    "id": "ops",
+                    "url": f"file://localhost{repo_path}",
+                    "branch": "master",
+                    "tags": "",
+                    "paths": ["compose.yml"],
+                    "username": "",
+                    "password": "",
+                }
+            ],
+            "docker_stack_recipe": {
+                **RECIPE,
+                "cache": {"directory": f"{tmp_path / 'stacks'}"},
+            },
+        }
+    }
+    monkeypatch.setenv("TAG", "1.0")
+    git_watcher = GitUrlWatcher(app_config)
+    await git_watcher.init()
+    recipe_spy = mocker.spy(auto_deploy_task, "generate_stack_file")
+
+    stack_cfg = await auto_deploy_task.create_stack(git_watcher, app_config)
+    assert stack_cfg == {"services": {"web": {"image": "nginx:1.0"}}}
+    assert await auto_deploy_task.create_stack(git_watcher, app_config) == stack_cfg
+    assert recipe_spy.call_count == 1
+
+    # what is left in the working tree is not part of the key, only HEAD is
+    (repo,) = git_watcher.watched_repos
+    compose = Path(repo.directory) / "compose.yml"
+    compose.write_text("garbage")
+    resolve_spy = mocker.spy(git_watcher.git_backend, "resolve")
+    assert await auto_deploy_task.create_stack(git_watcher, app_config) == stack_cfg
+    assert recipe_spy.call_count == 1
+    assert "HEAD:compose.yml" in resolve_spy.call_args_list[0].args
+    compose.write_text(COMPOSE)
+
+    monkeypatch.setenv("TAG", "1.1")
+    stack_cfg = await auto_deploy_task.create_stack(git_watcher, app_config)
+    assert stack_cfg == {"services": {"web": {"image": "nginx:1.1"}}}
+    assert recipe_spy.call_count == 2
+
+    # a new revision of a watched repo
+    run_command("echo '# new' >> compose.yml; git commit -am 'second'", cwd=repo_path)
+    assert await git_watcher.check_for_changes()
+    await auto_deploy_task.create_stack(git_watcher, app_config)
+    assert recipe_spy.call_count == 3
+
+    await git_watcher.cleanup()
+
+
+@pytest.mark.parametrize("cache_config", [None, {}])
+def test_stack_cache_is_optional(cache_config: Any):
+    assert StackBuildCache.from_config(cache_config) is None
@@ -0,0 +1,96 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+
+from asyncio import AbstractEventLoop
+
+import pytest
+from pytest_mock import MockerFixture
+
+from simcore_service_deployment_agent import subprocess_utils
+from simcore_service_deployment_agent.exceptions import CmdLineError
+from simcore_service_deployment_agent.subprocess_metrics import (
+    SubprocessMetrics,
+    command_name,
+)
+
+
+@pytest.mark.parametrize(
+    "command, expected_name",
+    [
+        (["git", "-c", "protocol.version=2", "ls-remote", "--heads"], "git ls-remote"),
+        (["git", "--git-dir", ".", "bundle", "create"], "git bundle"),
+        (["git", "--no-pager", "log", "--oneline"], "git log"),
+        (["/usr/bin/git", "fetch", "origin"], "git fetch"),
+        (["git", "--version"], "git"),
+        (["sleep", "30"], "sleep"),
+        ("docker-compose config > stack.yml", "shell"),
+    ],
+)
+def test_command_name(command: list[str], expected_name: str):
+    assert command_name(command) == expected_name
+
+
+def test_metrics_per_cycle():
+    now = 0.0
+    metrics = SubprocessMetrics(clock=lambda: now)
+    metrics.record(["git", "clone"], 20, 0)
+
+    metrics.start_cycle()
+    metrics.record(["git", "fetch"], 0.2, 0, output_bytes=10)
+    metrics.record(["git", "fetch"], 3, 128)
+    metrics.record("recipe", 70, 0)
+    now += 100
+    metrics.end_cycle()
+
+    data = metrics.to_dict()
+    assert data["current_cycle"] is None
+    assert metrics.last_cycle
+    last_cycle = metrics.last_cycle.to_dict()
+    assert data["last_cycle"] == last_cycle
+    assert last_cycle["number"] == 1
+    assert last_cycle["duration"] == 100
+    assert last_cycle["commands_duration"] == pytest.approx(73.2)
+    assert list(last_cycle["commands"]) == ["git fetch", "shell"]
+    fetch = last_cycle["commands"]["git fetch"]
+    assert fetch["count"] == 2
+    assert fetch["failures"] == 1
+    assert fetch["max_duration"] == 3
+    assert fetch["output_bytes"] == 10
+    assert fetch["histogram"]["0.5"] == 1
+    assert fetch["histogram"]["5"] == 1
+    assert sum(fetch["histogram"].values()) == 2
+    assert last_cycle["commands"]["shell"]["histogram"]["+Inf"] == 1
+    # outside of any cycle, only in the totals
+    assert data["total"]["git clone"]["count"] == 1
+
+    metrics.start_cycle()
+    assert metrics.current_cycle
+    assert metrics.current_cycle.number == 2
+
+
+async def test_commands_are_recorded(
+    event_loop: AbstractEventLoop, mocker: MockerFixture
+):
+    metrics = SubprocessMetrics()
+    mocker.patch.object(subprocess_utils, "metrics", metrics)
+    metrics.start_cycle()
+
+    await subprocess_utils.exec_command_async(["echo", "hello"])
+    with pytest.raises(CmdLineError):
+        await subprocess_utils.shell_command_async("exit 1")
+    with pytest.raises(CmdLineError):
+        await subprocess_utils.exec_command_async(["not_a_command"])
+    async with subprocess_utils.stream_command_lines(["seq", "3"]) as lines:
+        assert [line async for line in lines] == ["1", "2", "3"]
+
+    assert metrics.current_cycle
+    commands = metrics.current_cycle.to_dict()["commands"]
+    assert {
+        name: (stats["count"], stats["failures"], stats["output_bytes"])
+        for name, stats in commands.items()
+    } == {
+        "echo": (1, 0, len("hello\n")),
+        "shell": (1, 1, 0),
+        "not_a_command": (1, 1, 0),
+        "seq": (1, 0, len("1\n2\n3\n")),
+    }
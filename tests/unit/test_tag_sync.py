@@ -0,0 +1,95 @@
+# pylint: disable=redefined-outer-name
+
+from pytest_mock import MockerFixture
+
+from simcore_service_deployment_agent.git_refs import RefSnapshot, TagIndex
+from simcore_service_deployment_agent.tag_sync import TagSyncResolver
+
+SHA_1 = "1" * 40
+SHA_2 = "2" * 40
+
+
+def _snapshot(*tags: tuple[str, str, int]) -> RefSnapshot:
+    return RefSnapshot.from_for_each_ref(
+        "\n".join(
+            "\t".join([f"refs/tags/{tag}", sha, "", sha[:7], "", f"{creatordate}", ""])
+            for tag, sha, creatordate in tags
+        )
+    )
+
+
+def _repo(
+    repo_id: str, regexp: str, snapshot: RefSnapshot
+) -> tuple[str, RefSnapshot, TagIndex]:
+    return repo_id, snapshot, TagIndex(regexp).update(snapshot)
+
+
+def test_tag_sync_intersects_release_names():
+    resolver = TagSyncResolver()
+    status = resolver.resolve(
+        [
+            _repo(
+                "simcore",
+                "^(staging_.+)$",
+                _snapshot(("staging_1", SHA_1, 1), ("staging_2", SHA_2, 2)),
+            ),
+            _repo(
+                "ops",
+                "^test(staging_.+)$",
+                _snapshot(
+                    ("teststaging_1", SHA_1, 1),
+                    ("teststaging_2", SHA_2, 2),
+                    ("teststaging_2bis", SHA_2, 2),
+                ),
+            ),
+            # no matching tag: does not take part
+            _repo("other", "^production_", _snapshot(("staging_2", SHA_2, 2))),
+        ]
+    )
+    assert status.in_sync
+    assert status.common_release_names == {"staging_2"}
+    assert status.release_names == {
+        "simcore": {"staging_2"},
+        "ops": {"staging_2", "staging_2bis"},
+    }
+    assert status.blocking_repo_ids == ()
+
+
+def test_tag_sync_reports_blocking_repos():
+    # staging_1 is a substring of staging_10 and of teststaging_1 but not the same
+    status = TagSyncResolver().resolve(
+        [
+            _repo("simcore", "^staging_", _snapshot(("staging_10", SHA_2, 3))),
+            _repo("ops", "^staging_", _snapshot(("staging_1", SHA_1, 1))),
+            _repo("webserver", "^test", _snapshot(("teststaging_1", SHA_1, 2))),
+            _repo("storage", "^staging_", _snapshot(("staging_10", SHA_2, 2))),
+        ]
+    )
+    assert not status.in_sync
+    assert status.blocking_repo_ids == ("ops", "webserver")
+
+    assert not TagSyncResolver().resolve([]).in_sync
+
+
+def test_tag_sync_is_cached_until_a_snapshot_changes(mocker: MockerFixture):
+    resolver = TagSyncResolver()
+    repos = [
+        _repo("simcore", "^staging_", _snapshot(("staging_1", SHA_1, 1))),
+        _repo("ops", "^staging_", _snapshot(("staging_1", SHA_1, 1))),
+    ]
+    release_names_spy = mocker.spy(TagIndex, "release_names_on_sha")
+
+    status = resolver.resolve(repos)
+    assert status.in_sync
+    assert release_names_spy.call_count == 2
+    assert resolver.resolve(repos) is status
+    assert release_names_spy.call_count == 2
+
+    # a new tag in one repo
+    repo_id, _, tag_index = repos[1]
+    snapshot = _snapshot(("staging_1", SHA_1, 1), ("staging_2", SHA_2, 2))
+    repos[1] = (repo_id, snapshot, tag_index.update(snapshot))
+    status = resolver.resolve(repos)
+    assert not status.in_sync
+    assert status.blocking_repo_ids == ("simcore",)
+    assert release_names_spy.call_count == 4